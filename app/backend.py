@@ -7,8 +7,11 @@ from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import openai
 
+from app.index_store import current_generation_path
+
 # ---- Settings ----
-DB_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "chroma_db"))
+# Full ingestions write generations under chroma_db/generations; search the one CURRENT points at
+DB_PATH = current_generation_path(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "chroma_db")))
 EMBED_MODEL = 'all-MiniLM-L6-v2'
 OPENAI_MODEL = "gpt-3.5-turbo"  # Or "gpt-4" if you have access
 
@@ -0,0 +1,57 @@
+"""Model cascade: answer with a small model first, escalate to the large one.
+
+`generate_answer` sends a question to the small tier when retrieval is
+confident, then checks the draft without another model call. A draft that was
+cut off, declines to answer, is too short to be an answer, or quotes figures
+that appear nowhere in the context or the question is discarded, and the
+large tier answers instead. Questions whose retrieval confidence is already low
+go straight to the large tier, so a doomed small call costs no latency.
+
+    reason = check_draft(answer, finish_reason, context)  # None, or why the draft is rejected
+"""
+import re
+from typing import Optional, Set
+
+SMALL_TIER = "small"
+LARGE_TIER = "large"
+
+MIN_ANSWER_CHARS = 50  # Shorter drafts are not answers, whatever they say
+
+# Phrases a model uses when the context does not answer the question (for it)
+_REFUSAL_RE = re.compile(
+    r"\b(?:(?:do not|don't|does not|doesn't) (?:have|contain|include|provide|mention)"
+    r"(?: (?:enough|sufficient|any|specific))? (?:information|details|data)"
+    r"|(?:not|isn't|is not) (?:provided|mentioned|available|specified|included) in the (?:provided )?context"
+    r"|(?:cannot|can't|unable to) (?:answer|determine|find|provide))\b",
+    re.IGNORECASE)
+# Figures worth grounding: two or more digits, or any number with a currency, percent or decimal part
+_FIGURE_RE = re.compile(r"(?<![\w.])(?:[$€£]\s?)?(\d[\d,]*(?:\.\d+)?)\s?(%|[kKmMbB]\b)?")
+
+
+def _figures(text: str) -> Set[str]:
+    figures = set()
+    for match in _FIGURE_RE.finditer(text):
+        number = match.group(1).replace(",", "")
+        if "." in number:
+            number = number.rstrip("0").rstrip(".")
+        if len(number.replace(".", "")) >= 2 or match.group(2) or "." in number or match.group(0)[0] in "$€£":
+            figures.add(number)
+    return figures
+
+
+def ungrounded_figures(answer: str, context: str) -> Set[str]:
+    """Figures quoted in an answer that appear nowhere in its context"""
+    return _figures(answer) - _figures(context)
+
+
+def check_draft(answer: str, finish_reason: Optional[str], context: str) -> Optional[str]:
+    """Why a small-tier draft should be escalated, or None when it passes"""
+    if finish_reason == "length":
+        return "truncated"
+    if len(answer) < MIN_ANSWER_CHARS:
+        return "too_short"
+    if _REFUSAL_RE.search(answer):
+        return "refusal"
+    if ungrounded_figures(answer, context):
+        return "ungrounded_figures"
+    return None
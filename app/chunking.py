@@ -0,0 +1,258 @@
+"""Structure-aware Markdown chunking.
+
+`chunk_markdown_structured` parses a document into blocks (headings,
+paragraphs, lists, tables, code fences) and packs whole blocks into chunks of
+at most `max_tokens` tokens under the heading they belong to. A table or list
+is only split when it alone exceeds the budget, and then between rows or
+items, with the table header repeated in every piece. Each chunk carries its
+heading path ("Quarterly Report > Q1 - January to March 2024 > Cash Flow
+Analysis"), which is also the first line of the chunk text so the embedding
+sees the context a bare table row or bullet lacks.
+
+The parser is a small line-based one covering what the data/ documents use
+(ATX and setext headings, pipe tables, nested lists, fences); it is not a full
+CommonMark implementation.
+"""
+import re
+from typing import List, NamedTuple, Tuple
+
+MAX_TOKENS = 200  # About the 1000 characters generate_answer places per document
+CHILD_TOKENS = 64  # Child chunks of the parent-child index
+HEADING_SEPARATOR = " > "
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+_ATX_RE = re.compile(r"^\s{0,3}(#{1,6})\s+(.*?)\s*#*\s*$")
+_SETEXT_RE = re.compile(r"^\s{0,3}(=+|-+)\s*$")
+_BREAK_RE = re.compile(r"^\s{0,3}([-*_])(\s*\1){2,}\s*$")
+_FENCE_RE = re.compile(r"^\s*(```|~~~)")
+_ITEM_RE = re.compile(r"^(\s*)([-*+]|\d+[.)])\s+")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def count_tokens(text: str) -> int:
+    """Approximate model tokens: words and punctuation marks, without needing a tokenizer package"""
+    return len(_TOKEN_RE.findall(text))
+
+
+class MarkdownBlock(NamedTuple):
+    kind: str  # heading, paragraph, list, table, code
+    text: str
+    level: int = 0  # Heading level
+
+
+def _indent(line: str) -> int:
+    return len(line) - len(line.lstrip(" "))
+
+
+def _starts_block(lines: List[str], i: int) -> bool:
+    line = lines[i]
+    return bool(_ATX_RE.match(line) or _FENCE_RE.match(line) or _ITEM_RE.match(line)
+                or line.lstrip().startswith("|") or _BREAK_RE.match(line))
+
+
+def _is_setext_heading(lines: List[str], i: int) -> bool:
+    return (i + 1 < len(lines) and lines[i].strip() != "" and not _starts_block(lines, i)
+            and bool(_SETEXT_RE.match(lines[i + 1])))
+
+
+def parse_blocks(text: str) -> List[MarkdownBlock]:
+    lines = text.splitlines()
+    blocks = []
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if not line.strip():
+            i += 1
+            continue
+
+        fence = _FENCE_RE.match(line)
+        if fence:
+            end = i + 1
+            while end < len(lines) and not lines[end].strip().startswith(fence.group(1)):
+                end += 1
+            blocks.append(MarkdownBlock("code", "\n".join(lines[i:end + 1])))
+            i = end + 1
+            continue
+
+        heading = _ATX_RE.match(line)
+        if heading:
+            blocks.append(MarkdownBlock("heading", heading.group(2).strip(), len(heading.group(1))))
+            i += 1
+            continue
+
+        if _is_setext_heading(lines, i):
+            level = 1 if lines[i + 1].strip().startswith("=") else 2
+            blocks.append(MarkdownBlock("heading", line.strip().rstrip(":"), level))
+            i += 2
+            continue
+
+        if _BREAK_RE.match(line):
+            i += 1
+            continue
+
+        if line.lstrip().startswith("|"):
+            end = i
+            while end < len(lines) and lines[end].lstrip().startswith("|"):
+                end += 1
+            blocks.append(MarkdownBlock("table", "\n".join(lines[i:end])))
+            i = end
+            continue
+
+        item = _ITEM_RE.match(line)
+        if item:
+            base = _indent(line)
+            end = i + 1
+            while end < len(lines):
+                current = lines[end]
+                if current.strip():
+                    # Items at the list's own indent, or anything indented under an item, belong to the list
+                    if _indent(current) > base or (_ITEM_RE.match(current) and _indent(current) == base):
+                        end += 1
+                        continue
+                    break
+                # A blank line continues the list only if the list resumes after it
+                following = end + 1
+                while following < len(lines) and not lines[following].strip():
+                    following += 1
+                if following < len(lines) and (_indent(lines[following]) > base or (
+                        _ITEM_RE.match(lines[following]) and _indent(lines[following]) == base)):
+                    end = following
+                    continue
+                break
+            blocks.append(MarkdownBlock("list", "\n".join(lines[i:end]).rstrip()))
+            i = end
+            continue
+
+        end = i + 1
+        while end < len(lines) and lines[end].strip() and not _starts_block(lines, end) \
+                and not _is_setext_heading(lines, end) and not _SETEXT_RE.match(lines[end]):
+            end += 1
+        blocks.append(MarkdownBlock("paragraph", " ".join(l.strip() for l in lines[i:end])))
+        i = end
+    return blocks
+
+
+def _pack(pieces: List[str], max_tokens: int, joiner: str = "\n\n", prefix: str = "") -> List[str]:
+    """Greedily join pieces into strings of at most max_tokens (a single oversized piece stays whole)"""
+    packed, current, size = [], [], count_tokens(prefix)
+    base = size
+    for piece in pieces:
+        tokens = count_tokens(piece)
+        if current and size + tokens > max_tokens:
+            packed.append(prefix + joiner.join(current))
+            current, size = [], base
+        current.append(piece)
+        size += tokens
+    if current:
+        packed.append(prefix + joiner.join(current))
+    return packed
+
+
+def _split_block(block: MarkdownBlock, max_tokens: int) -> List[str]:
+    """Split a block that exceeds the budget at its natural boundaries"""
+    if block.kind == "table":
+        rows = block.text.split("\n")
+        # Repeat the header and its separator row in every piece
+        has_header = len(rows) > 2 and re.match(r"^\s*\|?[\s:|-]+\|?\s*$", rows[1])
+        header, body = (rows[:2], rows[2:]) if has_header else ([], rows)
+        prefix = "\n".join(header) + "\n" if header else ""
+        return _pack(body, max_tokens, joiner="\n", prefix=prefix)
+    if block.kind == "list":
+        lines = block.text.split("\n")
+        base = _indent(lines[0])
+        items: List[List[str]] = []
+        for line in lines:
+            if _ITEM_RE.match(line) and _indent(line) == base or not items:
+                items.append([line])
+            else:
+                items[-1].append(line)
+        pieces = []
+        for item in items:
+            text = "\n".join(item).rstrip()
+            pieces.extend(_split_text(text, max_tokens) if count_tokens(text) > max_tokens else [text])
+        return _pack(pieces, max_tokens, joiner="\n")
+    return _split_text(block.text, max_tokens)
+
+
+def _split_text(text: str, max_tokens: int) -> List[str]:
+    return _pack(_SENTENCE_RE.split(text), max_tokens, joiner=" ")
+
+
+def _fit(blocks: List[MarkdownBlock], max_tokens: int) -> List[MarkdownBlock]:
+    """Split every block over the budget into pieces of the same kind"""
+    fitted = []
+    for block in blocks:
+        if count_tokens(block.text) > max_tokens:
+            fitted.extend(MarkdownBlock(block.kind, piece) for piece in _split_block(block, max_tokens))
+        else:
+            fitted.append(block)
+    return fitted
+
+
+def _sections(content: str) -> List[Tuple[str, List[MarkdownBlock]]]:
+    """Group the document's blocks under their heading path"""
+    sections: List[Tuple[str, List[MarkdownBlock]]] = []
+    path: List[Tuple[int, str]] = []
+    blocks: List[MarkdownBlock] = []
+
+    def close_section():
+        if blocks:
+            sections.append((HEADING_SEPARATOR.join(title for _, title in path), list(blocks)))
+            blocks.clear()
+
+    for block in parse_blocks(content):
+        if block.kind == "heading":
+            close_section()
+            while path and path[-1][0] >= block.level:
+                path.pop()
+            path.append((block.level, block.text))
+        else:
+            blocks.append(block)
+    close_section()
+    return sections
+
+
+def _budget(max_tokens: int, heading_path: str) -> int:
+    # The heading path is repeated in every chunk, but never takes more than half the budget
+    return max(max_tokens - count_tokens(heading_path), max_tokens // 2)
+
+
+def _chunks(heading_path: str, blocks: List[MarkdownBlock], max_tokens: int) -> List[str]:
+    budget = _budget(max_tokens, heading_path)
+    bodies = _pack([block.text for block in _fit(blocks, budget)], budget)
+    return [f"{heading_path}\n\n{body}" if heading_path else body for body in bodies]
+
+
+def chunk_markdown_structured(content: str, max_tokens: int = MAX_TOKENS) -> List[Tuple[str, str]]:
+    """Chunk Markdown by structure; returns (chunk text, heading path) pairs"""
+    return [(chunk, heading_path) for heading_path, blocks in _sections(content)
+            for chunk in _chunks(heading_path, blocks, max_tokens)]
+
+
+def chunk_markdown_parents(content: str, parent_tokens: int = MAX_TOKENS,
+                           child_tokens: int = CHILD_TOKENS) -> List[Tuple[str, str, List[str]]]:
+    """Two-level chunks: (parent text, heading path, child texts) for every parent.
+
+    Parents are the chunks `chunk_markdown_structured` produces; each is cut
+    again at `child_tokens` with the same rules, so a child never spans two
+    parents and still starts with its heading path.
+    """
+    parents = []
+    for heading_path, blocks in _sections(content):
+        budget = _budget(parent_tokens, heading_path)
+        fitted = _fit(blocks, budget)
+        # Group the fitted blocks exactly as _pack groups their texts, so children map onto parents
+        groups: List[List[MarkdownBlock]] = []
+        size = 0
+        for block in fitted:
+            tokens = count_tokens(block.text)
+            if groups and size + tokens <= budget:
+                groups[-1].append(block)
+                size += tokens
+            else:
+                groups.append([block])
+                size = tokens
+        for group in groups:
+            parent = _chunks(heading_path, group, parent_tokens)[0]
+            parents.append((parent, heading_path, _chunks(heading_path, group, child_tokens)))
+    return parents
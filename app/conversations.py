@@ -0,0 +1,160 @@
+"""Server-side conversations with bounded history.
+
+A follow-up such as "and for Q3?" means nothing to retrieval on its own, so
+each turn is first rewritten into a standalone question. `rewrite_followup`
+does that with rules: a follow-up that only names another period or region
+takes the previous standalone question and swaps the period or region in.
+Anything the rules cannot resolve is left to a small model by the caller.
+
+History sent with a turn stays bounded however long the conversation gets:
+the last `recent_turns` turns are kept verbatim (answers cut to an excerpt),
+and older turns survive only as their standalone questions, oldest dropped
+first once the summary exceeds `summary_chars`.
+
+    conversation = store.get_or_create(username, conversation_id)
+    standalone, method = rewrite_followup(question, conversation)  # method None: ask a model
+    ...
+    conversation.add_turn(question, standalone, answer)
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional, Tuple
+
+from app.periods import ENTITIES, question_periods
+
+ANSWER_EXCERPT_CHARS = 400  # Of each recent answer kept verbatim
+SUMMARY_CHARS = 600  # Budget for the questions of older turns
+
+# Openings and pronouns that make a question lean on the previous turn
+_FOLLOWUP_RE = re.compile(
+    r"^\s*(?:and|also|but|or|what about|how about|same for|compared (?:to|with)|versus|vs\.?)\b", re.IGNORECASE)
+# Words that refer back to the previous turn. "IT" is the department, "there is" and "this year" are not references.
+_ANAPHORA_RE = re.compile(r"\b(?:[Ii]ts?|[Tt]hey|[Tt]hem|[Tt]heir|[Ss]ame"
+                          r"|(?:[Tt]hat|[Tt]his|[Tt]hose|[Tt]hese)(?!\s+(?:year|quarter|month|week)\b))\b")
+_LEAD_RE = re.compile(r"^\s*(?:and|also|but|or|what about|how about|same for)\s+(?:for|in|on|the)?\s*",
+                      re.IGNORECASE)
+_QUARTER_TOKEN_RE = re.compile(r"\b(?:Q[1-4]|(?:first|second|third|fourth)\s+quarter)\b", re.IGNORECASE)
+_YEAR_TOKEN_RE = re.compile(r"\b20\d{2}\b")
+_ENTITY_TOKEN_RE = re.compile(r"\b(" + "|".join(re.escape(entity) for entity in ENTITIES) + r")\b", re.IGNORECASE)
+# Words a period-only follow-up may still contain ("and for Q3 then?", "what about the same quarter in 2023")
+_FILLER = {"then", "please", "instead", "year", "quarter", "period", "region", "same"}
+
+
+class Turn(NamedTuple):
+    question: str
+    standalone: str
+    answer: str
+
+
+class Conversation:
+    def __init__(self, conversation_id: str, username: str, recent_turns: int = 2,
+                 summary_chars: int = SUMMARY_CHARS):
+        self.id = conversation_id
+        self.username = username
+        self.recent_turns = recent_turns
+        self.summary_chars = summary_chars
+        self.turns: List[Turn] = []  # The most recent turns, verbatim
+        self.earlier: List[str] = []  # Standalone questions of older turns
+        self.turn_count = 0
+        self.lock = threading.Lock()  # Serialises turns of one conversation
+
+    @property
+    def last_standalone(self) -> Optional[str]:
+        return self.turns[-1].standalone if self.turns else None
+
+    def add_turn(self, question: str, standalone: str, answer: str):
+        self.turns.append(Turn(question, standalone, answer[:ANSWER_EXCERPT_CHARS]))
+        self.turn_count += 1
+        while len(self.turns) > self.recent_turns:
+            self.earlier.append(self.turns.pop(0).standalone)
+        while self.earlier and sum(len(q) + 3 for q in self.earlier) > self.summary_chars:
+            self.earlier.pop(0)
+
+    def history_text(self) -> str:
+        """The history that goes into prompts; its size does not grow with the conversation"""
+        parts = []
+        if self.earlier:
+            parts.append("Earlier questions: " + "; ".join(self.earlier))
+        for turn in self.turns:
+            parts.append(f"User: {turn.question}\nAssistant: {turn.answer}")
+        return "\n\n".join(parts)
+
+
+class ConversationStore:
+    """Conversations by (username, id); idle ones expire after `ttl` and the least recent go past `max_entries`"""
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 1800.0, recent_turns: int = 2):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.recent_turns = recent_turns
+        self._entries: "OrderedDict[tuple, tuple[float, Conversation]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_create(self, username: str, conversation_id: str) -> Conversation:
+        key = (username, conversation_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            conversation = entry[1] if entry is not None and entry[0] > now else None
+            if conversation is None:
+                conversation = Conversation(conversation_id, username, self.recent_turns)
+            self._entries[key] = (now + self.ttl, conversation)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return conversation
+
+    def delete(self, username: str, conversation_id: str) -> bool:
+        with self._lock:
+            return self._entries.pop((username, conversation_id), None) is not None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def _content_words(question: str) -> List[str]:
+    """Words of a question other than its lead-in, periods, regions and filler"""
+    remainder = _LEAD_RE.sub("", question)
+    for pattern in (_ENTITY_TOKEN_RE, _YEAR_TOKEN_RE, _QUARTER_TOKEN_RE):
+        remainder = pattern.sub("", remainder)
+    return [word for word in re.findall(r"[a-z]{4,}", remainder.lower()) if word not in _FILLER]
+
+
+def is_followup(question: str) -> bool:
+    """Whether a question leans on the previous turn: it opens like a follow-up ("and for Q3?"), names nothing
+    but a period or region, or is short and refers back ("what drove that?")"""
+    if _FOLLOWUP_RE.search(question) or not _content_words(question):
+        return True
+    return len(question.split()) <= 8 and bool(_ANAPHORA_RE.search(question))
+
+
+def _swap(pattern, previous: str, replacement: str) -> str:
+    """The previous question with its first period or region replaced, or the new one appended"""
+    if pattern.search(previous):
+        return pattern.sub(replacement, previous, count=1)
+    return f"{previous.rstrip(' ?.')} in {replacement}?"
+
+
+def rewrite_followup(question: str, conversation: Optional[Conversation]) -> Tuple[str, Optional[str]]:
+    """A standalone version of `question` and how it was made: "none" (already standalone), "rules", or
+    None when the rules cannot resolve it and a model should"""
+    previous = conversation.last_standalone if conversation else None
+    if previous is None or not is_followup(question):
+        return question, "none"
+
+    years, quarters = question_periods(question)
+    entities = [match.group(1) for match in _ENTITY_TOKEN_RE.finditer(question)]
+    # Only a new period or region, and nothing else the previous question lacks
+    if not (years or quarters or entities) or _content_words(question):
+        return question, None
+
+    standalone = previous
+    if quarters:
+        standalone = _swap(_QUARTER_TOKEN_RE, standalone, " and ".join(f"Q{q}" for q in sorted(quarters)))
+    if years:
+        standalone = _swap(_YEAR_TOKEN_RE, standalone, " and ".join(str(y) for y in sorted(years)))
+    if entities:
+        standalone = _swap(_ENTITY_TOKEN_RE, standalone, " and ".join(entities))
+    return standalone, "rules"
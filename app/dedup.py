@@ -0,0 +1,106 @@
+"""Exact and near-duplicate detection for chunks.
+
+Chunks are compared as sets of word shingles. Exact duplicates (after
+whitespace and case folding) are caught by a content hash; near duplicates
+by MinHash signatures bucketed with locality-sensitive hashing, then
+confirmed on the estimated Jaccard similarity. Financial text repeats its
+wording from period to period, so a near duplicate must also quote the same
+figures ("$2.1 billion, up 12%" is not "$2.6 billion, up 19%"), and, when
+`groups` are given, belong to the same group (e.g. the same fiscal periods).
+Everything is seeded and built on stable hashes, so two ingestions of the same
+files make the same choices.
+
+    keep = find_duplicates(texts)  # keep[i] is None, or the index of the chunk i duplicates
+"""
+import hashlib
+import random
+import re
+import struct
+from typing import Dict, Hashable, List, Optional, Sequence
+
+SHINGLE_WORDS = 5
+NUM_PERMUTATIONS = 64
+BANDS = 16  # 16 bands of 4 rows: pairs above ~0.5 Jaccard share a bucket with high probability
+DEFAULT_THRESHOLD = 0.9  # Estimated Jaccard similarity that counts as a near duplicate
+
+_MERSENNE = (1 << 61) - 1
+_WORD_RE = re.compile(r"\w+")
+_NUMBER_RE = re.compile(r"\d[\d,]*(?:\.\d+)?")
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def shingles(text: str, size: int = SHINGLE_WORDS) -> set:
+    words = _WORD_RE.findall(text.lower())
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def figures(text: str) -> frozenset:
+    """The numbers a text quotes, with thousands separators dropped"""
+    return frozenset(number.replace(",", "") for number in _NUMBER_RE.findall(text))
+
+
+def _stable_hash(value: str) -> int:
+    # Python's hash() is salted per process; blake2b keeps signatures comparable across runs
+    return struct.unpack("<Q", hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest())[0]
+
+
+class MinHasher:
+    def __init__(self, num_permutations: int = NUM_PERMUTATIONS, seed: int = 1):
+        rng = random.Random(seed)
+        self._params = [(rng.randrange(1, _MERSENNE), rng.randrange(0, _MERSENNE))
+                        for _ in range(num_permutations)]
+
+    def signature(self, text: str) -> List[int]:
+        hashes = [_stable_hash(shingle) for shingle in shingles(text)] or [0]
+        return [min((a * h + b) % _MERSENNE for h in hashes) for a, b in self._params]
+
+    @staticmethod
+    def similarity(first: Sequence[int], second: Sequence[int]) -> float:
+        """Estimated Jaccard similarity of the shingle sets"""
+        return sum(1 for x, y in zip(first, second) if x == y) / len(first)
+
+
+def find_duplicates(texts: List[str], threshold: float = DEFAULT_THRESHOLD,
+                    hasher: Optional[MinHasher] = None, groups: Optional[Sequence[Hashable]] = None
+                    ) -> List[Optional[int]]:
+    """For every text, the index of an earlier text it duplicates, or None to keep it.
+
+    Exact duplicates always match. Near duplicates must also quote the same figures and, with `groups`,
+    share a group.
+    """
+    hasher = hasher or MinHasher()
+    rows = NUM_PERMUTATIONS // BANDS
+    exact: Dict[str, int] = {}
+    buckets: Dict[tuple, List[int]] = {}
+    signatures: Dict[int, List[int]] = {}
+    result: List[Optional[int]] = []
+
+    for i, text in enumerate(texts):
+        digest = hashlib.sha1(normalize(text).encode("utf-8")).hexdigest()
+        if digest in exact:
+            result.append(exact[digest])
+            continue
+
+        signature = hasher.signature(text)
+        keys = [(band, tuple(signature[band * rows:(band + 1) * rows])) for band in range(BANDS)]
+        # Compare only against kept texts that share a bucket, so this stays close to linear
+        candidates = {j for key in keys for j in buckets.get(key, ())}
+        match = None
+        for j in sorted(candidates):
+            if groups is not None and groups[i] != groups[j]:
+                continue
+            if hasher.similarity(signature, signatures[j]) >= threshold and figures(text) == figures(texts[j]):
+                match = j
+                break
+        result.append(match)
+        if match is None:
+            exact[digest] = i
+            signatures[i] = signature
+            for key in keys:
+                buckets.setdefault(key, []).append(i)
+    return result
@@ -0,0 +1,69 @@
+"""Query expansion: search with rephrasings of a weakly answered question.
+
+A short or vague question ("leave rules?", "Q3 numbers") often embeds far
+from the chunks that answer it. The `multi_query` and `hyde` retrieval modes
+search like `fixed` first and, only when no hit is confident, ask a small
+model for more to search with: several rephrasings of the question
+(`multi_query`), or a short passage that could answer it (`hyde`, hypothetical
+document embeddings). Every text is embedded in one call and searched
+alongside the question, and the rankings are merged with reciprocal rank
+fusion, so a chunk that several searches find near the top wins over one a
+single search scores highly.
+
+    texts = parse_expansions(completion, MULTI_QUERY)  # from the model's reply to expansion_prompt()
+    fused = reciprocal_rank_fusion([question_hits] + expansion_hits)
+"""
+import re
+from typing import Dict, List
+
+MULTI_QUERY = "multi_query"
+HYDE = "hyde"
+
+RRF_K = 60  # Damps the weight of top ranks; 60 is the value from the original RRF paper
+
+_INSTRUCTIONS = {
+    MULTI_QUERY: ("Write {n} different search queries for finding the company documents that answer the user's "
+                  "question. Use other words than the question, spell out abbreviations and name the metric, "
+                  "period or policy it is about. Reply with one query per line and nothing else."),
+    HYDE: ("Write a short passage, as it would appear in a FinSolve Technologies report, handbook or policy, "
+           "that answers the user's question. Invent plausible figures where needed. Reply with the passage only."),
+}
+_LIST_MARKER_RE = re.compile(r"^\s*(?:[-*+•]|\d+[.)])\s*")
+
+
+def expansion_prompt(question: str, method: str, n: int) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": _INSTRUCTIONS[method].format(n=n)},
+        {"role": "user", "content": question}
+    ]
+
+
+def parse_expansions(reply: str, method: str, n: int = 3) -> List[str]:
+    """The texts to search with from the model's reply: up to `n` queries, or the one passage"""
+    reply = reply.strip()
+    if method == HYDE:
+        return [reply] if reply else []
+    queries = []
+    for line in reply.splitlines():
+        line = _LIST_MARKER_RE.sub("", line).strip().strip('"')
+        if line and line.lower() not in (query.lower() for query in queries):
+            queries.append(line)
+    return queries[:n]
+
+
+def reciprocal_rank_fusion(rankings: List[List[Dict]], k: int = RRF_K) -> List[Dict]:
+    """Hits of several ranked lists merged by the sum of 1 / (k + rank), each chunk once.
+
+    A chunk keeps the highest similarity any search gave it, and its fused score as `rrf_score`.
+    """
+    fused: Dict[tuple, Dict] = {}
+    for ranking in rankings:
+        for rank, hit in enumerate(ranking, start=1):
+            key = (hit["source"], hit["content"])
+            entry = fused.get(key)
+            if entry is None:
+                entry = fused[key] = dict(hit, rrf_score=0.0)
+            elif hit["similarity_score"] > entry["similarity_score"]:
+                entry.update(hit, rrf_score=entry["rrf_score"])
+            entry["rrf_score"] += 1 / (k + rank)
+    return sorted(fused.values(), key=lambda hit: hit["rrf_score"], reverse=True)
@@ -0,0 +1,205 @@
+"""Extractive answers: quote the span of the top chunk that answers a question.
+
+Handbook lookups ("how many days of sick leave do I get") are answered
+verbatim by one chunk. For a question asking for one figure (`is_lookup`)
+whose top hit is confident enough, `generate_answer` asks an extractor for the answering span and returns it highlighted in its
+sentence or table row, with the source, without a chat completion.
+
+`TransformersExtractor` runs a local extractive question-answering model
+(`transformers` is in requirements.txt). `warm()` downloads and loads it, which
+the API does on a background thread at startup; the extractor is not `ready`
+until then. Without it, `LexicalExtractor` picks the sentence, list item or table row that
+covers most of the question's content words, and is confident only when
+one unit clearly covers more than any other.
+
+    extractor = load_extractor(model_name)
+    threading.Thread(target=extractor.warm, daemon=True).start()  # at startup
+    extraction = extractor(question, context) if extractor.ready else None
+    if extraction and extraction.score >= min_score:
+        answer = extraction.highlighted()
+"""
+import importlib.util
+import logging
+import re
+import threading
+from typing import List, NamedTuple, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+EXTRACTIVE_TIER = "extractive"
+DEFAULT_MODEL = "distilbert-base-cased-distilled-squad"
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9])")
+_QUANTITY_RE = re.compile(r"\b(?:how (?:many|much|long|often)|what (?:percentage|percent|amount|number))\b",
+                          re.IGNORECASE)
+_STOPWORDS = {
+    "a", "about", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "get", "has",
+    "have", "how", "i", "in", "is", "it", "long", "many", "me", "much", "my", "of", "often", "on", "or", "our",
+    "the", "there", "to", "was", "we", "were", "what", "when", "where", "which", "who", "why", "will", "with",
+    "you", "your",
+    # Every handbook passage is about these
+    "company", "employee", "employees", "finsolve",
+}
+
+
+class Extraction(NamedTuple):
+    answer: str
+    score: float  # 0..1 confidence that `answer` answers the question
+    passage: str  # The sentence or table row the answer was found in
+    start: int  # Offsets of `answer` within `passage`
+    end: int
+
+    def highlighted(self) -> str:
+        """The passage with the answer in bold"""
+        if self.start == 0 and self.end == len(self.passage):
+            return f"**{self.passage}**"
+        return f"{self.passage[:self.start]}**{self.answer}**{self.passage[self.end:]}"
+
+
+_SEPARATOR = object()
+
+
+def _clean(line: str):
+    """Markdown emphasis and table pipes removed; a two-cell row reads "Key: value" """
+    line = line.replace("**", "").replace("__", "").strip()
+    if line.startswith("|"):
+        cells = [cell.strip() for cell in line.strip("|").split("|")]
+        if all(set(cell) <= set("-: ") for cell in cells):
+            return _SEPARATOR
+        return ": ".join(cells) if len(cells) == 2 else "; ".join(cells)
+    return re.sub(r"^(?:[-*+]|\d+\.|#+)\s+", "", line)
+
+
+def passages(text: str) -> List[str]:
+    """Sentences, list items and table rows of a chunk, cleaned of Markdown; table headers are left out"""
+    units = []
+    for line in text.splitlines():
+        line = _clean(line)
+        if line is _SEPARATOR:
+            if units:
+                units.pop()
+        elif line:
+            units.extend(part for part in _SENTENCE_RE.split(line) if part)
+    return units
+
+
+def is_lookup(question: str) -> bool:
+    """Whether the question asks for one figure ("how many", "what percentage"), which one span can answer"""
+    return bool(_QUANTITY_RE.search(question))
+
+
+def _terms(text: str) -> Set[str]:
+    # Crude plural folding is enough to match "days" with "day" and "holidays" with "holiday"
+    return {word[:-1] if len(word) > 3 and word.endswith("s") else word
+            for word in _WORD_RE.findall(text.lower()) if word not in _STOPWORDS}
+
+
+class LexicalExtractor:
+    """Picks the passage covering most of the question's content words"""
+
+    name = "lexical"
+    ready = True
+
+    def warm(self):
+        pass
+
+    def __call__(self, question: str, context: str) -> Optional[Extraction]:
+        wanted = _terms(question)
+        if not wanted:
+            return None
+        quantity = is_lookup(question)
+        scored = []
+        for passage in passages(context):
+            if quantity and not re.search(r"\d", passage):
+                continue
+            scored.append((len(wanted & _terms(passage)), passage))
+        scored.sort(key=lambda item: -item[0])
+        if not scored or scored[0][0] == 0:
+            return None
+        best, passage = scored[0]
+        runner_up = scored[1][0] if len(scored) > 1 else 0
+        # A passage that ties with another is a guess, so halve the confidence at worst
+        score = best / len(wanted) * (1 - 0.5 * runner_up / best)
+        return Extraction(passage, round(score, 4), passage, 0, len(passage))
+
+
+class TransformersExtractor:
+    """A local extractive question-answering model, loaded on first use"""
+
+    def __init__(self, model_name: str = DEFAULT_MODEL):
+        self.name = f"transformers:{model_name}"
+        self.model_name = model_name
+        self._pipeline = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._pipeline is not None
+
+    def warm(self):
+        """Download and load the model; blocking, so run it off the request path"""
+        self._load()
+
+    def _load(self):
+        with self._lock:
+            if self._pipeline is None:
+                from transformers import pipeline
+
+                self._pipeline = pipeline("question-answering", model=self.model_name)
+        return self._pipeline
+
+    def __call__(self, question: str, context: str) -> Optional[Extraction]:
+        context = "\n".join(passages(context))
+        if not context:
+            return None
+        result = self._load()(question=question, context=context)
+        start, end = result["start"], result["end"]
+        # Highlight within the line the span was found in
+        line_start = context.rfind("\n", 0, start) + 1
+        line_end = context.find("\n", end)
+        passage = context[line_start:line_end if line_end != -1 else len(context)]
+        return Extraction(result["answer"].strip(), round(float(result["score"]), 4), passage,
+                          start - line_start, end - line_start)
+
+
+class FallbackExtractor:
+    """Tries the model extractor, and falls back to the lexical one for good if it cannot be loaded"""
+
+    def __init__(self, primary, fallback):
+        self.primary = primary
+        self.fallback = fallback
+        self.name = primary.name
+
+    @property
+    def ready(self) -> bool:
+        return self.primary is None or self.primary.ready
+
+    def warm(self):
+        try:
+            self.primary.warm()
+        except Exception as e:
+            logger.warning(f"Extractive model {self.primary.name} could not be loaded, "
+                           f"using the lexical extractor: {e}")
+            self.primary = None
+            self.name = self.fallback.name
+
+    def __call__(self, question: str, context: str) -> Optional[Extraction]:
+        primary = self.primary
+        if primary is not None:
+            try:
+                return primary(question, context)
+            except Exception as e:
+                # Only this question falls back; the model stays in use
+                logger.warning(f"Extractive model {primary.name} failed, using the lexical extractor: {e}")
+        return self.fallback(question, context)
+
+
+def load_extractor(model_name: str = DEFAULT_MODEL):
+    """The model extractor when `transformers` is installed, the lexical one otherwise"""
+    if model_name == LexicalExtractor.name:
+        return LexicalExtractor()
+    if importlib.util.find_spec("transformers") is None:
+        logger.info("transformers is not installed; extractive answers use the lexical extractor")
+        return LexicalExtractor()
+    return FallbackExtractor(TransformersExtractor(model_name), LexicalExtractor())
@@ -0,0 +1,277 @@
+"""Local stand-in for the OpenAI embeddings and chat completions endpoints.
+
+Lets the API be load tested without spending quota. Embeddings are
+deterministic feature-hashing vectors (app/local_embeddings.py), so an index
+ingested through this server can be queried meaningfully through it too.
+Latency is drawn from configurable distributions and chat completions support
+`stream=True` with server-sent events.
+
+    python -m app.fake_openai --port 8100 --chat-latency lognormal:1200,0.5
+    OPENAI_BASE_URL=http://localhost:8100/v1 OPENAI_API_KEY=sk-fake uvicorn app.main:app
+
+Latency specs (milliseconds): `fixed:50`, `uniform:20,80`, `normal:100,20` or
+`lognormal:<median>,<sigma>`. `--model-latency gpt-4o-mini=lognormal:500,0.4`
+overrides the chat latency for one model, to load test the model cascade.
+
+Prompt caching is simulated the way OpenAI documents it: a prompt whose
+first 1024 or more tokens (in 128-token steps) match a prompt the same model
+saw in the last five minutes reports them as `usage.prompt_tokens_details.
+cached_tokens`. `--prefill-ms-per-1k 150` adds latency per 1000 uncached
+prompt tokens, so a cache hit is also faster.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Dict, List, Union
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+
+from app.local_embeddings import HashingEmbedder
+
+DEFAULT_DIMENSIONS = 1536  # text-embedding-3-small
+CHARS_PER_TOKEN = 4
+CACHE_MIN_TOKENS = 1024  # Shortest prefix OpenAI caches
+CACHE_STEP_TOKENS = 128  # Cached prefixes grow in steps of this many tokens
+CACHE_TTL = 300  # Seconds an unused prefix stays cached
+CACHE_MAX_PREFIXES = 100000
+
+
+def parse_latency(spec: str) -> Callable[[], float]:
+    """Turn a latency spec into a sampler returning seconds"""
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",") if v]
+    if kind == "fixed":
+        return lambda: values[0] / 1000
+    if kind == "uniform":
+        return lambda: random.uniform(values[0], values[1]) / 1000
+    if kind == "normal":
+        return lambda: max(0.0, random.gauss(values[0], values[1])) / 1000
+    if kind == "lognormal":
+        mu = math.log(values[0])
+        return lambda: random.lognormvariate(mu, values[1]) / 1000
+    raise ValueError(f"Unknown latency spec: {spec}")
+
+
+class FakeSettings:
+    def __init__(self, embedding_latency="lognormal:60,0.4", chat_latency="lognormal:1500,0.5",
+                 first_token_latency="lognormal:400,0.4", error_rate=0.0, answer_tokens=120,
+                 model_latency: Dict[str, str] = None, prefill_ms_per_1k: float = 0.0):
+        self.embedding_latency = parse_latency(embedding_latency)
+        self.chat_latency = parse_latency(chat_latency)
+        self.model_latency = {model: parse_latency(spec) for model, spec in (model_latency or {}).items()}
+        self.prefill_ms_per_1k = prefill_ms_per_1k
+        self.first_token_latency = parse_latency(first_token_latency)
+        self.error_rate = error_rate
+        self.answer_tokens = answer_tokens
+
+    def chat_latency_for(self, model: str) -> float:
+        return self.model_latency.get(model, self.chat_latency)()
+
+
+class CallStats:
+    """Upstream call counters, served on /_stats so load tests can measure call reduction"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts: Dict[str, int] = {}
+
+    def inc(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + amount
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.counts)
+
+    def reset(self):
+        with self._lock:
+            self.counts.clear()
+
+
+class PrefixCache:
+    """Which prompt prefixes each model has seen recently, in CACHE_STEP_TOKENS steps"""
+
+    def __init__(self, ttl: float = CACHE_TTL, max_prefixes: int = CACHE_MAX_PREFIXES):
+        self.ttl = ttl
+        self.max_prefixes = max_prefixes
+        self._seen: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup_and_store(self, model: str, prompt: str) -> int:
+        """Tokens of `prompt` served from cache; every cacheable prefix of it is cached afterwards"""
+        step = CACHE_STEP_TOKENS * CHARS_PER_TOKEN
+        digest = hashlib.sha1(model.encode("utf-8"))
+        boundaries, hashed = [], 0
+        for end in range(CACHE_MIN_TOKENS * CHARS_PER_TOKEN, len(prompt) + 1, step):
+            digest.update(prompt[hashed:end].encode("utf-8"))
+            hashed = end
+            boundaries.append((end, digest.hexdigest()))
+
+        now = time.monotonic()
+        cached_chars = 0
+        with self._lock:
+            for end, key in boundaries:
+                seen = self._seen.get(key)
+                if seen is not None and now - seen <= self.ttl:
+                    cached_chars = end
+                self._seen[key] = now
+                self._seen.move_to_end(key)
+            while len(self._seen) > self.max_prefixes:
+                self._seen.popitem(last=False)
+        return cached_chars // CHARS_PER_TOKEN
+
+
+class EmbeddingRequest(BaseModel):
+    model: str
+    input: Union[str, List[str]]
+    dimensions: int = DEFAULT_DIMENSIONS
+
+
+class ChatRequest(BaseModel):
+    model: str
+    messages: List[Dict]
+    stream: bool = False
+    max_tokens: int = 800
+    temperature: float = 1.0
+
+
+def _approx_tokens(text: str) -> int:
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def create_app(settings: FakeSettings = None) -> FastAPI:
+    settings = settings or FakeSettings()
+    stats = CallStats()
+    prefix_cache = PrefixCache()
+    embedders: Dict[int, HashingEmbedder] = {}
+    app = FastAPI(title="Fake OpenAI")
+    app.state.stats = stats
+    app.state.settings = settings
+
+    def maybe_fail():
+        if settings.error_rate and random.random() < settings.error_rate:
+            stats.inc("rate_limited")
+            return JSONResponse(status_code=429, content={"error": {
+                "message": "Rate limit reached (simulated)", "type": "requests", "code": "rate_limit_exceeded"}})
+        return None
+
+    @app.post("/v1/embeddings")
+    async def embeddings(body: EmbeddingRequest):
+        stats.inc("embedding_requests")
+        failure = maybe_fail()
+        if failure:
+            return failure
+        texts = [body.input] if isinstance(body.input, str) else body.input
+        stats.inc("embedding_inputs", len(texts))
+        await asyncio.sleep(settings.embedding_latency())
+
+        embedder = embedders.setdefault(body.dimensions, HashingEmbedder(body.dimensions))
+        tokens = sum(_approx_tokens(text) for text in texts)
+        return {
+            "object": "list",
+            "model": body.model,
+            "data": [{"object": "embedding", "index": i, "embedding": vector}
+                     for i, vector in enumerate(embedder(texts))],
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(body: ChatRequest):
+        stats.inc("chat_requests")
+        stats.inc(f"chat_requests:{body.model}")
+        failure = maybe_fail()
+        if failure:
+            return failure
+
+        prompt = "".join(f"{m.get('role')}:{m.get('content', '')}\n" for m in body.messages)
+        prompt_tokens = sum(_approx_tokens(str(m.get("content", ""))) for m in body.messages)
+        cached_tokens = min(prompt_tokens, prefix_cache.lookup_and_store(body.model, prompt))
+        n_tokens = min(body.max_tokens, settings.answer_tokens)
+        for name, value in (("prompt_tokens", prompt_tokens), ("cached_prompt_tokens", cached_tokens),
+                            ("completion_tokens", n_tokens)):
+            stats.inc(name, value)
+            stats.inc(f"{name}:{body.model}", value)
+        words = [f"token{i}" for i in range(n_tokens)]
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": n_tokens,
+                 "total_tokens": prompt_tokens + n_tokens,
+                 "prompt_tokens_details": {"cached_tokens": cached_tokens}}
+        prefill = settings.prefill_ms_per_1k * (prompt_tokens - cached_tokens) / 1000 / 1000
+
+        if not body.stream:
+            await asyncio.sleep(prefill + settings.chat_latency_for(body.model))
+            return {
+                "id": completion_id, "object": "chat.completion", "created": created, "model": body.model,
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {
+                    "role": "assistant",
+                    "content": "Simulated answer based on the provided context. " + " ".join(words)}}],
+                "usage": usage,
+            }
+
+        async def event_stream():
+            first_token = prefill + settings.first_token_latency()
+            await asyncio.sleep(first_token)
+            # Spread the remaining latency evenly over the generated tokens
+            per_token = max(0.0, settings.chat_latency_for(body.model) - first_token) / max(1, n_tokens)
+            for i, word in enumerate(words):
+                chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                         "model": body.model,
+                         "choices": [{"index": 0, "finish_reason": None,
+                                      "delta": {"role": "assistant", "content": word + " "} if i == 0
+                                      else {"content": word + " "}}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await asyncio.sleep(per_token)
+            final = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                     "model": body.model, "choices": [{"index": 0, "finish_reason": "stop", "delta": {}}]}
+            yield f"data: {json.dumps(final)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+    @app.get("/_stats")
+    async def get_stats():
+        return stats.snapshot()
+
+    @app.post("/_stats/reset")
+    async def reset_stats():
+        stats.reset()
+        return {"reset": True}
+
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local fake OpenAI server for load testing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--embedding-latency", default="lognormal:60,0.4")
+    parser.add_argument("--chat-latency", default="lognormal:1500,0.5", help="total completion latency")
+    parser.add_argument("--first-token-latency", default="lognormal:400,0.4", help="streaming only")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered with 429")
+    parser.add_argument("--answer-tokens", type=int, default=120)
+    parser.add_argument("--model-latency", action="append", default=[], metavar="MODEL=SPEC",
+                        help="chat latency for one model; repeatable")
+    parser.add_argument("--prefill-ms-per-1k", type=float, default=0.0,
+                        help="extra latency per 1000 prompt tokens not served from the prompt cache")
+    args = parser.parse_args(argv)
+
+    import uvicorn
+
+    model_latency = dict(spec.split("=", 1) for spec in args.model_latency)
+    settings = FakeSettings(args.embedding_latency, args.chat_latency, args.first_token_latency,
+                            args.error_rate, args.answer_tokens, model_latency, args.prefill_ms_per_1k)
+    uvicorn.run(create_app(settings), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Cached health state for the liveness and readiness probes.
+
+Probes run every few seconds, so they must not call OpenAI or scan Chroma.
+`HealthMonitor` refreshes collection counts in the background and reads the
+upstream state the scheduler records on every OpenAI call; the probe
+endpoints only read this snapshot. The expensive end-to-end check stays
+available as `/health?deep=true`.
+"""
+import asyncio
+import logging
+import threading
+import time
+from typing import Dict, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from app.telemetry import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+COLLECTION_DOCUMENTS = REGISTRY.gauge(
+    "finrag_collection_documents", "Documents per collection at the last background refresh", ["collection"])
+REFRESH_FAILURES = REGISTRY.counter(
+    "finrag_health_refresh_failures_total", "Background collection refreshes that failed")
+
+
+class HealthMonitor:
+    def __init__(self, index_manager, upstream, refresh_interval: float = 30.0,
+                 upstream_failure_threshold: int = 5):
+        self.index_manager = index_manager
+        self.upstream = upstream
+        self.refresh_interval = refresh_interval
+        self.upstream_failure_threshold = upstream_failure_threshold
+        self.started_at = time.time()
+        self.collection_counts: Dict[str, int] = {}
+        self.refreshed_at: Optional[float] = None
+        self.refresh_error: Optional[str] = None
+        self.embedding_dim: Optional[int] = None
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        # Report the new generation's counts right after a swap rather than at the next tick
+        index_manager.on_swap(lambda generation: self.refresh_collections())
+
+    def refresh_collections(self) -> Dict[str, int]:
+        """Count the documents of every collection; blocking, run it off the event loop"""
+        try:
+            index = self.index_manager.active
+            counts = index.document_counts()
+            index_dim = index.embedding_dimensions()
+        except Exception as e:
+            REFRESH_FAILURES.inc()
+            logger.warning(f"Collection refresh failed: {e}")
+            with self._lock:
+                self.refresh_error = str(e)
+            raise
+        with self._lock:
+            self.collection_counts = counts
+            self.refreshed_at = time.time()
+            self.refresh_error = None
+            # Until a query or deep check has embedded something, report the size the index was built with
+            if self.embedding_dim is None:
+                self.embedding_dim = index_dim
+        for name, count in counts.items():
+            COLLECTION_DOCUMENTS.set(count, collection=name)
+        return counts
+
+    def record_embedding_dim(self, dim: int):
+        self.embedding_dim = dim
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                await run_in_threadpool(self.refresh_collections)
+            except Exception:
+                pass  # Already logged; readiness reports the stale snapshot
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._refresh_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.collection_counts)
+
+    def upstream_status(self) -> Dict[str, object]:
+        failures = self.upstream.consecutive_failures
+        return {
+            "status": "failing" if failures >= self.upstream_failure_threshold else "ok",
+            "last_success_at": self.upstream.last_success_at,
+            "last_error": self.upstream.last_error,
+            "consecutive_failures": failures,
+            "queue_depth": self.upstream.queue_depth(),
+        }
+
+    def liveness(self) -> Dict[str, object]:
+        return {"status": "alive", "uptime_s": round(time.time() - self.started_at, 1)}
+
+    def readiness(self) -> tuple[bool, Dict[str, object]]:
+        """Ready once the index has been read recently; an OpenAI outage only degrades the status"""
+        now = time.time()
+        with self._lock:
+            refreshed_at, counts, error = self.refreshed_at, dict(self.collection_counts), self.refresh_error
+        # Allow one missed refresh before the snapshot counts as stale
+        fresh = refreshed_at is not None and now - refreshed_at <= 2 * self.refresh_interval + 5
+        ready = fresh and bool(counts)
+        upstream = self.upstream_status()
+        if not ready:
+            status = "not_ready"
+        elif upstream["status"] != "ok":
+            status = "degraded"
+        else:
+            status = "ready"
+        return ready, {
+            "status": status,
+            "index_generation": self.index_manager.active.name,
+            "collections": counts,
+            "collections_refreshed_s_ago": round(now - refreshed_at, 1) if refreshed_at else None,
+            "refresh_error": error,
+            "upstream": upstream,
+        }
@@ -0,0 +1,390 @@
+"""On-disk bookkeeping shared by ingestion and the API.
+
+Ingestion bumps a version stamp in the Chroma directory after every write,
+and the API drops its cached collection handles and counts when the stamp
+changes, so the query path does not need to ask Chroma whether anything
+changed.
+
+Full ingestions are written blue/green: each run builds a fresh generation
+under `<db_path>/generations/<id>` and then atomically repoints
+`<db_path>/CURRENT` at it. `IndexManager` in the API notices the new pointer,
+opens and warms the new generation off the request path and swaps it in,
+while requests already running finish on the old one. Without a pointer file
+the Chroma directory itself is served, as before generations existed.
+"""
+import asyncio
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Optional, Tuple
+
+import chromadb
+from chromadb.api.client import SharedSystemClient
+from chromadb.config import Settings
+from starlette.concurrency import run_in_threadpool
+
+from app.parent_store import PARENTS_FILE, ParentStore
+from app.router import compute_centroids, load_centroids
+from app.telemetry import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+INDEX_SWAPS = REGISTRY.counter("finrag_index_swaps_total", "Index generations swapped in without a restart")
+INDEX_WARM_SECONDS = REGISTRY.histogram("finrag_index_warm_seconds", "Time to open and warm a new index generation")
+
+VERSION_FILE = "index_version"
+POINTER_FILE = "CURRENT"
+GENERATIONS_DIR = "generations"
+# Written into a generation once it is complete; only generations carrying it are ever pruned
+PUBLISHED_FILE = "PUBLISHED"
+LEGACY_GENERATION = "legacy"
+
+
+def version_path(db_path: str) -> str:
+    return os.path.join(db_path, VERSION_FILE)
+
+
+def bump_version(db_path: str) -> str:
+    """Write a new version stamp atomically and return it"""
+    version = f"{int(time.time())}-{uuid.uuid4().hex[:8]}"
+    os.makedirs(db_path, exist_ok=True)
+    _write_atomic(version_path(db_path), version)
+    return version
+
+
+def _write_atomic(path: str, content: str):
+    tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_version(db_path: str) -> Optional[str]:
+    try:
+        with open(version_path(db_path), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+class CollectionCache:
+    """Collection handles and document counts, dropped whenever the version stamp changes.
+
+    The stamp file is stat'ed at most once per `check_interval` seconds. With no
+    `db_path` (in-memory clients) entries live until `invalidate()` is called.
+    """
+
+    def __init__(self, chroma_client, db_path: Optional[str] = None, check_interval: float = 1.0,
+                 enabled: bool = True):
+        self.chroma_client = chroma_client
+        self.db_path = db_path
+        self.check_interval = check_interval
+        self.enabled = enabled
+        self._entries: Dict[str, Tuple[object, int]] = {}
+        self._lock = threading.Lock()
+        self._stamp = self._read_stamp()
+        self._checked_at = time.monotonic()
+
+    def _read_stamp(self):
+        if self.db_path is None:
+            return None
+        try:
+            stat = os.stat(version_path(self.db_path))
+        except FileNotFoundError:
+            return None
+        # os.replace gives the stamp a new inode, so this changes even within one mtime tick
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _check_version(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        stamp = self._read_stamp()
+        if stamp != self._stamp:
+            self._stamp = stamp
+            self.invalidate()
+
+    @property
+    def version(self):
+        """The version stamp currently seen, for keying results read from this index"""
+        self._check_version()
+        return self._stamp
+
+    def get(self, name: str) -> Tuple[object, int]:
+        """Return (collection, document_count); raises like get_collection when it does not exist"""
+        if not self.enabled:
+            collection = self.chroma_client.get_collection(name)
+            return collection, collection.count()
+
+        self._check_version()
+        entry = self._entries.get(name)
+        if entry is None:
+            collection = self.chroma_client.get_collection(name)
+            entry = (collection, collection.count())
+            with self._lock:
+                self._entries[name] = entry
+        return entry
+
+    def invalidate(self, name: Optional[str] = None):
+        with self._lock:
+            if name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(name, None)
+
+
+# =============================================================================
+# GENERATIONS
+# =============================================================================
+def open_client(path: str):
+    os.makedirs(path, exist_ok=True)
+    return chromadb.Client(Settings(
+        persist_directory=path,
+        is_persistent=True,
+        anonymized_telemetry=False
+    ))
+
+
+def close_client(client):
+    """Release a generation's Chroma system; Chroma 0.4 keeps one per directory for the process lifetime"""
+    try:
+        identifier = client._identifier
+        system = SharedSystemClient._identifer_to_system.pop(identifier, None)
+        if system is not None:
+            system.stop()
+    except Exception as e:
+        logger.warning(f"Could not close Chroma client: {e}")
+
+
+def read_pointer(db_path: str) -> Optional[str]:
+    try:
+        with open(os.path.join(db_path, POINTER_FILE), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def generation_path(db_path: str, generation: str) -> str:
+    if generation == LEGACY_GENERATION:
+        return db_path
+    return os.path.join(db_path, GENERATIONS_DIR, generation)
+
+
+def current_generation_path(db_path: str) -> str:
+    """The directory of the generation CURRENT points at, or db_path itself without a pointer"""
+    return generation_path(db_path, read_pointer(db_path) or LEGACY_GENERATION)
+
+
+def list_generations(db_path: str) -> List[str]:
+    """Generation ids, oldest first (ids sort by creation time)"""
+    root = os.path.join(db_path, GENERATIONS_DIR)
+    if not os.path.isdir(root):
+        return []
+    return sorted(name for name in os.listdir(root) if os.path.isdir(os.path.join(root, name)))
+
+
+def create_generation(db_path: str) -> Tuple[str, str]:
+    """Allocate an empty generation directory for a full ingestion; returns (id, path)"""
+    generation = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    path = generation_path(db_path, generation)
+    os.makedirs(path)
+    return generation, path
+
+
+def published_generations(db_path: str) -> List[str]:
+    """Generation ids that were published, in the order they were published"""
+    published = []
+    for generation in list_generations(db_path):
+        marker = os.path.join(generation_path(db_path, generation), PUBLISHED_FILE)
+        try:
+            published.append((os.stat(marker).st_mtime_ns, generation))
+        except FileNotFoundError:
+            continue  # Still being built by another ingestion, or abandoned by one that failed
+    return [generation for _, generation in sorted(published)]
+
+
+def publish_generation(db_path: str, generation: str, keep: int = 3):
+    """Point CURRENT at a finished generation and delete all but the `keep` most recently published.
+
+    Older generations are kept for a while because an API process may still be
+    finishing requests on the one it is swapping away from. Generations that
+    were never published are left alone, since another ingestion may still be
+    writing them.
+    """
+    previous = read_pointer(db_path)
+    _write_atomic(os.path.join(generation_path(db_path, generation), PUBLISHED_FILE), str(time.time()))
+    _write_atomic(os.path.join(db_path, POINTER_FILE), generation)
+    bump_version(db_path)
+    for old in published_generations(db_path)[:-keep]:
+        if old not in (generation, previous):
+            shutil.rmtree(generation_path(db_path, old), ignore_errors=True)
+
+
+class IndexGeneration:
+    """One opened index: its Chroma client, collection cache, parent sections and routing centroids"""
+
+    def __init__(self, name: str, client, db_path: Optional[str] = None, cache_collections: bool = True,
+                 parents: Optional[ParentStore] = None, path: Optional[str] = None):
+        self.name = name
+        self.client = client
+        self.path = path
+        self.collections = CollectionCache(client, db_path=db_path, enabled=cache_collections)
+        # Empty for indexes built without the parent-child layout; hits then keep their own text
+        self.parents = parents if parents is not None else ParentStore()
+        self.loaded_at = time.time()
+        self._centroids: Optional[Tuple[object, Dict[str, List[List[float]]]]] = None
+
+    def close(self):
+        close_client(self.client)
+        self.parents.close()
+
+    def document_counts(self) -> Dict[str, int]:
+        return {c.name: c.count() for c in self.client.list_collections()}
+
+    def embedding_dimensions(self) -> Optional[int]:
+        """The embedding size ingestion stamped into the collections' metadata, if any"""
+        for collection in self.client.list_collections():
+            dimensions = (collection.metadata or {}).get("embedding_dimensions")
+            if dimensions:
+                return dimensions
+        return None
+
+    def centroids(self) -> Dict[str, List[List[float]]]:
+        """Routing centroids written by ingestion, reread after incremental writes.
+
+        Indexes without a centroids file (in-memory clients, older generations)
+        get them computed from their stored embeddings instead.
+        """
+        version = self.collections.version
+        if self._centroids is None or self._centroids[0] != version:
+            stored = load_centroids(self.path) if self.path else None
+            self._centroids = (version, stored if stored is not None else compute_centroids(self.client))
+        return self._centroids[1]
+
+    def warm(self) -> Dict[str, int]:
+        """Load every collection's handle, count and HNSW segment so the first query is not cold"""
+        counts = {}
+        for listed in self.client.list_collections():
+            collection, count = self.collections.get(listed.name)
+            counts[listed.name] = count
+            if count:
+                sample = collection.get(limit=1, include=["embeddings"])
+                collection.query(query_embeddings=sample["embeddings"], n_results=1)
+        self.centroids()
+        return counts
+
+
+class IndexManager:
+    """Serves the generation CURRENT points at and hot-swaps to new ones"""
+
+    def __init__(self, db_path: Optional[str], check_interval: float = 5.0, retire_after: float = 60.0,
+                 cache_collections: bool = True, client=None, parents: Optional[ParentStore] = None):
+        self.db_path = db_path
+        self.check_interval = check_interval
+        self.retire_after = retire_after
+        self.cache_collections = cache_collections
+        self._listeners: List[Callable[[IndexGeneration], None]] = []
+        self._retiring: List[Tuple[IndexGeneration, float]] = []
+        self._skipped: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+        self._swap_lock = threading.Lock()
+        if client is not None:
+            # A fixed client (benchmarks, tests) is never swapped
+            self.active = IndexGeneration("fixed", client, cache_collections=cache_collections, parents=parents)
+        else:
+            self.active = self._open(read_pointer(db_path) or LEGACY_GENERATION)
+
+    @classmethod
+    def for_client(cls, client, cache_collections: bool = True,
+                   parents: Optional[ParentStore] = None) -> "IndexManager":
+        return cls(None, cache_collections=cache_collections, client=client, parents=parents)
+
+    def _open(self, generation: str) -> IndexGeneration:
+        path = generation_path(self.db_path, generation)
+        client = open_client(path)
+        # The stamp in the root directory still covers incremental writes into a generation
+        return IndexGeneration(generation, client, db_path=self.db_path, cache_collections=self.cache_collections,
+                               parents=ParentStore(os.path.join(path, PARENTS_FILE)), path=path)
+
+    def on_swap(self, listener: Callable[[IndexGeneration], None]):
+        self._listeners.append(listener)
+
+    def check_for_new_generation(self) -> bool:
+        """Open, warm and swap in the generation CURRENT points at, if it changed; blocking"""
+        if self.db_path is None:
+            return False
+        with self._swap_lock:
+            generation = read_pointer(self.db_path)
+            if generation is None or generation == self.active.name or generation == self._skipped:
+                return False
+
+            start = time.perf_counter()
+            candidate = None
+            try:
+                candidate = self._open(generation)
+                counts = candidate.warm()
+            except Exception as e:
+                logger.error(f"Could not load index generation {generation}, still serving "
+                             f"{self.active.name}: {e}")
+                if candidate is not None:
+                    candidate.close()
+                self._skipped = generation
+                return False
+            if not any(counts.values()):
+                logger.error(f"Index generation {generation} has no documents, still serving {self.active.name}")
+                candidate.close()
+                self._skipped = generation
+                return False
+            INDEX_WARM_SECONDS.observe(time.perf_counter() - start)
+
+            previous, self.active = self.active, candidate
+            # Requests that already picked up the old generation finish on it before it is closed
+            self._retiring.append((previous, time.monotonic() + self.retire_after))
+            INDEX_SWAPS.inc()
+            logger.info(f"Swapped index generation {previous.name} -> {generation} "
+                        f"({sum(counts.values())} documents, warmed in {time.perf_counter() - start:.2f}s)")
+
+        for listener in self._listeners:
+            try:
+                listener(candidate)
+            except Exception as e:
+                logger.warning(f"Index swap listener failed: {e}")
+        return True
+
+    def retire_old_generations(self):
+        now = time.monotonic()
+        still_retiring = []
+        for generation, retire_at in self._retiring:
+            if retire_at <= now:
+                generation.close()
+            else:
+                still_retiring.append((generation, retire_at))
+        self._retiring = still_retiring
+
+    async def _watch_loop(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await run_in_threadpool(self.check_for_new_generation)
+                self.retire_old_generations()
+            except Exception as e:
+                logger.error(f"Index generation check failed: {e}")
+
+    def start(self):
+        if self._task is None and self.db_path is not None:
+            self._task = asyncio.ensure_future(self._watch_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
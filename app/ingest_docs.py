@@ -2,11 +2,25 @@ import os
 import glob
 import toml
 import csv
+import math
 import re
+import time
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import chromadb
 from chromadb.config import Settings
 from openai import OpenAI
 
+from app.chunking import chunk_markdown_parents, chunk_markdown_structured
+from app.dedup import find_duplicates
+from app.index_store import create_generation, publish_generation
+from app.parent_store import PARENTS_FILE, ParentStore
+from app.parsers import get_parser, looks_like_header, registered_extensions, table_lines
+from app.periods import document_period, find_entities, period_flags, period_label, report_type, section_periods
+from app.router import write_centroids
+from app.telemetry import REGISTRY
+
 # ========= CONFIG =========
 # Chunk size for splitting documents into smaller pieces for embedding
 CHUNK_SIZE = 1000
@@ -14,60 +28,117 @@ CHUNK_SIZE = 1000
 OVERLAP = 200
 # Maximum chunk size specifically for CSV rows, to avoid overly long single embeddings
 CSV_MAX_CHUNK = 1200
+# Markdown chunker: "structured" keeps tables and lists whole under their heading path,
+# "heading" is the original split on headings followed by sentence chunks
+MARKDOWN_CHUNKER = os.getenv("MARKDOWN_CHUNKER", "structured")
+# Embed small child chunks and keep their parent sections for the prompt (structured chunker only).
+# Off by default: it only pays off on large corpora with many near-miss sections, and costs recall on data/
+PARENT_CHILD_INDEX = os.getenv("PARENT_CHILD_INDEX", "0") == "1"
+# Store exact and near-duplicate chunks of a department once (estimated Jaccard similarity >= threshold)
+DEDUP_CHUNKS = os.getenv("DEDUP_CHUNKS", "1") == "1"
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.9"))
 
 # Define paths relative to the script's location
 ROOT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-DB_PATH = os.path.join(ROOT_PATH, "chroma_db")
+DB_PATH = os.getenv("CHROMA_DB_PATH") or os.path.join(ROOT_PATH, "chroma_db")
 DATA_PATH = os.path.join(ROOT_PATH, "data")
-# Create the ChromaDB directory if it doesn't exist
-os.makedirs(DB_PATH, exist_ok=True)
 
 # List of departments, corresponding to data subfolders and ChromaDB collection names
 departments = ["engineering", "finance", "marketing", "hr", "general"]
 
+EMBEDDING_MODEL = "text-embedding-3-small"  # ENSURE THIS MATCHES THE CHATBOT
+# Shortened (Matryoshka) embeddings, e.g. 512 or 256; 0 keeps the model's full 1536 dimensions.
+# Read by the chatbot too, so queries match the index. Re-ingest after changing it.
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "0"))
+
+# Worker processes for parsing files; PDFs and spreadsheets are CPU bound
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", "1"))
+
+PARSE_SECONDS = REGISTRY.histogram("finrag_parse_seconds", "Time to parse and chunk one file", ["format"])
+PARSED_BYTES = REGISTRY.counter("finrag_parsed_bytes_total", "Bytes of source documents parsed", ["format"])
+PARSED_PAGES = REGISTRY.counter("finrag_parsed_pages_total", "Pages or sheets parsed", ["format"])
+PARSED_FILES = REGISTRY.counter("finrag_parsed_files_total", "Files parsed", ["format", "status"])
+DUPLICATE_CHUNKS = REGISTRY.counter("finrag_duplicate_chunks_total", "Chunks collapsed into an identical or near-identical one")
+
+
 # ========= LOAD API KEY =========
 # Attempt to load OpenAI API key from environment variables or Streamlit secrets file
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
-    secrets_path = os.path.join(ROOT_PATH, "frontend/.streamlit/secrets.toml")
-    if os.path.exists(secrets_path):
-        secrets = toml.load(secrets_path)
-        OPENAI_API_KEY = secrets.get("OPENAI_API_KEY")
-
-# Validate that the API key is present and appears to be in the correct format
-if not OPENAI_API_KEY or not OPENAI_API_KEY.strip().startswith("sk-"):
-    raise ValueError(
-        "❌ OPENAI_API_KEY not found or invalid. Set it in environment or frontend/.streamlit/secrets.toml"
-    )
+def load_api_key():
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        secrets_path = os.path.join(ROOT_PATH, "frontend/.streamlit/secrets.toml")
+        if os.path.exists(secrets_path):
+            secrets = toml.load(secrets_path)
+            api_key = secrets.get("OPENAI_API_KEY")
 
-# Initialize OpenAI client and define the embedding model
-client_oai = OpenAI(api_key=OPENAI_API_KEY)
-EMBEDDING_MODEL = "text-embedding-3-small"  # ENSURE THIS MATCHES THE CHATBOT
+    # Validate that the API key is present and appears to be in the correct format
+    if not api_key or not api_key.strip().startswith("sk-"):
+        raise ValueError(
+            "❌ OPENAI_API_KEY not found or invalid. Set it in environment or frontend/.streamlit/secrets.toml"
+        )
+    return api_key
+
+
+_client_oai = None
+
+
+def get_openai_client():
+    # Created on first use so the chunking helpers can be imported without an API key
+    global _client_oai
+    if _client_oai is None:
+        _client_oai = OpenAI(api_key=load_api_key())
+    return _client_oai
 
-print(f"✅ Using embedding model: {EMBEDDING_MODEL}")
 
 # ========= EMBEDDING =========
+# Request options asking the API for EMBEDDING_DIMENSIONS-long vectors; sent through extra_body
+# because the pinned openai client predates the `dimensions` argument
+def embedding_options():
+    return {"extra_body": {"dimensions": EMBEDDING_DIMENSIONS}} if EMBEDDING_DIMENSIONS else {}
+
+
+# Truncate longer vectors to `dimensions` and re-normalise them, for endpoints that ignore the
+# dimensions option. text-embedding-3 vectors keep most of their meaning in the leading dimensions.
+def shorten_embeddings(embeddings, dimensions=EMBEDDING_DIMENSIONS):
+    if not dimensions:
+        return embeddings
+    shortened = []
+    for vector in embeddings:
+        if len(vector) > dimensions:
+            vector = vector[:dimensions]
+            norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+            vector = [x / norm for x in vector]
+        shortened.append(vector)
+    return shortened
+
+
 # Function to generate embeddings for a list of texts using the specified OpenAI model
 def embed(texts):
     try:
-        response = client_oai.embeddings.create(
+        response = get_openai_client().embeddings.create(
             model=EMBEDDING_MODEL,
-            input=texts
+            input=texts,
+            **embedding_options()
         )
-        embeddings = [d.embedding for d in response.data]
+        embeddings = shorten_embeddings([d.embedding for d in response.data])
         print(f"✅ Generated {len(embeddings)} embeddings with {len(embeddings[0])} dimensions")
         return embeddings
     except Exception as e:
         print(f"❌ Embedding error: {e}")
         raise
 
+
 # ========= VECTOR DB =========
 # Initialize ChromaDB client in persistent mode with explicit settings
-chroma_client = chromadb.Client(Settings(
-    persist_directory=DB_PATH,
-    is_persistent=True,
-    anonymized_telemetry=False
-))
+def get_chroma_client(db_path=DB_PATH):
+    # Create the ChromaDB directory if it doesn't exist
+    os.makedirs(db_path, exist_ok=True)
+    return chromadb.Client(Settings(
+        persist_directory=db_path,
+        is_persistent=True,
+        anonymized_telemetry=False
+    ))
+
 
 # ========= UTILITY FUNCTIONS =========
 # Chunks text into sentences, ensuring chunks are within CHUNK_SIZE with OVERLAP
@@ -94,122 +165,415 @@ def chunk_sentences(text, chunk_size=CHUNK_SIZE, overlap=OVERLAP):
 def chunk_long_text(text, max_length=CSV_MAX_CHUNK):
     return [text[i:i+max_length] for i in range(0, len(text), max_length)]
 
-# ========= CLEAR EXISTING DATA =========
-print("🧹 Clearing existing collections...")
-for dept in departments:
+# Split Markdown content by headings and then chunk sentences within sections
+def chunk_markdown(content):
+    sections = re.split(r'(?=^#{1,6} )', content, flags=re.MULTILINE)
+    chunks = []
+    for section in sections:
+        if section.strip():  # Only process non-empty sections
+            chunks.extend(chunk_sentences(section.strip()))
+    return chunks
+
+# Chunk Markdown with the configured chunker into (parent, heading path, chunks) groups.
+# Without the parent-child index every chunk is its own group with no parent, and the
+# "heading" chunker has no heading paths.
+def chunk_markdown_sections(content, chunker=MARKDOWN_CHUNKER, parent_child=PARENT_CHILD_INDEX):
+    if chunker == "structured" and parent_child:
+        return chunk_markdown_parents(content)
+    if chunker == "structured":
+        return [(None, heading, [chunk]) for chunk, heading in chunk_markdown_structured(content)]
+    if chunker == "heading":
+        return [(None, "", [chunk]) for chunk in chunk_markdown(content)]
+    raise ValueError(f"Unknown Markdown chunker: {chunker}")
+
+# Read CSV rows as " | "-joined strings, skipping a header row of plain column names
+def read_csv_rows(path):
+    with open(path, "r", encoding="utf-8") as csvfile:
+        reader = csv.reader(csvfile)
+        rows = []
+        for i, row in enumerate(reader):
+            # Skip if the first row looks like a header
+            if i == 0 and all(re.match(r'^\s*[\w\s]+\s*$', col) for col in row):
+                continue
+            # Join non-empty columns with " | "
+            joined = " | ".join(col.strip() for col in row if col.strip())
+            if joined:
+                rows.append(joined)
+    return rows
+
+def chunk_csv_rows(rows):
+    chunks = []
+    for row in rows:
+        # If a CSV row is very long, chunk it further
+        if len(row) > CSV_MAX_CHUNK:
+            chunks.extend(chunk_long_text(row, CSV_MAX_CHUNK))
+        else:
+            chunks.append(row)
+    return chunks
+
+
+# ========= DOCUMENT LOADING =========
+# Markdown and CSV are read here; every other format goes through the parser registry
+SUPPORTED_EXTENSIONS = (".md", ".csv") + registered_extensions()
+
+
+# Chunk parser blocks: text through the Markdown chunker, tables through the CSV row chunker.
+# Returns (parent, heading path, chunks, page) groups; page is None for formats without pages.
+def chunk_blocks(blocks, chunker=MARKDOWN_CHUNKER, parent_child=PARENT_CHILD_INDEX):
+    groups = []
+    for block in blocks:
+        if block.kind == "table":
+            rows = block.content
+            header = rows[0] if len(rows) > 1 and looks_like_header(rows[0]) else None
+            block_groups = [(None, "", [chunk])
+                            for chunk in chunk_csv_rows(table_lines(rows[1:] if header else rows, header))]
+        else:
+            block_groups = chunk_markdown_sections(block.content, chunker, parent_child)
+        groups.extend((parent, heading, chunks, block.page) for parent, heading, chunks in block_groups)
+    return groups
+
+
+# Build the chunks, metadata and ids for one file, plus the (id, content, metadata) parents its
+# chunks point at through their parent_id; returns None for empty or unsupported files
+def build_file_documents(dept, path, chunker=MARKDOWN_CHUNKER, parent_child=PARENT_CHILD_INDEX):
+    name = os.path.basename(path)
+    if path.endswith(".md"):
+        print(f"  Ingesting Markdown: {name}")
+        with open(path, "r", encoding="utf-8") as f:
+            content = f.read().strip()
+        if not content:
+            print(f"    ⚠️  Empty file skipped: {path}")
+            return None
+        groups = [(parent, heading, chunks, None)
+                  for parent, heading, chunks in chunk_markdown_sections(content, chunker, parent_child)]
+        if not groups:
+            print(f"    ⚠️  No chunks generated from: {path}")
+            return None
+        print(f"    ✅ {name} → {sum(len(g[2]) for g in groups)} chunks (Markdown)")
+        doc_type, id_tag = "markdown", "md"
+    elif path.endswith(".csv"):
+        print(f"  Ingesting CSV: {name}")
+        rows = read_csv_rows(path)
+        if not rows:
+            print(f"    ⚠️  Empty CSV skipped: {path}")
+            return None
+        groups = [(None, "", [chunk], None) for chunk in chunk_csv_rows(rows)]
+        print(f"    ✅ {name} → {len(groups)} chunks (CSV)")
+        doc_type, id_tag = "csv", "csv"
+    else:
+        parser = get_parser(path)
+        if parser is None:
+            return None
+        missing = parser.missing_dependency()
+        if missing:
+            print(f"    ⚠️  {name} skipped: install the '{missing}' package to ingest {parser.name.upper()} files")
+            return None
+        print(f"  Ingesting {parser.name.upper()}: {name}")
+        groups = chunk_blocks(parser.parse(path), chunker, parent_child)
+        if not groups:
+            print(f"    ⚠️  No text extracted from: {path}")
+            return None
+        print(f"    ✅ {name} → {sum(len(g[2]) for g in groups)} chunks ({parser.name.upper()})")
+        doc_type = id_tag = parser.name
+
+    # Fiscal period and report type, so retrieval can pre-filter on the periods a question names
+    title = content.splitlines()[0].lstrip("#").strip() if doc_type == "markdown" else ""
+    period = document_period(title, name)
+    kind = report_type(title, name, doc_type, period)
+
+    chunks, metadatas, parents = [], [], []
+    for parent, heading, group_chunks, page in groups:
+        metadata = {"department": dept, "source": name, "type": doc_type, "report_type": kind}
+        if page is not None:
+            metadata["page"] = page
+        if heading:
+            metadata["heading_path"] = heading
+        periods = section_periods(heading or "", period)
+        metadata.update(period_flags(periods))
+        if period_label(periods):
+            metadata["fiscal_period"] = period_label(periods)
+        if parent is not None:
+            parent_id = f"{dept}-{name}-{id_tag}-p{len(parents)}"
+            parents.append((parent_id, parent, dict(metadata)))
+            metadata["parent_id"] = parent_id
+        chunks.extend(group_chunks)
+        for chunk in group_chunks:
+            entities = find_entities(chunk)
+            metadatas.append(dict(metadata, entities=entities) if entities else dict(metadata))
+    ids = [f"{dept}-{name}-{id_tag}-{i}" for i in range(len(chunks))]
+    return chunks, metadatas, ids, parents
+
+
+def file_format(path):
+    if path.endswith(".md"):
+        return "markdown"
+    if path.endswith(".csv"):
+        return "csv"
+    parser = get_parser(path)
+    return parser.name if parser else "unknown"
+
+
+# Runs in a parse worker process; metrics are returned so the parent process can record them
+def _build_file_with_stats(dept, path, chunker=MARKDOWN_CHUNKER, parent_child=PARENT_CHILD_INDEX):
+    start = time.perf_counter()
     try:
-        collection = chroma_client.get_collection(f"{dept}_docs")
-        chroma_client.delete_collection(f"{dept}_docs")
-        print(f"  ✅ Cleared existing {dept}_docs collection")
-    except Exception:
-        print(f"  ℹ️  No existing {dept}_docs collection to clear")
-
-# ========= INGESTION LOOP =========
-# Iterate through each department to ingest its documents
-for dept in departments:
-    folder = os.path.join(DATA_PATH, dept)
-    if not os.path.exists(folder):
-        print(f"⚠️  Folder missing for department: {dept}. Skipping.")
-        continue
+        built = build_file_documents(dept, path, chunker, parent_child)
+        status = "ok" if built else "skipped"
+    except Exception as e:
+        print(f"    ❌ Could not parse {path}: {e}")
+        built, status = None, "error"
+    stats = {
+        "format": file_format(path),
+        "status": status,
+        "seconds": time.perf_counter() - start,
+        "bytes": os.path.getsize(path),
+        "pages": len({m["page"] for m in built[1] if "page" in m}) if built else 0,
+    }
+    return built, stats
 
-    # Get or create a collection in ChromaDB for the current department
-    collection = chroma_client.get_or_create_collection(
+
+# Per-format totals for the end-of-run summary
+parse_totals = {}
+
+
+def record_parse_stats(stats):
+    fmt = stats["format"]
+    PARSE_SECONDS.observe(stats["seconds"], format=fmt)
+    PARSED_BYTES.inc(stats["bytes"], format=fmt)
+    PARSED_PAGES.inc(stats["pages"], format=fmt)
+    PARSED_FILES.inc(format=fmt, status=stats["status"])
+    totals = parse_totals.setdefault(fmt, {"files": 0, "bytes": 0, "seconds": 0.0})
+    totals["files"] += 1
+    totals["bytes"] += stats["bytes"]
+    totals["seconds"] += stats["seconds"]
+
+
+# Process pool for parsing, or None to parse in this process.
+# Spawned rather than forked, because the API process runs threads.
+@contextlib.contextmanager
+def parse_pool(workers=PARSE_WORKERS):
+    if workers <= 1:
+        yield None
+        return
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        yield pool
+
+
+def list_department_files(folder):
+    # Grouped by format in SUPPORTED_EXTENSIONS order, so Markdown and CSV keep their original order
+    paths = []
+    for extension in SUPPORTED_EXTENSIONS:
+        paths.extend(sorted(glob.glob(os.path.join(folder, f"*{extension}"))))
+    return paths
+
+
+# Collapse exact and near-duplicate chunks into their first copy, which lists the other files
+# in its "duplicate_sources" metadata (";"-separated) and counts them in "duplicates".
+# Near duplicates must quote the same figures and be about the same periods; an exact duplicate from
+# a document about other periods adds its period flags to the kept copy, so period filters still find it.
+# Takes and returns (path, chunks, metadatas, ids, parents) tuples; files left empty are dropped.
+def dedupe_documents(documents, threshold=DEDUP_THRESHOLD):
+    positions = [(d, c) for d, document in enumerate(documents) for c in range(len(document[1]))]
+    periods = [frozenset(key for key in documents[d][2][c] if key.startswith("period_")) for d, c in positions]
+    matches = find_duplicates([documents[d][1][c] for d, c in positions], threshold, groups=periods)
+
+    dropped = set()
+    for i, ((d, c), match) in enumerate(zip(positions, matches)):
+        if match is None:
+            continue
+        dropped.add((d, c))
+        kept_d, kept_c = positions[match]
+        kept = documents[kept_d][2][kept_c]
+        kept["duplicates"] = kept.get("duplicates", 0) + 1
+        duplicate = documents[d][2][c]
+        if not periods[i] <= set(kept):
+            kept.update({flag: 1 for flag in periods[i]})
+            labels = ", ".join(label for label in (kept.get("fiscal_period"), duplicate.get("fiscal_period")) if label)
+            if labels:
+                kept["fiscal_period"] = ", ".join(dict.fromkeys(labels.split(", ")))
+        source = duplicate["source"]
+        others = [name for name in kept.get("duplicate_sources", "").split(";") if name]
+        if source != kept["source"] and source not in others:
+            kept["duplicate_sources"] = ";".join(others + [source])
+    DUPLICATE_CHUNKS.inc(len(dropped))
+
+    deduped = []
+    for d, (path, chunks, metadatas, ids, parents) in enumerate(documents):
+        keep = [c for c in range(len(chunks)) if (d, c) not in dropped]
+        if not keep:
+            continue
+        referenced = {metadatas[c].get("parent_id") for c in keep}
+        deduped.append((path, [chunks[c] for c in keep], [metadatas[c] for c in keep], [ids[c] for c in keep],
+                        [parent for parent in parents if parent[0] in referenced]))
+    return deduped
+
+
+# Build the chunks, metadata and ids for every file of one department folder, optionally on a parse pool.
+# Returns a list of (path, chunks, metadatas, ids, parents) tuples, one per non-empty file.
+def build_department_documents(dept, folder, pool=None, chunker=MARKDOWN_CHUNKER, parent_child=PARENT_CHILD_INDEX,
+                               dedup=DEDUP_CHUNKS):
+    paths = list_department_files(folder)
+    for extension, label in ((".md", "markdown"), (".csv", "CSV")):
+        if not any(path.endswith(extension) for path in paths):
+            print(f"  ⚠️  No {label} files found in {dept}")
+
+    if pool is None:
+        results = map(_build_file_with_stats, [dept] * len(paths), paths,
+                      [chunker] * len(paths), [parent_child] * len(paths))
+    else:
+        results = pool.map(_build_file_with_stats, [dept] * len(paths), paths,
+                           [chunker] * len(paths), [parent_child] * len(paths))
+
+    documents = []
+    for path, (built, stats) in zip(paths, results):
+        record_parse_stats(stats)
+        if built:
+            documents.append((path, *built))
+    if dedup:
+        before = sum(len(chunks) for _, chunks, _, _, _ in documents)
+        documents = dedupe_documents(documents)
+        collapsed = before - sum(len(chunks) for _, chunks, _, _, _ in documents)
+        if collapsed:
+            print(f"  ♻️  {dept}: {collapsed} duplicate chunks collapsed")
+    return documents
+
+
+# ========= INGESTION =========
+def get_department_collection(chroma_client, dept):
+    return chroma_client.get_or_create_collection(
         name=f"{dept}_docs",
         metadata={"hnsw:space": "cosine"}  # Explicitly set cosine distance
     )
-    print(f"Processing department: {dept}")
 
-    # ✅ 1. Ingest Markdown files
-    md_files = glob.glob(os.path.join(folder, "*.md"))
-    if md_files:
-        for path in md_files:
-            print(f"  Ingesting Markdown: {os.path.basename(path)}")
-            # FIXED: encoding="utf-8" instead of encoding="utf="8"
-            with open(path, "r", encoding="utf-8") as f:
-                content = f.read().strip()
-            if not content:
-                print(f"    ⚠️  Empty file skipped: {path}")
-                continue
 
-            # Split Markdown content by headings and then chunk sentences within sections
-            sections = re.split(r'(?=^#{1,6} )', content, flags=re.MULTILINE)
-            chunks = []
-            for section in sections:
-                if section.strip():  # Only process non-empty sections
-                    chunks.extend(chunk_sentences(section.strip()))
+# Refuse vectors of another length than the ones a collection already holds, and stamp the length
+# into the collection metadata on first write, so the chatbot can reject mismatched queries too
+def check_embedding_dimensions(collection, embeddings):
+    if not embeddings:
+        return
+    dimensions = len(embeddings[0])
+    metadata = dict(collection.metadata or {})
+    stored = metadata.get("embedding_dimensions")
+    if stored is None and collection.count():
+        # Indexed before collections were stamped; the vectors themselves tell
+        stored = len(collection.peek(1)["embeddings"][0])
+    if stored is not None and stored != dimensions:
+        raise ValueError(f"Collection {collection.name} holds {stored}-dimensional embeddings, not {dimensions}; "
+                         f"set EMBEDDING_DIMENSIONS={stored} or run a full ingestion")
+    if "embedding_dimensions" not in metadata:
+        collection.modify(metadata={**metadata, "embedding_dimensions": dimensions, "embedding_model": EMBEDDING_MODEL})
 
-            if not chunks:
-                print(f"    ⚠️  No chunks generated from: {path}")
-                continue
 
-            print(f"    ✅ {os.path.basename(path)} → {len(chunks)} chunks (Markdown)")
-            # Generate embeddings for the chunks
-            embeddings = embed(chunks)
-            # Add chunks, embeddings, metadata, and unique IDs to the ChromaDB collection
-            collection.add(
-                embeddings=embeddings,
-                documents=chunks,
-                metadatas=[{"department": dept, "source": os.path.basename(path), "type": "markdown"} for _ in chunks],
-                ids=[f"{dept}-{os.path.basename(path)}-md-{i}" for i in range(len(chunks))]
-            )
-    else:
-        print(f"  ⚠️  No markdown files found in {dept}")
-
-    # ✅ 2. Ingest CSV files
-    csv_files = glob.glob(os.path.join(folder, "*.csv"))
-    if csv_files:
-        for path in csv_files:
-            print(f"  Ingesting CSV: {os.path.basename(path)}")
-            # FIXED: encoding="utf-8" instead of encoding="utf="8"
-            with open(path, "r", encoding="utf-8") as csvfile:
-                reader = csv.reader(csvfile)
-                rows = []
-                header_row = None
-                for i, row in enumerate(reader):
-                    # Capture header row
-                    if i == 0:
-                        header_row = row
-                        # Skip if it looks like a header
-                        if all(re.match(r'^\s*[\w\s]+\s*$', col) for col in row):
-                            continue
-                    # Join non-empty columns with " | "
-                    joined = " | ".join(col.strip() for col in row if col.strip())
-                    if joined:
-                        rows.append(joined)
-
-            if not rows:
-                print(f"    ⚠️  Empty CSV skipped: {path}")
-                continue
+# Replace everything a collection holds for one file with its current chunks.
+# Returns the number of chunks written (0 when the file was deleted or is empty).
+# Parents, when a parent store is given, are swapped before the chunks so no new chunk points at a missing one.
+def replace_file(collection, dept, path, embed_fn=None, parents=None):
+    embed_fn = embed_fn or embed
+    built = None
+    if os.path.exists(path):
+        built, stats = _build_file_with_stats(dept, path)
+        record_parse_stats(stats)
+        if stats["status"] == "error":
+            # Keep the chunks from the last good version rather than dropping the file
+            raise ValueError(f"Could not parse {path}")
+    if built and DEDUP_CHUNKS:
+        # Only within the file; duplicates of other files are collapsed by the next full ingestion
+        deduped = dedupe_documents([(path, *built)])
+        built = deduped[0][1:] if deduped else None
+    # Embed before deleting, so the file stays searchable until its new chunks are ready
+    embeddings = embed_fn(built[0]) if built else None
+    check_embedding_dimensions(collection, embeddings)
+    if parents is not None:
+        parents.replace_source(collection.name, os.path.basename(path), built[3] if built else [])
+    # Delete by source rather than by id, so chunks beyond a shrunk file's new length go too
+    collection.delete(where={"source": os.path.basename(path)})
+    if not built:
+        return 0
+    chunks, metadatas, ids, _ = built
+    collection.add(embeddings=embeddings, documents=chunks, metadatas=metadatas, ids=ids)
+    return len(chunks)
 
-            chunks = []
-            for row in rows:
-                # If a CSV row is very long, chunk it further
-                if len(row) > CSV_MAX_CHUNK:
-                    chunks.extend(chunk_long_text(row, CSV_MAX_CHUNK))
-                else:
-                    chunks.append(row)
-
-            print(f"    ✅ {os.path.basename(path)} → {len(chunks)} chunks (CSV)")
-            embeddings = embed(chunks)
-            collection.add(
-                embeddings=embeddings,
-                documents=chunks,
-                metadatas=[{"department": dept, "source": os.path.basename(path), "type": "csv"} for _ in chunks],
-                ids=[f"{dept}-{os.path.basename(path)}-csv-{i}" for i in range(len(chunks))]
-            )
-    else:
-        print(f"  ⚠️  No CSV files found in {dept}")
+
+# Files whose duplicate chunks were collapsed into this file's stored chunks. They have to be
+# re-ingested when this file changes or is deleted, or their content would go with it.
+def collapsed_sources(collection, source):
+    stored = collection.get(where={"source": source}, include=["metadatas"])["metadatas"]
+    return sorted({name for metadata in stored for name in metadata.get("duplicate_sources", "").split(";") if name})
+
+
+# Embed and store every document of one department and its parent sections; embed_fn defaults to OpenAI
+def ingest_department(chroma_client, dept, data_path=DATA_PATH, embed_fn=None, pool=None, parents=None):
+    embed_fn = embed_fn or embed
+    folder = os.path.join(data_path, dept)
+    if not os.path.exists(folder):
+        print(f"⚠️  Folder missing for department: {dept}. Skipping.")
+        return None
+
+    # Get or create a collection in ChromaDB for the current department
+    collection = get_department_collection(chroma_client, dept)
+    print(f"Processing department: {dept}")
+
+    for path, chunks, metadatas, ids, file_parents in build_department_documents(dept, folder, pool):
+        # Generate embeddings for the chunks
+        embeddings = embed_fn(chunks)
+        check_embedding_dimensions(collection, embeddings)
+        # Add chunks, embeddings, metadata, and unique IDs to the ChromaDB collection
+        collection.add(
+            embeddings=embeddings,
+            documents=chunks,
+            metadatas=metadatas,
+            ids=ids
+        )
+        if parents is not None and file_parents:
+            parents.add(collection.name, file_parents)
 
     # Verify collection after ingestion
     final_count = collection.count()
     print(f"✅ Finished ingesting all documents for {dept}. Total documents: {final_count}\n")
+    return collection
+
+
+def main():
+    load_api_key()
+    print(f"✅ Using embedding model: {EMBEDDING_MODEL}")
+
+    # ========= NEW GENERATION =========
+    # Ingest into a fresh directory so a running API keeps serving the current index meanwhile
+    generation, generation_path = create_generation(DB_PATH)
+    print(f"🆕 Building index generation {generation}")
+    chroma_client = get_chroma_client(generation_path)
+    # Parent sections of the parent-child index live next to the generation's Chroma files
+    parents = ParentStore(os.path.join(generation_path, PARENTS_FILE))
+
+    # ========= INGESTION LOOP =========
+    # Iterate through each department to ingest its documents
+    with parse_pool() as pool:
+        for dept in departments:
+            ingest_department(chroma_client, dept, pool=pool, parents=parents)
+
+    print("📄 Parsing throughput:")
+    for fmt, totals in sorted(parse_totals.items()):
+        rate = totals["bytes"] / totals["seconds"] / 1e6 if totals["seconds"] else 0.0
+        print(f"  - {fmt}: {totals['files']} files, {totals['bytes'] / 1e6:.2f} MB, {rate:.2f} MB/s")
+
+    # ========= FINAL VERIFICATION =========
+    print("🔍 Final verification:")
+    collections = chroma_client.list_collections()
+    for col in collections:
+        count = col.count()
+        print(f"  - {col.name}: {count} documents")
+    print(f"  - parent sections: {parents.count()}")
+    parents.close()
+    # Per-source centroids the query router ranks collections by
+    write_centroids(chroma_client, generation_path)
+
+    # ========= PUBLISH =========
+    # Repoint CURRENT; running APIs warm the new generation and swap to it without a restart
+    publish_generation(DB_PATH, generation)
+    print(f"✅ ALL DOCUMENTS INGESTED to {generation_path}")
+    print(f"✅ Published generation {generation} (CURRENT -> {generation})")
+    print(f"✅ Using embedding model: {EMBEDDING_MODEL} (ensure chatbot uses the same!)")
 
-# ========= FINAL VERIFICATION =========
-print("🔍 Final verification:")
-collections = chroma_client.list_collections()
-for col in collections:
-    count = col.count()
-    print(f"  - {col.name}: {count} documents")
 
-print(f"✅ ALL DOCUMENTS INGESTED to {DB_PATH}")
-print(f"✅ Using embedding model: {EMBEDDING_MODEL} (ensure chatbot uses the same!)")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+"""Ingestion jobs run inside the API.
+
+`POST /ingest/jobs` queues a job and a small worker pool runs it off the event
+loop. Its embedding calls go through the upstream scheduler at ingestion
+priority, so interactive queries keep their budget while a job runs.
+
+* `incremental` jobs re-embed the given files (or every file of the given
+  departments) and replace their chunks in the live index generation. A file
+  keeps its old chunks until its new ones are embedded, and files deleted
+  from data/ are dropped from the index.
+* `full` jobs rebuild every department into a new generation and publish it;
+  the index manager warms it and swaps it in (see app/index_store.py).
+
+Progress is kept on the job and streamed by `/ingest/jobs/{id}/events`.
+Cancellation is cooperative: incremental jobs stop between files, full jobs
+between embedding batches and discard their unpublished generation.
+"""
+import glob
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app import ingest_docs
+from app.index_store import bump_version, close_client, create_generation, open_client, publish_generation
+from app.parent_store import PARENTS_FILE, ParentStore
+from app.router import write_centroids
+from app.telemetry import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+INGEST_JOBS = REGISTRY.counter("finrag_ingest_jobs_total", "Finished ingestion jobs", ["mode", "status"])
+INGEST_CHUNKS = REGISTRY.counter("finrag_ingest_chunks_total", "Chunks embedded by ingestion jobs")
+
+
+class IngestMode(str, Enum):
+    INCREMENTAL = "incremental"
+    FULL = "full"
+
+
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+TERMINAL_STATUSES = (JobStatus.SUCCEEDED, JobStatus.FAILED, JobStatus.CANCELLED)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class IngestJob:
+    def __init__(self, mode: IngestMode, departments: List[str], files: List[Tuple[str, str]]):
+        self.id = uuid.uuid4().hex[:12]
+        self.mode = mode
+        self.departments = departments
+        self.files = files  # (department, path) pairs for file-set jobs
+        self.status = JobStatus.QUEUED
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self.generation: Optional[str] = None
+        self.files_total = 0
+        self.files_done = 0
+        self.chunks_embedded = 0
+        self.current_file: Optional[str] = None
+        # Bumped on every change so progress streams only send new snapshots
+        self.version = 0
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    def update(self, **changes):
+        with self._lock:
+            for name, value in changes.items():
+                setattr(self, name, value)
+            self.version += 1
+
+    def add_embedded(self, count: int):
+        with self._lock:
+            self.chunks_embedded += count
+            self.version += 1
+        INGEST_CHUNKS.inc(count)
+
+    def cancel(self):
+        self._cancel.set()
+
+    def check_cancelled(self):
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    @property
+    def done(self) -> bool:
+        return self.status in TERMINAL_STATUSES
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._lock:
+            end = self.finished_at or time.time()
+            elapsed = end - self.started_at if self.started_at else 0.0
+            return {
+                "id": self.id,
+                "mode": self.mode.value,
+                "status": self.status.value,
+                "departments": self.departments,
+                "files": [os.path.join(dept, os.path.basename(path)) for dept, path in self.files],
+                "generation": self.generation,
+                "files_total": self.files_total,
+                "files_done": self.files_done,
+                "current_file": self.current_file,
+                "chunks_embedded": self.chunks_embedded,
+                "elapsed_s": round(elapsed, 2),
+                "chunks_per_s": round(self.chunks_embedded / elapsed, 2) if elapsed else 0.0,
+                "cancel_requested": self._cancel.is_set(),
+                "error": self.error,
+                "created_at": self.created_at,
+                "finished_at": self.finished_at,
+            }
+
+
+class IngestJobManager:
+    def __init__(self, index_manager, embed_fn: Callable[[List[str]], List[List[float]]], db_path: str,
+                 data_path: str = ingest_docs.DATA_PATH, max_workers: int = 1, batch_size: int = 64,
+                 history: int = 100, parse_workers: int = ingest_docs.PARSE_WORKERS):
+        self.index_manager = index_manager
+        self.embed_fn = embed_fn
+        self.db_path = db_path
+        self.data_path = data_path
+        self.batch_size = batch_size
+        self.parse_workers = parse_workers
+        self.history = history
+        self._jobs: Dict[str, IngestJob] = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+
+    # ----- job bookkeeping -----
+    def resolve_files(self, files: List[str]) -> List[Tuple[str, str]]:
+        """Map paths relative to data/ onto (department, absolute path); raises ValueError outside data/"""
+        root = os.path.realpath(self.data_path)
+        resolved = []
+        for relative in files:
+            path = os.path.realpath(os.path.join(root, relative))
+            dept = os.path.relpath(path, root).split(os.sep)[0]
+            if not path.startswith(root + os.sep) or dept not in ingest_docs.departments \
+                    or os.path.dirname(path) != os.path.join(root, dept):
+                raise ValueError(f"Not a department document: {relative}")
+            if not path.endswith(ingest_docs.SUPPORTED_EXTENSIONS):
+                raise ValueError(f"Unsupported file type: {relative}")
+            resolved.append((dept, path))
+        return resolved
+
+    def submit(self, mode: IngestMode, departments: Optional[List[str]] = None,
+               files: Optional[List[str]] = None) -> IngestJob:
+        unknown = [dept for dept in departments or [] if dept not in ingest_docs.departments]
+        if unknown:
+            raise ValueError(f"Unknown departments: {', '.join(unknown)}")
+        if mode == IngestMode.FULL:
+            # A generation must hold every collection, so full jobs always rebuild all departments
+            departments, resolved = list(ingest_docs.departments), []
+        else:
+            resolved = self.resolve_files(files or [])
+            departments = departments or ([] if resolved else list(ingest_docs.departments))
+
+        return self._enqueue(IngestJob(mode, departments, resolved))
+
+    def submit_changes(self, changes: List[Tuple[str, str]]) -> IngestJob:
+        """Queue an incremental job for (department, path) pairs reported by the data watcher"""
+        return self._enqueue(IngestJob(IngestMode.INCREMENTAL, [], list(changes)))
+
+    def _enqueue(self, job: IngestJob) -> IngestJob:
+        with self._lock:
+            self._jobs[job.id] = job
+            finished = [j for j in self._jobs.values() if j.done]
+            for old in sorted(finished, key=lambda j: j.created_at)[:max(0, len(self._jobs) - self.history)]:
+                del self._jobs[old.id]
+        self._pool.submit(self._run, job)
+        logger.info(f"Queued {job.mode.value} ingestion job {job.id}")
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        return self._jobs.get(job_id)
+
+    def list(self) -> List[IngestJob]:
+        return sorted(self._jobs.values(), key=lambda j: j.created_at, reverse=True)
+
+    def cancel(self, job_id: str) -> Optional[IngestJob]:
+        job = self._jobs.get(job_id)
+        if job is not None and not job.done:
+            job.cancel()
+            if job.status == JobStatus.QUEUED:
+                job.update(status=JobStatus.CANCELLED, finished_at=time.time())
+        return job
+
+    def shutdown(self):
+        for job in self._jobs.values():
+            job.cancel()
+        self._pool.shutdown(wait=False)
+
+    # ----- execution -----
+    def _embed_batches(self, job: IngestJob, texts: List[str], cancellable: bool) -> List[List[float]]:
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            if cancellable:
+                job.check_cancelled()
+            batch = texts[start:start + self.batch_size]
+            vectors.extend(self.embed_fn(batch))
+            job.add_embedded(len(batch))
+        return vectors
+
+    def _run(self, job: IngestJob):
+        if job.done:  # Cancelled while queued
+            return
+        job.update(status=JobStatus.RUNNING, started_at=time.time())
+        status, error = JobStatus.SUCCEEDED, None
+        try:
+            if job.mode == IngestMode.FULL:
+                self._run_full(job)
+            else:
+                self._run_incremental(job)
+        except JobCancelled:
+            status = JobStatus.CANCELLED
+            logger.info(f"Ingestion job {job.id} cancelled")
+        except Exception as e:
+            status, error = JobStatus.FAILED, str(e)
+            logger.error(f"Ingestion job {job.id} failed: {e}")
+        # One update, so a progress stream never sees a final status without finished_at
+        job.update(status=status, error=error, current_file=None, finished_at=time.time())
+        INGEST_JOBS.inc(mode=job.mode.value, status=status.value)
+
+    def _department_files(self, collection, dept: str) -> List[str]:
+        """Files on disk plus files the collection still holds that were deleted from disk"""
+        folder = os.path.join(self.data_path, dept)
+        on_disk = sorted(path for path in glob.glob(os.path.join(folder, "*"))
+                         if path.endswith(ingest_docs.SUPPORTED_EXTENSIONS))
+        indexed = {metadata.get("source") for metadata in collection.get(include=["metadatas"])["metadatas"]}
+        deleted = sorted(os.path.join(folder, source) for source in indexed
+                         if source and not os.path.exists(os.path.join(folder, source)))
+        return on_disk + deleted
+
+    def _run_incremental(self, job: IngestJob):
+        active = self.index_manager.active
+        client = active.client
+        targets = list(job.files)
+        for dept in job.departments:
+            collection = ingest_docs.get_department_collection(client, dept)
+            targets.extend((dept, path) for path in self._department_files(collection, dept))
+        job.update(files_total=len(targets))
+
+        queued = {(dept, os.path.basename(path)) for dept, path in targets}
+        try:
+            for dept, path in targets:
+                job.check_cancelled()
+                job.update(current_file=os.path.join(dept, os.path.basename(path)))
+                collection = ingest_docs.get_department_collection(client, dept)
+                # Files deduplicated into this one lose their only copy with it; re-ingest them as well
+                for source in ingest_docs.collapsed_sources(collection, os.path.basename(path)):
+                    if (dept, source) not in queued:
+                        queued.add((dept, source))
+                        targets.append((dept, os.path.join(os.path.dirname(path), source)))
+                        job.update(files_total=len(targets))
+                # Not cancellable mid-file, so a file is never left half replaced
+                ingest_docs.replace_file(collection, dept, path,
+                                         embed_fn=lambda texts: self._embed_batches(job, texts, cancellable=False),
+                                         parents=active.parents)
+                job.update(files_done=job.files_done + 1)
+        finally:
+            if job.files_done:
+                try:
+                    if active.path:
+                        write_centroids(client, active.path, sorted({f"{dept}_docs" for dept, _ in targets}))
+                except Exception as e:
+                    # Routing falls back to the previous centroids; never fail the job over it
+                    logger.warning(f"Could not update routing centroids: {e}")
+                # Running queries drop their cached handles and counts
+                bump_version(self.db_path)
+
+    def _run_full(self, job: IngestJob):
+        generation, path = create_generation(self.db_path)
+        job.update(generation=generation)
+        client = open_client(path)
+        parents = ParentStore(os.path.join(path, PARENTS_FILE))
+        published = False
+        try:
+            documents = []
+            with ingest_docs.parse_pool(self.parse_workers) as pool:
+                for dept in job.departments:
+                    folder = os.path.join(self.data_path, dept)
+                    if os.path.exists(folder):
+                        documents.append((dept, ingest_docs.build_department_documents(dept, folder, pool)))
+            job.update(files_total=sum(len(files) for _, files in documents))
+
+            for dept, files in documents:
+                collection = ingest_docs.get_department_collection(client, dept)
+                for file_path, chunks, metadatas, ids, file_parents in files:
+                    job.update(current_file=os.path.join(dept, os.path.basename(file_path)))
+                    embeddings = self._embed_batches(job, chunks, cancellable=True)
+                    ingest_docs.check_embedding_dimensions(collection, embeddings)
+                    collection.add(embeddings=embeddings, documents=chunks, metadatas=metadatas, ids=ids)
+                    if file_parents:
+                        parents.add(collection.name, file_parents)
+                    job.update(files_done=job.files_done + 1)
+
+            job.check_cancelled()
+            write_centroids(client, path)
+            # The API opens the generation's parent store itself when it swaps
+            parents.close()
+            publish_generation(self.db_path, generation)
+            published = True
+            # Swap now instead of waiting for the next reload check
+            self.index_manager.check_for_new_generation()
+        finally:
+            if not published:
+                parents.close()
+                close_client(client)
+                shutil.rmtree(path, ignore_errors=True)
@@ -2,8 +2,11 @@ import os
 import chromadb
 from chromadb.config import Settings
 
+from app.index_store import current_generation_path
+
 ROOT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-DB_PATH = os.path.join(ROOT_PATH, "chroma_db")
+# Full ingestions write generations under chroma_db/generations; list the one CURRENT points at
+DB_PATH = current_generation_path(os.path.join(ROOT_PATH, "chroma_db"))
 
 client = chromadb.Client(Settings(persist_directory=DB_PATH, is_persistent=True))
 
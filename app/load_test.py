@@ -0,0 +1,421 @@
+"""Load generator for the FinRAG API.
+
+Drives `/auth/login` and `/chat/query` with a weighted mix of roles and
+reports throughput, latency percentiles and error rates per endpoint. Point the
+API at app/fake_openai.py to load test without spending OpenAI quota:
+
+    python -m app.fake_openai --port 8100 &
+    OPENAI_BASE_URL=http://localhost:8100/v1 OPENAI_API_KEY=sk-fake uvicorn app.main:app --port 8000 &
+    python -m app.load_test --users 20 --duration 60 --fake-openai-url http://localhost:8100
+
+Closed loop (`--users`): each virtual user logs in, asks `--queries-per-session`
+questions with exponential think time, then starts a new session.
+Open loop (`--rate`): queries arrive as a Poisson process regardless of how fast
+the API answers, and latency is measured from the scheduled arrival time so
+queueing delay is not hidden.
+Burst (`--burst N`): N users of one role ask the same question at the same
+moment, as after a company-wide announcement; compare the upstream call counts
+with QUERY_COALESCING=1 and 0 on the API.
+Replay (`--replay log.jsonl`): `--users` workers send the questions of a log
+written with `--record` in order, once each, so two API configurations can be
+compared on exactly the same traffic.
+
+Conversation (`--conversation-turns 20`): one user holds a conversation of
+alternating questions and follow-ups ("And for Q3?") and the report lists the
+prompt tokens of every turn, next to the size of the full transcript that
+sending the whole history would have cost.
+
+Batch (`--batch 500`): one user of `--batch-role` sends that many distinct
+questions to `/chat/batch` and times each streamed answer from the start of
+the request; with `--batch-loop` the same questions go one at a time to
+`/chat/query`, as a job without the batch endpoint would send them. Compare
+the two `throughput_rps` figures.
+
+With `--fake-openai-url` the report includes the upstream token counts and an
+estimated cost at PRICES, with cached prompt tokens at the discounted rate.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import time
+import uuid
+from typing import Dict, List, Optional
+
+import httpx
+
+ROOT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+QUESTIONS_PATH = os.path.join(ROOT_PATH, "benchmarks", "retrieval_questions.json")
+
+# Demo accounts from USERS_DB in app/main.py
+ROLE_USERS = {
+    "finance": ("alice", "fin123"),
+    "marketing": ("bob", "mkt123"),
+    "hr": ("charlie", "hr123"),
+    "engineering": ("dave", "eng123"),
+    "c_level": ("ceo", "ceo123"),
+    "employee": ("eve", "emp123"),
+}
+
+# USD per million tokens: (prompt, cached prompt, completion)
+PRICES = {
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+}
+
+# Asked in turn after each question of a --conversation-turns run
+FOLLOW_UPS = ["And for Q3?", "What about 2023?", "Can you explain that in more detail?", "How about Europe?"]
+
+# Most traffic comes from general employees asking handbook questions
+DEFAULT_ROLE_MIX = "employee=40,finance=15,marketing=15,hr=10,engineering=15,c_level=5"
+
+
+def parse_role_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for part in spec.split(","):
+        role, _, weight = part.partition("=")
+        if role.strip() not in ROLE_USERS:
+            raise ValueError(f"Unknown role in mix: {role}")
+        mix[role.strip()] = float(weight or 1)
+    return mix
+
+
+def load_questions(path: str = QUESTIONS_PATH) -> Dict[str, List[str]]:
+    with open(path, "r", encoding="utf-8") as f:
+        questions = json.load(f)["questions"]
+    by_role: Dict[str, List[str]] = {}
+    for question in questions:
+        by_role.setdefault(question["role"], []).append(question["question"])
+    return by_role
+
+
+def load_replay(path: str) -> List[Dict[str, str]]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def estimate_cost(upstream_calls: Dict[str, int]) -> float:
+    """USD for the chat tokens counted by the fake server, per model"""
+    total = 0.0
+    for model, (prompt_price, cached_price, completion_price) in PRICES.items():
+        prompt = upstream_calls.get(f"prompt_tokens:{model}", 0)
+        cached = upstream_calls.get(f"cached_prompt_tokens:{model}", 0)
+        completion = upstream_calls.get(f"completion_tokens:{model}", 0)
+        total += ((prompt - cached) * prompt_price + cached * cached_price + completion * completion_price) / 1e6
+    return round(total, 4)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))]
+
+
+class EndpointStats:
+    def __init__(self):
+        self.latencies_ms: List[float] = []
+        self.statuses: Dict[str, int] = {}
+
+    def record(self, latency_s: float, status: str):
+        self.latencies_ms.append(latency_s * 1000)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def summary(self, elapsed_s: float) -> Dict[str, object]:
+        total = len(self.latencies_ms)
+        errors = sum(count for status, count in self.statuses.items() if status != "200")
+        return {
+            "requests": total,
+            "throughput_rps": round(total / elapsed_s, 2) if elapsed_s else 0.0,
+            "error_rate": round(errors / total, 4) if total else 0.0,
+            "statuses": dict(sorted(self.statuses.items())),
+            "p50_ms": round(percentile(self.latencies_ms, 50), 1),
+            "p90_ms": round(percentile(self.latencies_ms, 90), 1),
+            "p95_ms": round(percentile(self.latencies_ms, 95), 1),
+            "p99_ms": round(percentile(self.latencies_ms, 99), 1),
+            "max_ms": round(max(self.latencies_ms), 1) if total else 0.0,
+        }
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.role_mix = parse_role_mix(args.role_mix)
+        self.questions = load_questions(args.questions)
+        self.stats: Dict[str, EndpointStats] = {"/auth/login": EndpointStats(), "/chat/query": EndpointStats()}
+        if args.batch and not args.batch_loop:
+            self.stats["/chat/batch"] = EndpointStats()
+        self.tokens: Dict[str, str] = {}
+        self.rng = random.Random(args.seed)
+        self.replay = load_replay(args.replay) if args.replay else None
+        self.recorded: List[Dict[str, str]] = []
+
+    def pick_role(self) -> str:
+        roles, weights = zip(*self.role_mix.items())
+        return self.rng.choices(roles, weights=weights)[0]
+
+    def pick_question(self, role: str) -> str:
+        return self.rng.choice(self.questions.get(role) or self.questions["employee"])
+
+    async def _timed(self, endpoint: str, request, started: Optional[float] = None):
+        started = started if started is not None else time.perf_counter()
+        try:
+            response = await request
+            status = str(response.status_code)
+        except httpx.TimeoutException:
+            response, status = None, "timeout"
+        except httpx.HTTPError as e:
+            response, status = None, type(e).__name__
+        self.stats[endpoint].record(time.perf_counter() - started, status)
+        return response if status == "200" else None
+
+    async def login(self, client: httpx.AsyncClient, role: str, started: Optional[float] = None) -> Optional[str]:
+        username, password = ROLE_USERS[role]
+        response = await self._timed("/auth/login", client.post(
+            "/auth/login", json={"username": username, "password": password}), started)
+        if response is None:
+            return None
+        token = response.json()["access_token"]
+        self.tokens[role] = token
+        return token
+
+    def query_body(self, question: str) -> Dict[str, object]:
+        body = {"question": question, "max_results": self.args.max_results}
+        if self.args.retrieval_mode:
+            body["retrieval_mode"] = self.args.retrieval_mode
+        return body
+
+    async def query(self, client: httpx.AsyncClient, role: str, token: str, started: Optional[float] = None,
+                    question: Optional[str] = None):
+        question = question or self.pick_question(role)
+        if self.args.record:
+            self.recorded.append({"role": role, "question": question})
+        await self._timed("/chat/query", client.post(
+            "/chat/query", json=self.query_body(question),
+            headers={"Authorization": f"Bearer {token}"}), started)
+
+    async def conversation(self, client: httpx.AsyncClient, role: str, turns: int) -> List[Dict[str, object]]:
+        """One conversation of alternating questions and follow-ups; per-turn token counts"""
+        token = await self.login(client, role)
+        if token is None:
+            return []
+        conversation_id = str(uuid.uuid4())
+        questions = self.questions.get(role) or self.questions["employee"]
+        rows, transcript_chars = [], 0
+        for turn in range(turns):
+            if turn % 2 == 0:
+                question = questions[turn // 2 % len(questions)]
+            else:
+                question = FOLLOW_UPS[turn // 2 % len(FOLLOW_UPS)]
+            body = dict(self.query_body(question), conversation_id=conversation_id)
+            response = await self._timed("/chat/query", client.post(
+                "/chat/query", json=body, headers={"Authorization": f"Bearer {token}"}))
+            if response is None:
+                continue
+            data = response.json()
+            debug = data.get("debug_info") or {}
+            details = debug.get("conversation") or {}
+            rows.append({
+                "turn": turn + 1,
+                "question": question,
+                "standalone_question": details.get("standalone_question"),
+                "rewrite": details.get("rewrite"),
+                "prompt_tokens": (debug.get("usage") or {}).get("prompt_tokens"),
+                "history_tokens": details.get("history_tokens"),
+                "transcript_tokens": transcript_chars // 4,
+            })
+            transcript_chars += len(question) + len(data["answer"])
+        return rows
+
+    def batch_questions(self) -> List[str]:
+        """--batch distinct questions, as a nightly job asking every question of a checklist would send"""
+        questions = self.questions.get(self.args.batch_role) or self.questions["employee"]
+        return [f"{questions[i % len(questions)]} (#{i + 1})" for i in range(self.args.batch)]
+
+    async def batch(self, client: httpx.AsyncClient, role: str):
+        """One /chat/batch request, or the same questions looped through /chat/query with --batch-loop"""
+        token = await self.login(client, role)
+        if token is None:
+            return
+        questions = self.batch_questions()
+        headers = {"Authorization": f"Bearer {token}"}
+        if self.args.batch_loop:
+            for question in questions:
+                await self.query(client, role, token, question=question)
+            return
+        stats = self.stats["/chat/batch"]
+        started = time.perf_counter()
+        try:
+            async with client.stream("POST", "/chat/batch", headers=headers, json={
+                    "questions": questions, "max_results": self.args.max_results}) as response:
+                if response.status_code != 200:
+                    stats.record(time.perf_counter() - started, str(response.status_code))
+                    return
+                async for line in response.aiter_lines():
+                    item = json.loads(line) if line.strip() else {}
+                    if "index" in item:
+                        stats.record(time.perf_counter() - started, "error" if "error" in item else "200")
+        except httpx.TimeoutException:
+            stats.record(time.perf_counter() - started, "timeout")
+        except httpx.HTTPError as e:
+            stats.record(time.perf_counter() - started, type(e).__name__)
+
+    async def replay_worker(self, client: httpx.AsyncClient, entries):
+        for entry in entries:
+            role = entry["role"]
+            token = self.tokens.get(role) or await self.login(client, role)
+            if token is not None:
+                await self.query(client, role, token, question=entry["question"])
+
+    async def virtual_user(self, client: httpx.AsyncClient, deadline: float):
+        role = self.pick_role()
+        while time.perf_counter() < deadline:
+            token = await self.login(client, role)
+            if token is None:
+                await asyncio.sleep(1)
+                continue
+            for _ in range(self.args.queries_per_session):
+                if time.perf_counter() >= deadline:
+                    return
+                await self.query(client, role, token)
+                if self.args.think_time:
+                    await asyncio.sleep(self.rng.expovariate(1000 / self.args.think_time))
+
+    async def arrival(self, client: httpx.AsyncClient, scheduled: float):
+        role = self.pick_role()
+        token = self.tokens.get(role)
+        # A fresh session logs in first; both calls are timed from the scheduled arrival
+        if token is None or self.rng.random() < 1 / self.args.queries_per_session:
+            token = await self.login(client, role, started=scheduled)
+        if token is not None:
+            await self.query(client, role, token, started=scheduled)
+
+    async def run(self) -> Dict[str, object]:
+        args = self.args
+        limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+        async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+            upstream_before = await self.upstream_stats()
+            start = time.perf_counter()
+            deadline = start + args.duration
+
+            conversation = None
+            if args.conversation_turns:
+                conversation = await self.conversation(client, args.conversation_role, args.conversation_turns)
+            elif args.batch:
+                await self.batch(client, args.batch_role)
+            elif self.replay is not None:
+                entries = iter(self.replay)
+                await asyncio.gather(*(self.replay_worker(client, entries) for _ in range(args.users)))
+            elif args.burst:
+                token = await self.login(client, args.burst_role)
+                for i in range(args.bursts if token else 0):
+                    if i:
+                        await asyncio.sleep(args.burst_interval)
+                    question = args.burst_question or self.pick_question(args.burst_role)
+                    await asyncio.gather(*(
+                        self._timed("/chat/query", client.post(
+                            "/chat/query", json=self.query_body(question),
+                            headers={"Authorization": f"Bearer {token}"}))
+                        for _ in range(args.burst)))
+            elif args.rate:
+                tasks = []
+                scheduled = start
+                while scheduled < deadline:
+                    delay = scheduled - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    tasks.append(asyncio.create_task(self.arrival(client, scheduled)))
+                    scheduled += self.rng.expovariate(args.rate)
+                await asyncio.gather(*tasks)
+            else:
+                await asyncio.gather(*(self.virtual_user(client, deadline) for _ in range(args.users)))
+
+            elapsed = time.perf_counter() - start
+            upstream_after = await self.upstream_stats()
+
+        report = {
+            "config": {k: v for k, v in vars(args).items() if k not in ("questions",)},
+            "elapsed_s": round(elapsed, 2),
+            "endpoints": {endpoint: stats.summary(elapsed) for endpoint, stats in self.stats.items()},
+        }
+        if conversation is not None:
+            report["conversation"] = conversation
+        if upstream_after is not None:
+            report["upstream_calls"] = {key: value - upstream_before.get(key, 0)
+                                        for key, value in upstream_after.items()}
+            report["estimated_cost_usd"] = estimate_cost(report["upstream_calls"])
+        if args.record:
+            with open(args.record, "w", encoding="utf-8") as f:
+                f.writelines(json.dumps(entry) + "\n" for entry in self.recorded)
+        return report
+
+    async def upstream_stats(self) -> Optional[Dict[str, int]]:
+        """Call counters from app/fake_openai.py, when it is the upstream"""
+        if not self.args.fake_openai_url:
+            return None
+        async with httpx.AsyncClient(base_url=self.args.fake_openai_url, timeout=5) as client:
+            return (await client.get("/_stats")).json()
+
+
+def print_report(report: Dict[str, object]):
+    print(f"\nElapsed: {report['elapsed_s']}s")
+    if "conversation" in report:
+        print(f"\n{'turn':>4} {'prompt':>7} {'history':>8} {'transcript':>11}  rewrite      question")
+        for row in report["conversation"]:
+            print(f"{row['turn']:>4} {row['prompt_tokens'] or '-':>7} {row['history_tokens'] or 0:>8} "
+                  f"{row['transcript_tokens']:>11}  {row['rewrite'] or '-':<12} {(row['standalone_question'] or '')[:80]}")
+    for endpoint, summary in report["endpoints"].items():
+        print(f"\n{endpoint}")
+        for key, value in summary.items():
+            print(f"  {key:<16} {value}")
+    if "upstream_calls" in report:
+        print("\nUpstream OpenAI calls")
+        for key, value in sorted(report["upstream_calls"].items()):
+            print(f"  {key:<28} {value}")
+        print(f"\nEstimated chat cost: ${report['estimated_cost_usd']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load generator for /auth/login and /chat/query")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to generate load")
+    parser.add_argument("--users", type=int, default=10, help="closed-loop virtual users")
+    parser.add_argument("--rate", type=float, help="open-loop arrivals per second (overrides --users)")
+    parser.add_argument("--burst", type=int, help="fire this many identical queries at once (overrides --users)")
+    parser.add_argument("--bursts", type=int, default=1, help="number of bursts")
+    parser.add_argument("--burst-interval", type=float, default=2, help="seconds between bursts")
+    parser.add_argument("--burst-role", default="employee", choices=sorted(ROLE_USERS))
+    parser.add_argument("--burst-question", help="question for every burst (default: one per burst)")
+    parser.add_argument("--role-mix", default=DEFAULT_ROLE_MIX, help="role=weight pairs")
+    parser.add_argument("--queries-per-session", type=int, default=5)
+    parser.add_argument("--think-time", type=float, default=0, help="mean think time between queries (ms)")
+    parser.add_argument("--max-results", type=int, default=10)
+    parser.add_argument("--retrieval-mode", help="retrieval_mode sent with every query")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--max-connections", type=int, default=200)
+    parser.add_argument("--questions", default=QUESTIONS_PATH)
+    parser.add_argument("--fake-openai-url", help="fake OpenAI base URL, to report upstream call counts")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="write the report as JSON to this path")
+    parser.add_argument("--record", help="write the questions asked to this JSONL file")
+    parser.add_argument("--replay", help="send the questions of a --record file in order (overrides --rate/--burst)")
+    parser.add_argument("--conversation-turns", type=int, help="hold one conversation of this many turns instead")
+    parser.add_argument("--conversation-role", default="finance", choices=sorted(ROLE_USERS))
+    parser.add_argument("--batch", type=int, help="send this many questions through /chat/batch instead")
+    parser.add_argument("--batch-role", default="finance", choices=sorted(ROLE_USERS))
+    parser.add_argument("--batch-loop", action="store_true", help="send the --batch questions one by one instead")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(LoadTest(args).run())
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
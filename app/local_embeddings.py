@@ -0,0 +1,118 @@
+"""Offline embedding functions for benchmarks and local testing.
+
+Each embedder is a callable taking a list of texts and returning a list of
+vectors, the same contract as `RAGEngine.embed_text` and `ingest_docs.embed`.
+"""
+import hashlib
+import json
+import math
+import os
+import re
+from typing import Callable, Dict, List, Optional
+
+from app.ingest_docs import shorten_embeddings
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+class HashingEmbedder:
+    """Deterministic bag-of-words embedding using signed feature hashing.
+
+    Needs no model download or network access, and keeps enough lexical signal
+    (unigrams and bigrams) for retrieval benchmarks to be meaningful.
+    """
+
+    name = "hashing"
+
+    def __init__(self, dimensions: int = 512):
+        self.dimensions = dimensions
+
+    def _features(self, text: str) -> List[str]:
+        tokens = _TOKEN_RE.findall(text.lower())
+        return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+    def embed_one(self, text: str) -> List[float]:
+        vector = [0.0] * self.dimensions
+        for feature in self._features(text):
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dimensions
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        return [x / norm for x in vector]
+
+    def __call__(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_one(text) for text in texts]
+
+
+class SentenceTransformerEmbedder:
+    """Local sentence-transformers model, as used by app/vector_store.py"""
+
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2"):
+        from sentence_transformers import SentenceTransformer
+
+        self.name = f"st:{model_name}"
+        self.model = SentenceTransformer(model_name)
+
+    def __call__(self, texts: List[str]) -> List[List[float]]:
+        return self.model.encode(texts, normalize_embeddings=True).tolist()
+
+
+class FixtureEmbedder:
+    """Replays embeddings recorded to a JSON file, keyed by a hash of the text.
+
+    With `record=True`, texts missing from the fixture are embedded with
+    `fallback` (normally the OpenAI embedder) and written back on `save()`, so a
+    fixture can be captured once online and replayed offline afterwards.
+    """
+
+    def __init__(self, path: str, fallback: Optional[Callable[[List[str]], List[List[float]]]] = None,
+                 record: bool = False):
+        self.name = f"fixture:{os.path.basename(path)}"
+        self.path = path
+        self.fallback = fallback
+        self.record = record
+        self.vectors: Dict[str, List[float]] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.vectors = json.load(f)["vectors"]
+
+    @staticmethod
+    def key(text: str) -> str:
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def __call__(self, texts: List[str]) -> List[List[float]]:
+        missing = [text for text in texts if self.key(text) not in self.vectors]
+        if missing:
+            if not (self.record and self.fallback):
+                raise KeyError(f"{len(missing)} texts are not in fixture {self.path}; re-record it")
+            for text, vector in zip(missing, self.fallback(missing)):
+                self.vectors[self.key(text)] = vector
+        return [self.vectors[self.key(text)] for text in texts]
+
+    def save(self):
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({"vectors": self.vectors}, f)
+
+
+class ShortenedEmbedder:
+    """Another embedder's vectors truncated to `dimensions` and re-normalised, as EMBEDDING_DIMENSIONS does"""
+
+    def __init__(self, embedder, dimensions: int):
+        self.name = f"{embedder.name}@{dimensions}"
+        self.embedder = embedder
+        self.dimensions = dimensions
+
+    def __call__(self, texts: List[str]) -> List[List[float]]:
+        return shorten_embeddings(self.embedder(texts), self.dimensions)
+
+
+def get_embedder(spec: str):
+    """Build an embedder from a spec: `hashing[:dims]`, `st[:model]` or `fixture:<path>`"""
+    kind, _, arg = spec.partition(":")
+    if kind == "hashing":
+        return HashingEmbedder(int(arg) if arg else 512)
+    if kind == "st":
+        return SentenceTransformerEmbedder(arg or "all-MiniLM-L6-v2")
+    if kind == "fixture":
+        return FixtureEmbedder(arg)
+    raise ValueError(f"Unknown embedder spec: {spec}")
@@ -6,14 +6,60 @@ from enum import Enum
 from fastapi import FastAPI, HTTPException, Depends, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
-import chromadb
-from chromadb.config import Settings
 from openai import OpenAI
+import asyncio
 import hashlib
+import json
 import logging
+import re
+import threading
+import time
 from dotenv import load_dotenv
 
+from app import ingest_docs
+from app.cascade import LARGE_TIER, SMALL_TIER, check_draft
+from app.conversations import Conversation, ConversationStore, rewrite_followup
+from app.expansion import expansion_prompt, parse_expansions, reciprocal_rank_fusion
+from app.extractive import EXTRACTIVE_TIER, is_lookup, load_extractor
+from app.health import HealthMonitor
+from app.index_store import IndexManager
+from app.ingest_jobs import IngestJobManager, IngestMode
+from app.periods import in_period, period_filter
+from app.query_cache import QueryCache
+from app.router import CollectionRouter
+from app.scheduler import Priority, UpstreamBusy, UpstreamScheduler, estimate_tokens
+from app.telemetry import REGISTRY, MetricsMiddleware, span, start_trace
+from app.watcher import DataWatcher
+
+UPSTREAM_CALLS = REGISTRY.counter(
+    "finrag_upstream_calls_total", "Calls made to the OpenAI API", ["endpoint"])
+COALESCED_REQUESTS = REGISTRY.counter(
+    "finrag_coalesced_requests_total", "Queries answered by joining an identical in-flight query")
+PREFETCHES = REGISTRY.counter(
+    "finrag_prefetches_total", "Speculative retrievals requested through /chat/prefetch", ["status"])
+PROMPT_TOKENS = REGISTRY.counter(
+    "finrag_prompt_tokens_total", "Prompt tokens sent to chat models, by cascade tier", ["tier"])
+CACHED_PROMPT_TOKENS = REGISTRY.counter(
+    "finrag_cached_prompt_tokens_total", "Prompt tokens served from the upstream prompt cache", ["tier"])
+GENERATION_SECONDS = REGISTRY.histogram(
+    "finrag_generation_seconds", "Chat completion latency per model tier", ["tier"])
+ANSWERS = REGISTRY.counter(
+    "finrag_answers_total", "Generated answers, by the model tier that produced them", ["tier"])
+ESCALATIONS = REGISTRY.counter(
+    "finrag_cascade_escalations_total", "Questions answered by the large tier instead of the small one", ["reason"])
+REWRITES = REGISTRY.counter(
+    "finrag_query_rewrites_total", "Conversation turns, by how the question was made standalone", ["method"])
+ANSWER_SECONDS = REGISTRY.histogram(
+    "finrag_answer_seconds", "End-to-end /chat/query latency, by the tier that answered", ["tier"])
+QUERY_EXPANSIONS = REGISTRY.counter(
+    "finrag_query_expansions_total", "multi_query and hyde retrievals, by whether the question was expanded",
+    ["method", "outcome"])
+BATCH_QUESTIONS = REGISTRY.counter(
+    "finrag_batch_questions_total", "Questions answered through /chat/batch", ["status"])
+
 load_dotenv()
 
 # Configure logging
@@ -31,6 +77,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
 
 # Security
 security = HTTPBearer()
@@ -47,17 +94,121 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 if not OPENAI_API_KEY:
     raise ValueError("OPENAI_API_KEY environment variable not set")
 
-client_oai = OpenAI(api_key=OPENAI_API_KEY)
+# Retries are left to the upstream scheduler so backoff respects the shared budgets
+client_oai = OpenAI(api_key=OPENAI_API_KEY, max_retries=0)
 EMBEDDING_MODEL = "text-embedding-3-small"
 CHAT_MODEL = "gpt-4o"
 
+# Answer with SMALL_CHAT_MODEL first and escalate to CHAT_MODEL when retrieval confidence is below
+# CASCADE_MIN_CONFIDENCE or the draft fails the self-check in app/cascade.py; 0 always uses CHAT_MODEL
+MODEL_CASCADE = os.getenv("MODEL_CASCADE", "1") == "1"
+SMALL_CHAT_MODEL = os.getenv("SMALL_CHAT_MODEL", "gpt-4o-mini")
+CASCADE_MIN_CONFIDENCE = float(os.getenv("CASCADE_MIN_CONFIDENCE", "0.35"))
+ANSWER_MAX_TOKENS = 800
+
+# Identical for every request so it opens every prompt; the role and context follow it (see _build_messages)
+ANSWER_INSTRUCTIONS = """You are a helpful assistant for FinSolve Technologies with role-based access control.
+
+IMPORTANT INSTRUCTIONS:
+1. Answer the user's question using ONLY the provided context documents
+2. Provide information relevant to the user's role, given in the next message
+3. Be comprehensive and detailed when the context supports it
+4. If the context has relevant information but it's partial, provide what you can and mention limitations
+5. Do NOT refuse to answer if there is relevant information in the context
+6. Format your response clearly and professionally
+7. If you need to make connections between different pieces of information in the context, that's allowed
+
+Context Quality: The documents provided have been pre-filtered for relevance to the user's question."""
+
+# Quote the answering span of the top chunk instead of calling a chat model when a lookup question's top hit
+# scores at least EXTRACTIVE_MIN_SIMILARITY and the extractor (app/extractive.py) is at least
+# EXTRACTIVE_MIN_SCORE sure. EXTRACTIVE_MODEL names a local question-answering model to use instead of the
+# lexical extractor, e.g. distilbert-base-cased-distilled-squad; it is downloaded at startup.
+EXTRACTIVE_ANSWERS = os.getenv("EXTRACTIVE_ANSWERS", "1") == "1"
+EXTRACTIVE_MODEL = os.getenv("EXTRACTIVE_MODEL", "lexical")
+EXTRACTIVE_MIN_SIMILARITY = float(os.getenv("EXTRACTIVE_MIN_SIMILARITY", "0.5"))
+EXTRACTIVE_MIN_SCORE = float(os.getenv("EXTRACTIVE_MIN_SCORE", "0.6"))
+
+# Retrieval Setup
+ANSWER_CONTEXT_DOCS = 5  # Documents generate_answer places in the prompt
+DEFAULT_RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "fixed")
+ADAPTIVE_INITIAL_K = 3  # First-pass n_results per collection in adaptive mode
+ADAPTIVE_HIGH_CONFIDENCE = 0.45  # Hits at or above this count towards early termination
+ADAPTIVE_AMBIGUITY_MARGIN = 0.05  # Widen when the k-th hit scores this close to the best
+
+# "multi_query" and "hyde" search like "fixed" and, when the best hit scores below EXPANSION_SKIP_SIMILARITY,
+# also search with EXPANSION_QUERIES rephrasings or a hypothetical answer written by SMALL_CHAT_MODEL
+EXPANSION_SKIP_SIMILARITY = float(os.getenv("EXPANSION_SKIP_SIMILARITY", "0.45"))
+EXPANSION_QUERIES = int(os.getenv("EXPANSION_QUERIES", "3"))
+EXPANSION_MAX_TOKENS = 200
+
+# Rank a role's collections by centroid similarity and keyword rules, and search the top ROUTER_TOP_N only,
+# unless the ranking is too close to call or those collections answer below the confidence threshold
+QUERY_ROUTING = os.getenv("QUERY_ROUTING", "1") == "1"
+ROUTER_TOP_N = int(os.getenv("ROUTER_TOP_N", "2"))
+ROUTER_MIN_MARGIN = float(os.getenv("ROUTER_MIN_MARGIN", "0.05"))
+
+# Questions naming a quarter or year keep only chunks tagged with that period, whole-year or undated ones.
+# "post" over-fetches and drops off-period hits in Python; "where" pre-filters inside Chroma, which pays
+# a few milliseconds per clause at this corpus size; "off" disables it. A collection with no confident
+# on-period hit falls back to its unfiltered results.
+PERIOD_FILTER = os.getenv("PERIOD_FILTER", "post")
+PERIOD_OVERFETCH = 3  # Candidates fetched per result kept in "post" mode
+
+# Conversations: a turn sent with a conversation_id is rewritten into a standalone question before retrieval,
+# by rules or, when they cannot resolve it and QUERY_REWRITE=auto, by SMALL_CHAT_MODEL ("rules" never calls a
+# model). Prompts carry the last CONVERSATION_RECENT_TURNS turns and a bounded summary of the older ones.
+QUERY_REWRITE = os.getenv("QUERY_REWRITE", "auto")
+CONVERSATION_RECENT_TURNS = int(os.getenv("CONVERSATION_RECENT_TURNS", "2"))
+CONVERSATION_TTL = float(os.getenv("CONVERSATION_TTL", "1800"))  # Seconds an idle conversation is kept
+CONVERSATION_MAX_COUNT = 10000
+REWRITE_MAX_TOKENS = 80
+REWRITE_INSTRUCTIONS = ("Rewrite the user's follow-up as one standalone question that can be understood without "
+                        "the conversation. Keep every period, region and metric it refers to. If it already "
+                        "stands on its own, repeat it unchanged. Reply with the question only.")
+
+# /chat/batch embeds all questions in one call, queries each collection once for all of them, and generates
+# BATCH_CONCURRENCY answers at a time at a scheduler priority below interactive queries and prefetches
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "1000"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "16"))
+BATCH_EMBED_INPUTS = 2048  # Most inputs the embeddings API takes in one request
+
+# Concurrent identical questions share one retrieval and one completion
+QUERY_COALESCING = os.getenv("QUERY_COALESCING", "1") == "1"
+
+# Query embeddings and retrieval results, filled by /chat/prefetch while the user types; 0 disables
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "300"))
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+PREFETCH_MIN_CHARS = 8  # Shorter drafts are not worth an embedding call
+PREFETCH_JOIN_TIMEOUT = 5.0  # How long a query waits for a still-running prefetch of the same question
+
+# Upstream budgets; set them to the organisation's OpenAI rate limits
+upstream = UpstreamScheduler(
+    requests_per_minute=float(os.getenv("OPENAI_RPM", "500")),
+    tokens_per_minute=float(os.getenv("OPENAI_TPM", "200000")),
+    max_concurrency=int(os.getenv("OPENAI_MAX_CONCURRENCY", "16")),
+    max_queue_depth=int(os.getenv("UPSTREAM_MAX_QUEUE_DEPTH", "64")),
+    max_queue_wait=float(os.getenv("UPSTREAM_MAX_QUEUE_WAIT", "10")),
+)
+
 # ChromaDB Setup
-DB_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "../chroma_db"))
-chroma_client = chromadb.Client(Settings(
-    persist_directory=DB_PATH,
-    is_persistent=True,
-    anonymized_telemetry=False
-))
+DB_PATH = os.getenv("CHROMA_DB_PATH") or os.path.abspath(os.path.join(os.path.dirname(__file__), "../chroma_db"))
+# Serves the generation DB_PATH/CURRENT points at and swaps to new ones as ingestion publishes them
+INDEX_RELOAD_INTERVAL = float(os.getenv("INDEX_RELOAD_INTERVAL", "5"))
+index_manager = IndexManager(DB_PATH, check_interval=INDEX_RELOAD_INTERVAL)
+
+# Ingestion jobs submitted through /ingest/jobs
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))
+INGEST_PROGRESS_INTERVAL = 0.5  # Seconds between progress checks on /ingest/jobs/{id}/events
+
+# Ingest files as they change under data/<department>/
+WATCH_DATA = os.getenv("WATCH_DATA", "0") == "1"
+WATCH_DEBOUNCE = float(os.getenv("WATCH_DEBOUNCE", "2"))
+WATCH_POLL_INTERVAL = float(os.getenv("WATCH_POLL_INTERVAL", "2"))  # Only used without watchdog
+
+# Probes answer from state refreshed in the background, never from Chroma or OpenAI directly
+HEALTH_REFRESH_INTERVAL = float(os.getenv("HEALTH_REFRESH_INTERVAL", "30"))
+health_monitor = HealthMonitor(index_manager, upstream, refresh_interval=HEALTH_REFRESH_INTERVAL)
 
 
 # =============================================================================
@@ -72,6 +223,13 @@ class UserRole(str, Enum):
     EMPLOYEE = "employee"
 
 
+class RetrievalMode(str, Enum):
+    FIXED = "fixed"
+    ADAPTIVE = "adaptive"
+    MULTI_QUERY = "multi_query"
+    HYDE = "hyde"
+
+
 class LoginRequest(BaseModel):
     username: str
     password: str
@@ -80,6 +238,26 @@ class LoginRequest(BaseModel):
 class QueryRequest(BaseModel):
     question: str
     max_results: Optional[int] = 10  # Allow more results for better context
+    retrieval_mode: Optional[RetrievalMode] = None  # Defaults to RETRIEVAL_MODE
+    include_timings: bool = False  # Return per-stage timings in debug_info
+    conversation_id: Optional[str] = None  # Client-chosen id; follow-ups are read in the context of earlier turns
+
+
+class BatchQueryRequest(BaseModel):
+    questions: List[str]  # Up to BATCH_MAX_QUESTIONS; answers stream back as NDJSON in completion order
+    max_results: Optional[int] = 10
+
+
+class PrefetchRequest(BaseModel):
+    question: str  # The question as typed so far
+    max_results: Optional[int] = 10  # Should match the eventual /chat/query request
+    retrieval_mode: Optional[RetrievalMode] = None
+
+
+class IngestJobRequest(BaseModel):
+    mode: IngestMode = IngestMode.INCREMENTAL
+    departments: Optional[List[str]] = None  # Defaults to every department when no files are given
+    files: Optional[List[str]] = None  # Paths relative to data/, e.g. "hr/hr_data.csv"
 
 
 class LoginResponse(BaseModel):
@@ -98,6 +276,7 @@ class QueryResponse(BaseModel):
     confidence_score: float
     departments_searched: List[str]
     debug_info: Optional[Dict[str, Any]] = None  # For debugging
+    conversation_id: Optional[str] = None
 
 
 class User(BaseModel):
@@ -130,6 +309,9 @@ USERS_DB = {
                 hashed_password=hash_password("emp123"))
 }
 
+# Roles allowed to run ingestion jobs
+INGEST_ROLES = [UserRole.C_LEVEL]
+
 # Role-based access control mapping
 ROLE_COLLECTIONS = {
     UserRole.FINANCE: ["finance_docs", "general_docs"],
@@ -189,50 +371,160 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
         raise HTTPException(status_code=401, detail="Invalid token")
 
 
+def require_ingest_role(current_user: dict = Depends(verify_token)):
+    """Only roles in INGEST_ROLES may manage ingestion jobs"""
+    if current_user["role"] not in INGEST_ROLES:
+        raise HTTPException(status_code=403, detail="Your role cannot manage ingestion jobs")
+    return current_user
+
+
 # =============================================================================
 # IMPROVED RAG ENGINE
 # =============================================================================
 class RAGEngine:
-    def __init__(self):
+    def __init__(self, chroma=None, embedding_fn=None, cache_collections=True, parents=None, cache_queries=True,
+                 routing=QUERY_ROUTING, period_filtering=PERIOD_FILTER, cascade=MODEL_CASCADE,
+                 extractive=EXTRACTIVE_ANSWERS):
         self.rbac_manager = RBACManager()
+        # A fixed client and parent store (benchmarks) or the hot-swappable index generations under DB_PATH
+        self.indexes = IndexManager.for_client(chroma, cache_collections, parents) if chroma else index_manager
+        # Optional local embedding function (see app/local_embeddings.py) used instead of OpenAI
+        self.embedding_fn = embedding_fn
         # Lower confidence threshold for better recall
         self.min_confidence_threshold = 0.15  # Reduced from 0.3
-
-    def embed_text(self, texts: List[str]) -> List[List[float]]:
+        # Warmed by /chat/prefetch; embeddings are keyed by embedding_key(), retrievals by normalize_question()
+        cache_ttl = QUERY_CACHE_TTL if cache_queries else 0
+        self.embedding_cache = QueryCache("embedding", QUERY_CACHE_SIZE, cache_ttl)
+        self.retrieval_cache = QueryCache("retrieval", QUERY_CACHE_SIZE, cache_ttl)
+        self._pending_retrievals: Dict[tuple, threading.Event] = {}
+        self._pending_lock = threading.Lock()
+        # Only ever narrows the collections a role may search
+        self.router = CollectionRouter(ROUTER_TOP_N, ROUTER_MIN_MARGIN) if routing else None
+        self.period_filtering = period_filtering
+        self._dated_collections: tuple = (None, {})  # (index generation and version, {collection: has dated chunks})
+        self.cascade = cascade
+        self.extractor = load_extractor(EXTRACTIVE_MODEL) if extractive else None
+
+    def embed_text(self, texts: List[str], priority: Priority = Priority.INTERACTIVE) -> List[List[float]]:
         """Generate embeddings for text"""
+        if self.embedding_fn is not None:
+            with span("embedding"):
+                return self.embedding_fn(texts)
         try:
-            response = client_oai.embeddings.create(
-                model=EMBEDDING_MODEL,
-                input=texts
-            )
-            return [data.embedding for data in response.data]
+            UPSTREAM_CALLS.inc(endpoint="embeddings")
+            with span("embedding"):
+                response = upstream.call(
+                    lambda: client_oai.embeddings.create(
+                        model=EMBEDDING_MODEL,
+                        input=texts,
+                        **ingest_docs.embedding_options()
+                    ),
+                    priority=priority,
+                    estimated_tokens=sum(estimate_tokens(text) for text in texts),
+                    endpoint="embeddings"
+                )
+            embeddings = ingest_docs.shorten_embeddings([data.embedding for data in response.data])
+            health_monitor.record_embedding_dim(len(embeddings[0]))
+            return embeddings
+        except UpstreamBusy:
+            raise
         except Exception as e:
             logger.error(f"Embedding generation failed: {str(e)}")
             raise HTTPException(status_code=500, detail=f"Embedding generation failed: {str(e)}")
 
-    def retrieve_documents(self, query: str, allowed_collections: List[str], top_k: int = 10) -> tuple[
-        List[Dict], Dict]:
+    def embed_query(self, query: str, priority: Priority = Priority.INTERACTIVE) -> List[float]:
+        """Embed one question, reusing the embedding of a prefetched draft"""
+        key = embedding_key(query)
+        embedding = self.embedding_cache.get(key)
+        if embedding is None:
+            embedding = self.embed_text([query], priority=priority)[0]
+            self.embedding_cache.put(key, embedding)
+        return embedding
+
+    def retrieve_documents(self, query: str, allowed_collections: List[str], top_k: int = 10,
+                           mode: Optional[RetrievalMode] = None,
+                           priority: Priority = Priority.INTERACTIVE) -> tuple[List[Dict], Dict]:
         """Retrieve relevant documents from allowed collections with better error handling"""
         if not allowed_collections:
             return [], {"error": "No allowed collections"}
 
+        mode = RetrievalMode(mode or DEFAULT_RETRIEVAL_MODE)
+        start_time = time.perf_counter()
+
+        # One query stays on one generation even if a new one is swapped in meanwhile
+        index = self.indexes.active
+        cache_key = (normalize_question(query), tuple(allowed_collections), top_k, mode.value,
+                     index.name, index.collections.version)
+        cached = self.retrieval_cache.get(cache_key)
+        if cached is None and self.retrieval_cache.enabled:
+            with self._pending_lock:
+                pending = self._pending_retrievals.get(cache_key)
+            if pending is not None:
+                # A prefetch of this question is still running; its result beats starting over
+                pending.wait(timeout=PREFETCH_JOIN_TIMEOUT)
+                cached = self.retrieval_cache.get(cache_key)
+        if cached is not None:
+            documents, cached_debug = cached
+            return list(documents), {**cached_debug, "cache_hit": True,
+                                     "retrieval_ms": round((time.perf_counter() - start_time) * 1000, 2)}
+
+        done = threading.Event()
+        with self._pending_lock:
+            self._pending_retrievals.setdefault(cache_key, done)
+        try:
+            return self._retrieve(query, allowed_collections, top_k, mode, priority, index, cache_key, start_time)
+        finally:
+            with self._pending_lock:
+                if self._pending_retrievals.get(cache_key) is done:
+                    del self._pending_retrievals[cache_key]
+            done.set()
+
+    def _retrieve(self, query: str, allowed_collections: List[str], top_k: int, mode: RetrievalMode,
+                  priority: Priority, index, cache_key: tuple, start_time: float) -> tuple[List[Dict], Dict]:
+        """Embed the question and search the index; retrieve_documents handles the cache"""
         # Generate query embedding
         try:
-            query_embedding = self.embed_text([query])[0]
+            query_embedding = self.embed_query(query, priority)
+        except UpstreamBusy:
+            raise
         except Exception as e:
             logger.error(f"Failed to generate query embedding: {e}")
             return [], {"error": f"Query embedding failed: {e}"}
 
         all_results = []
-        debug_info = {"collections_tried": [], "collections_found": [], "total_docs": 0}
+        debug_info = {"collections_tried": [], "collections_found": [], "total_docs": 0,
+                      "collections_skipped": [], "retrieval_mode": mode.value, "vectors_scored": 0,
+                      "index_generation": index.name, "cache_hit": False, "collections_routed_out": [],
+                      "period_filter": period_filter(query) if self.period_filtering != "off" else None,
+                      "period_fallbacks": [], "collections_failed": []}
+        period_where = debug_info["period_filter"]
+
+        # Collections are searched in the order given, so callers list the most specific first
+        search_order, routed = allowed_collections, len(allowed_collections)
+        if self.router is not None:
+            with span("routing"):
+                search_order, routed, debug_info["routing_scores"] = self.router.route(
+                    query, query_embedding, allowed_collections, index.centroids())
+        target_hits = min(top_k, ANSWER_CONTEXT_DOCS)
+        high_confidence_hits = 0
+
+        for position, collection_name in enumerate(search_order):
+            if mode == RetrievalMode.ADAPTIVE and high_confidence_hits >= target_hits:
+                # Enough strong hits already; lower-priority collections cannot improve the prompt
+                debug_info["collections_skipped"].append(collection_name)
+                continue
+            if position >= routed and any(hit["similarity_score"] >= self.min_confidence_threshold
+                                          for hit in all_results):
+                # Ranked out by the router, and the collections it chose answered confidently
+                debug_info["collections_routed_out"].append(collection_name)
+                continue
 
-        for collection_name in allowed_collections:
             debug_info["collections_tried"].append(collection_name)
             try:
                 # Check if collection exists
                 try:
-                    collection = chroma_client.get_collection(collection_name)
-                    collection_count = collection.count()
+                    with span("collection_lookup"):
+                        collection, collection_count = index.collections.get(collection_name)
                     debug_info["collections_found"].append(collection_name)
                     debug_info["total_docs"] += collection_count
 
@@ -244,59 +536,470 @@ class RAGEngine:
 
                 except Exception as e:
                     logger.warning(f"Collection {collection_name} not found or inaccessible: {e}")
+                    debug_info["collections_failed"].append(collection_name)
                     continue
 
-                # Query the collection with better parameters
-                try:
-                    results = collection.query(
-                        query_embeddings=[query_embedding],
-                        n_results=min(top_k, collection_count),
-                        include=["documents", "distances", "metadatas"]
-                    )
-
-                    if not results["documents"] or not results["documents"][0]:
-                        logger.warning(f"No results returned from collection {collection_name}")
-                        continue
-
-                    # Process results
-                    for i, (doc, distance) in enumerate(zip(results["documents"][0], results["distances"][0])):
-                        # Better similarity calculation
-                        # ChromaDB uses cosine distance, convert to similarity
-                        similarity_score = max(0, 1 - distance)
-
-                        metadata = results.get("metadatas", [[{}]])[0][i] if results.get("metadatas") else {}
-
-                        all_results.append({
-                            "content": doc.strip(),
-                            "similarity_score": similarity_score,
-                            "source": collection_name,
-                            "metadata": metadata,
-                            "distance": distance
-                        })
-
-                        logger.debug(
-                            f"Document from {collection_name}: similarity={similarity_score:.3f}, distance={distance:.3f}")
-
-                except Exception as e:
-                    logger.error(f"Error querying collection {collection_name}: {e}")
-                    continue
-
+                index_dimensions = (collection.metadata or {}).get("embedding_dimensions")
+                if index_dimensions and index_dimensions != len(query_embedding):
+                    raise HTTPException(
+                        status_code=503,
+                        detail=f"Index holds {index_dimensions}-dimensional embeddings but queries are "
+                               f"{len(query_embedding)}-dimensional; set EMBEDDING_DIMENSIONS to match the index")
+
+                max_k = min(top_k, collection_count)
+                if mode == RetrievalMode.ADAPTIVE:
+                    k = min(ADAPTIVE_INITIAL_K, max_k)
+                    hits = self._search(index, collection, collection_count, query_embedding, k, period_where,
+                                        debug_info)
+                    if len(hits) == k < max_k and self._is_ambiguous(hits):
+                        logger.debug(f"Widening {collection_name} from {k} to {max_k} results")
+                        hits = self._search(index, collection, collection_count, query_embedding, max_k, period_where,
+                                            debug_info)
+                else:
+                    hits = self._search(index, collection, collection_count, query_embedding, max_k, period_where,
+                                        debug_info)
+
+                high_confidence_hits += sum(1 for hit in hits if hit["similarity_score"] >= ADAPTIVE_HIGH_CONFIDENCE)
+                all_results.extend(hits)
+
+            except HTTPException:
+                raise
             except Exception as e:
                 logger.error(f"Error accessing collection {collection_name}: {e}")
+                debug_info["collections_failed"].append(collection_name)
                 continue
 
         # Sort by similarity score and return top results
         all_results.sort(key=lambda x: x["similarity_score"], reverse=True)
 
+        if mode in (RetrievalMode.MULTI_QUERY, RetrievalMode.HYDE):
+            all_results = self._expand(query, mode.value, all_results, top_k, index, priority, period_where,
+                                       debug_info)
+
         debug_info["total_results"] = len(all_results)
         debug_info["top_similarities"] = [r["similarity_score"] for r in all_results[:5]]
+        debug_info["retrieval_ms"] = round((time.perf_counter() - start_time) * 1000, 2)
 
         logger.info(
             f"Retrieved {len(all_results)} total results, top similarity: {all_results[0]['similarity_score']:.3f}" if all_results else "No results retrieved")
 
+        # Interactive results are cached too, so asking again or regenerating an answer skips the search; the
+        # key holds the index version, so nothing outlives a re-ingestion. Partial results are not cached:
+        # a collection that failed or an expansion that was shed would otherwise be missing for the whole TTL.
+        expansion_outcome = debug_info.get("expansion", {}).get("outcome")
+        if not debug_info["collections_failed"] and expansion_outcome not in ("failed", "shed"):
+            self.retrieval_cache.put(cache_key, (all_results[:top_k], dict(debug_info)))
         return all_results[:top_k], debug_info
 
-    def generate_answer(self, query: str, documents: List[Dict], user_role: str) -> Dict[str, Any]:
+    def _expand(self, query: str, method: str, hits: List[Dict], top_k: int, index, priority: Priority,
+                period_where: Optional[Dict], debug_info: Dict) -> List[Dict]:
+        """`hits` fused with the hits of model-written expansions of the question, unless they are confident already"""
+        if hits and hits[0]["similarity_score"] >= EXPANSION_SKIP_SIMILARITY:
+            QUERY_EXPANSIONS.inc(method=method, outcome="skipped")
+            debug_info["expansion"] = {"method": method, "outcome": "skipped"}
+            return hits
+
+        # The question's own hits still answer if expansion fails; it only ever adds recall
+        started = time.perf_counter()
+        texts, embeddings, outcome = [], [], "failed"
+        try:
+            texts = self._expansion_texts(query, method, priority)
+            embeddings = self.embed_text(texts, priority=priority) if texts else []
+        except UpstreamBusy:
+            logger.warning("Upstream busy; searching with the question alone")
+            outcome = "shed"
+        except Exception as e:
+            logger.warning(f"Query expansion ({method}) failed, searching with the question alone: {e}")
+        if not embeddings:
+            QUERY_EXPANSIONS.inc(method=method, outcome=outcome)
+            debug_info["expansion"] = {"method": method, "outcome": outcome}
+            return hits
+
+        # The collections the question searched, each queried once for all expansions; Chroma searches
+        # the embeddings of one query in parallel
+        rankings = [[] for _ in embeddings]
+        period_debug = {"period_fallbacks": []}
+        for name in debug_info["collections_found"]:
+            try:
+                collection, collection_count = index.collections.get(name)
+                max_k = min(top_k, collection_count)
+                if max_k == 0:
+                    continue
+                n_results = min(max_k * PERIOD_OVERFETCH, collection_count) if period_where else max_k
+                batch = self._query_collection_batch(index, collection, name, embeddings, n_results)
+            except Exception as e:
+                logger.warning(f"Collection {name} not found or inaccessible: {e}")
+                debug_info["collections_failed"].append(name)
+                continue
+            for ranking, unfiltered in zip(rankings, batch):
+                debug_info["vectors_scored"] += len(unfiltered)
+                ranking.extend(self._keep_in_period(name, unfiltered, max_k, period_where, period_debug)
+                               if period_where else unfiltered[:max_k])
+        for ranking in rankings:
+            ranking.sort(key=lambda x: x["similarity_score"], reverse=True)
+            del ranking[top_k:]
+
+        fused = reciprocal_rank_fusion([hits] + rankings)
+        original = {(hit["source"], hit["content"]) for hit in hits[:top_k]}
+        QUERY_EXPANSIONS.inc(method=method, outcome="expanded")
+        debug_info["expansion"] = {
+            "method": method,
+            "outcome": "expanded",
+            "texts": texts,
+            "new_hits": sum(1 for hit in fused[:top_k] if (hit["source"], hit["content"]) not in original),
+            "expansion_ms": round((time.perf_counter() - started) * 1000, 2)
+        }
+        return fused
+
+    def _expansion_texts(self, query: str, method: str, priority: Priority) -> List[str]:
+        """Rephrasings of the question, or a hypothetical answer to it, from the small model"""
+        messages = expansion_prompt(query, method, EXPANSION_QUERIES)
+        UPSTREAM_CALLS.inc(endpoint="chat_completions")
+        with span("query_expansion"):
+            response = upstream.call(
+                lambda: client_oai.chat.completions.create(
+                    model=SMALL_CHAT_MODEL,
+                    messages=messages,
+                    temperature=0.3,
+                    max_tokens=EXPANSION_MAX_TOKENS
+                ),
+                priority=priority,
+                estimated_tokens=sum(estimate_tokens(m["content"]) for m in messages) + EXPANSION_MAX_TOKENS,
+                endpoint="chat_completions"
+            )
+        PROMPT_TOKENS.inc(getattr(response.usage, "prompt_tokens", 0) or 0, tier="expansion")
+        return parse_expansions(response.choices[0].message.content or "", method, EXPANSION_QUERIES)
+
+    def retrieve_batch(self, queries: List[str], allowed_collections: List[str], top_k: int = 10,
+                       priority: Priority = Priority.BATCH) -> List[tuple[List[Dict], Dict]]:
+        """retrieve_documents for many questions: one embedding call for all of them, then one query per
+        collection for every question that searches it.
+
+        Searches as the fixed mode does. Period constraints are applied after the search even in "where"
+        mode, since one Chroma query cannot take a different clause per question. Results are not cached,
+        so a bulk job does not evict the questions users are typing.
+        """
+        if not queries or not allowed_collections:
+            return [([], {"error": "No allowed collections"}) for _ in queries]
+        start_time = time.perf_counter()
+        index = self.indexes.active
+        embeddings = self._embed_batch(queries, priority)
+
+        debug_infos, plans = [], []
+        for query, query_embedding in zip(queries, embeddings):
+            debug_info = {"collections_tried": [], "collections_found": [], "total_docs": 0,
+                          "collections_skipped": [], "retrieval_mode": RetrievalMode.FIXED.value,
+                          "vectors_scored": 0, "index_generation": index.name, "cache_hit": False,
+                          "collections_routed_out": [], "batched": True,
+                          "period_filter": period_filter(query) if self.period_filtering != "off" else None,
+                          "period_fallbacks": [], "collections_failed": []}
+            search_order, routed = allowed_collections, len(allowed_collections)
+            if self.router is not None:
+                with span("routing"):
+                    search_order, routed, debug_info["routing_scores"] = self.router.route(
+                        query, query_embedding, allowed_collections, index.centroids())
+            debug_infos.append(debug_info)
+            plans.append((search_order, routed))
+
+        # Round 0 searches the collections each question was routed to. Each later round adds the next
+        # routed-out collection for the questions still without a confident hit, as _retrieve does one by one.
+        results: List[List[Dict]] = [[] for _ in queries]
+        for round_ in range(1 + max(len(order) - routed for order, routed in plans)):
+            members: Dict[str, List[int]] = {}
+            for q, (order, routed) in enumerate(plans):
+                if round_ == 0:
+                    names = order[:routed]
+                elif routed + round_ - 1 < len(order):
+                    names = [order[routed + round_ - 1]]
+                    if any(hit["similarity_score"] >= self.min_confidence_threshold for hit in results[q]):
+                        debug_infos[q]["collections_routed_out"].extend(names)
+                        continue
+                else:
+                    continue
+                for name in names:
+                    members.setdefault(name, []).append(q)
+            for name, questions in members.items():
+                self._search_batch(index, name, questions, embeddings, top_k, debug_infos, results)
+
+        retrieval_ms = round((time.perf_counter() - start_time) * 1000, 2)
+        retrieved = []
+        for hits, debug_info in zip(results, debug_infos):
+            hits.sort(key=lambda x: x["similarity_score"], reverse=True)
+            debug_info["total_results"] = len(hits)
+            debug_info["top_similarities"] = [r["similarity_score"] for r in hits[:5]]
+            debug_info["retrieval_ms"] = retrieval_ms
+            retrieved.append((hits[:top_k], debug_info))
+        logger.info(f"Retrieved documents for {len(queries)} questions in {retrieval_ms} ms")
+        return retrieved
+
+    def _embed_batch(self, queries: List[str], priority: Priority) -> List[List[float]]:
+        """Embeddings for many questions: cached ones reused, the rest in as few calls as the API allows"""
+        embeddings = [self.embedding_cache.get(embedding_key(query)) for query in queries]
+        missing = [q for q, embedding in enumerate(embeddings) if embedding is None]
+        for start in range(0, len(missing), BATCH_EMBED_INPUTS):
+            chunk = missing[start:start + BATCH_EMBED_INPUTS]
+            for q, embedding in zip(chunk, self.embed_text([queries[q] for q in chunk], priority=priority)):
+                embeddings[q] = embedding
+        return embeddings
+
+    def _search_batch(self, index, collection_name: str, questions: List[int], embeddings: List[List[float]],
+                      top_k: int, debug_infos: List[Dict], results: List[List[Dict]]):
+        """One Chroma query for all `questions` (indexes into the batch) that search this collection"""
+        for q in questions:
+            debug_infos[q]["collections_tried"].append(collection_name)
+        try:
+            with span("collection_lookup"):
+                collection, collection_count = index.collections.get(collection_name)
+        except Exception as e:
+            logger.warning(f"Collection {collection_name} not found or inaccessible: {e}")
+            for q in questions:
+                debug_infos[q]["collections_failed"].append(collection_name)
+            return
+        for q in questions:
+            debug_infos[q]["collections_found"].append(collection_name)
+            debug_infos[q]["total_docs"] += collection_count
+        if collection_count == 0:
+            logger.warning(f"Collection {collection_name} is empty")
+            return
+
+        index_dimensions = (collection.metadata or {}).get("embedding_dimensions")
+        if index_dimensions and index_dimensions != len(embeddings[questions[0]]):
+            raise HTTPException(
+                status_code=503,
+                detail=f"Index holds {index_dimensions}-dimensional embeddings but queries are "
+                       f"{len(embeddings[questions[0]])}-dimensional; set EMBEDDING_DIMENSIONS to match the index")
+
+        max_k = min(top_k, collection_count)
+        period_wheres = [debug_infos[q]["period_filter"] for q in questions]
+        # Over-fetching for every question is cheaper than a second query for the ones naming a period
+        n_results = min(max_k * PERIOD_OVERFETCH, collection_count) if any(period_wheres) else max_k
+        try:
+            batch = self._query_collection_batch(index, collection, collection_name,
+                                                 [embeddings[q] for q in questions], n_results)
+        except Exception:
+            for q in questions:
+                debug_infos[q]["collections_failed"].append(collection_name)
+            return
+        for q, period_where, unfiltered in zip(questions, period_wheres, batch):
+            debug_infos[q]["vectors_scored"] += len(unfiltered)
+            if period_where is None:
+                results[q].extend(unfiltered[:max_k])
+            else:
+                results[q].extend(self._keep_in_period(collection_name, unfiltered, max_k, period_where,
+                                                       debug_infos[q]))
+
+    def _query_collection(self, index, collection, collection_name: str, query_embedding: List[float],
+                          n_results: int, where: Optional[Dict] = None) -> List[Dict]:
+        """Run one ANN query against a collection and convert distances to similarity scores"""
+        return self._query_collection_batch(index, collection, collection_name, [query_embedding], n_results,
+                                            where)[0]
+
+    def _query_collection_batch(self, index, collection, collection_name: str, query_embeddings: List[List[float]],
+                                n_results: int, where: Optional[Dict] = None) -> List[List[Dict]]:
+        """_query_collection for several embeddings in one Chroma call; one hit list per embedding.
+
+        Raises when the query fails, so callers can tell a failed collection from one without hits.
+        """
+        try:
+            with span(f"query:{collection_name}"):
+                results = collection.query(
+                    query_embeddings=query_embeddings,
+                    n_results=n_results,
+                    where=where,
+                    include=["documents", "distances", "metadatas"]
+                )
+        except Exception as e:
+            logger.error(f"Error querying collection {collection_name}: {e}")
+            # The cached handle may belong to a collection that was dropped and recreated; drop it from the
+            # generation it came from, which may no longer be the active one
+            index.collections.invalidate(collection_name)
+            raise
+
+        batch = []
+        for q, documents in enumerate(results["documents"] or [[] for _ in query_embeddings]):
+            if not documents:
+                logger.warning(f"No results returned from collection {collection_name}")
+                batch.append([])
+                continue
+
+            hits = []
+            for i, (doc, distance) in enumerate(zip(documents, results["distances"][q])):
+                # ChromaDB uses cosine distance, convert to similarity
+                similarity_score = max(0, 1 - distance)
+
+                metadata = results["metadatas"][q][i] if results.get("metadatas") else {}
+
+                hits.append({
+                    "content": doc.strip(),
+                    "similarity_score": similarity_score,
+                    "source": collection_name,
+                    "metadata": metadata,
+                    "distance": distance
+                })
+
+                logger.debug(
+                    f"Document from {collection_name}: similarity={similarity_score:.3f}, distance={distance:.3f}")
+            batch.append(hits)
+
+        return batch
+
+    def _search(self, index, collection, collection_count: int, query_embedding: List[float], n_results: int,
+                period_where: Optional[Dict], debug_info: Dict) -> List[Dict]:
+        """_query_collection with the question's period constraint applied as PERIOD_FILTER says"""
+        name = collection.name
+        if period_where is None:
+            hits = self._query_collection(index, collection, name, query_embedding, n_results)
+            debug_info["vectors_scored"] += len(hits)
+            return hits
+
+        if self.period_filtering == "where":
+            # Chroma's metadata filter is not free; skip it where every chunk would pass anyway
+            dated = self._has_dated_chunks(index, collection)
+            hits = self._query_collection(index, collection, name, query_embedding, n_results,
+                                          period_where if dated else None)
+            debug_info["vectors_scored"] += len(hits)
+            if not dated or any(hit["similarity_score"] >= self.min_confidence_threshold for hit in hits):
+                return hits
+            unfiltered = self._query_collection(index, collection, name, query_embedding, n_results)
+            debug_info["vectors_scored"] += len(unfiltered)
+        else:
+            unfiltered = self._query_collection(index, collection, name, query_embedding,
+                                                min(n_results * PERIOD_OVERFETCH, collection_count))
+            debug_info["vectors_scored"] += len(unfiltered)
+            return self._keep_in_period(name, unfiltered, n_results, period_where, debug_info)
+        # Nothing confident on-period, or the index predates period tags
+        debug_info["period_fallbacks"].append(name)
+        return unfiltered[:n_results]
+
+    def _keep_in_period(self, name: str, unfiltered: List[Dict], n_results: int, period_where: Dict,
+                        debug_info: Dict) -> List[Dict]:
+        """The on-period hits among over-fetched ones, or the unfiltered top hits when none is confident"""
+        hits = [hit for hit in unfiltered if in_period(hit["metadata"] or {}, period_where)][:n_results]
+        if any(hit["similarity_score"] >= self.min_confidence_threshold for hit in hits):
+            return hits
+        # Nothing confident on-period, or the index predates period tags
+        debug_info["period_fallbacks"].append(name)
+        return unfiltered[:n_results]
+
+    def _has_dated_chunks(self, index, collection) -> bool:
+        """Whether any chunk of the collection is tagged with a fiscal period"""
+        version = (index.name, index.collections.version)
+        if self._dated_collections[0] != version:
+            self._dated_collections = (version, {})
+        known = self._dated_collections[1]
+        if collection.name not in known:
+            known[collection.name] = bool(collection.get(where={"period_any": 1}, limit=1, include=[])["ids"])
+        return known[collection.name]
+
+    def _is_ambiguous(self, hits: List[Dict]) -> bool:
+        """True when the weakest hit is still relevant and close to the best, so more may follow"""
+        best = hits[0]["similarity_score"]
+        weakest = hits[-1]["similarity_score"]
+        return weakest >= self.min_confidence_threshold and best - weakest <= ADAPTIVE_AMBIGUITY_MARGIN
+
+    def expand_to_parents(self, documents: List[Dict]) -> List[Dict]:
+        """Swap child hits for their parent sections, keeping each parent once at its best child's rank"""
+        parent_ids = [doc["metadata"].get("parent_id") for doc in documents]
+        if not any(parent_ids):
+            return documents
+        with span("parent_lookup"):
+            parents = self.indexes.active.parents.get_many([parent_id for parent_id in parent_ids if parent_id])
+
+        expanded, seen = [], set()
+        for doc, parent_id in zip(documents, parent_ids):
+            if parent_id in seen:
+                continue
+            content = parents.get(parent_id) if parent_id else None
+            if content is None:
+                # No parent, or it was replaced since retrieval: the hit's own text still answers
+                expanded.append(doc)
+                continue
+            seen.add(parent_id)
+            expanded.append({**doc, "content": content})
+        return expanded
+
+    def answer_query(self, query: str, allowed_collections: List[str], top_k: int,
+                     mode: Optional[RetrievalMode], user_role: str,
+                     conversation: Optional[Conversation] = None) -> tuple[List[Dict], Dict, Dict[str, Any]]:
+        """Run retrieval and generation for one question, as the next turn of `conversation` if given"""
+        if conversation is None:
+            # Retrieve relevant documents with debug info
+            documents, debug_info = self.retrieve_documents(
+                query=query,
+                allowed_collections=allowed_collections,
+                top_k=top_k,
+                mode=mode
+            )
+
+            # Generate answer
+            result = self.generate_answer(
+                query=query,
+                documents=documents,
+                user_role=user_role
+            )
+            return documents, debug_info, result
+
+        # Turns of one conversation run one at a time, each seeing the turns before it
+        with conversation.lock:
+            history = conversation.history_text()
+            standalone, method = self.rewrite_question(query, conversation, history)
+            documents, debug_info = self.retrieve_documents(standalone, allowed_collections, top_k, mode)
+            result = self.generate_answer(standalone, documents, user_role, history=history)
+            conversation.add_turn(query, standalone, result["answer"])
+            result["conversation"] = {
+                "turn": conversation.turn_count,
+                "standalone_question": standalone,
+                "rewrite": method,
+                "history_tokens": estimate_tokens(history) if history else 0
+            }
+        return documents, debug_info, result
+
+    def open_conversation(self, conversation: Conversation, query: str, answer: str) -> Dict[str, Any]:
+        """Record the first turn of a conversation, answered without one; returns its conversation details"""
+        with conversation.lock:
+            conversation.add_turn(query, query, answer)
+            turn = conversation.turn_count
+        REWRITES.inc(method="none")
+        return {"turn": turn, "standalone_question": query, "rewrite": "none", "history_tokens": 0}
+
+    def rewrite_question(self, query: str, conversation: Conversation, history: str) -> tuple[str, str]:
+        """A standalone version of a conversation turn, and how it was made"""
+        standalone, method = rewrite_followup(query, conversation)
+        if method is None and QUERY_REWRITE == "auto":
+            try:
+                standalone, method = self._rewrite_with_model(query, history), "model"
+            except UpstreamBusy:
+                logger.warning("Upstream busy; rewriting the follow-up by concatenation")
+            except Exception as e:
+                logger.warning(f"Follow-up rewrite failed, concatenating instead: {e}")
+        if method is None:
+            # Retrieval still sees what the previous turn was about
+            standalone, method = f"{conversation.last_standalone} {query}", "concatenate"
+        REWRITES.inc(method=method)
+        return standalone, method
+
+    def _rewrite_with_model(self, query: str, history: str) -> str:
+        messages = [
+            {"role": "system", "content": REWRITE_INSTRUCTIONS},
+            {"role": "user", "content": f"Conversation:\n{history}\n\nFollow-up: {query}"}
+        ]
+        UPSTREAM_CALLS.inc(endpoint="chat_completions")
+        with span("query_rewrite"):
+            response = upstream.call(
+                lambda: client_oai.chat.completions.create(
+                    model=SMALL_CHAT_MODEL,
+                    messages=messages,
+                    temperature=0,
+                    max_tokens=REWRITE_MAX_TOKENS
+                ),
+                estimated_tokens=sum(estimate_tokens(m["content"]) for m in messages) + REWRITE_MAX_TOKENS,
+                endpoint="chat_completions"
+            )
+        PROMPT_TOKENS.inc(getattr(response.usage, "prompt_tokens", 0) or 0, tier="rewrite")
+        return response.choices[0].message.content.strip() or query
+
+    def generate_answer(self, query: str, documents: List[Dict], user_role: str, history: str = "",
+                        priority: Priority = Priority.INTERACTIVE) -> Dict[str, Any]:
         """Generate answer using retrieved documents with improved logic"""
 
         # Filter documents by confidence threshold
@@ -308,7 +1011,7 @@ class RAGEngine:
         # If no documents meet the threshold, try with lower threshold or use all available
         if not relevant_docs and documents:
             # Use all documents but with a warning
-            relevant_docs = documents[:5]  # Use top 5 regardless of score
+            relevant_docs = documents[:ANSWER_CONTEXT_DOCS]  # Use top documents regardless of score
             logger.warning(
                 f"Using documents below confidence threshold. Highest score: {documents[0]['similarity_score']:.3f}")
 
@@ -321,59 +1024,58 @@ class RAGEngine:
                 "reason": "No relevant documents found"
             }
 
-        # Prepare context from documents
-        context_parts = []
-        sources = set()
-
         # Use more documents for better context
-        num_docs_to_use = min(5, len(relevant_docs))
-
-        for i, doc in enumerate(relevant_docs[:num_docs_to_use]):
-            content = doc["content"]
-            source = doc["source"]
-            score = doc["similarity_score"]
-
-            # Clean and truncate content if too long
-            content = content.strip()
-            if len(content) > 1000:  # Truncate very long documents
-                content = content[:1000] + "..."
-
-            context_parts.append(f"Document {i + 1} (Source: {source}, Relevance: {score:.2f}):\n{content}")
-            sources.add(source)
+        num_docs_to_use = min(ANSWER_CONTEXT_DOCS, len(relevant_docs))
 
-        context = "\n\n" + "=" * 50 + "\n\n".join(context_parts)
+        # Hits that share a parent section put it in the prompt once
+        context_docs = self.expand_to_parents(relevant_docs[:num_docs_to_use])
 
         # Calculate overall confidence
         confidence_score = sum(doc["similarity_score"] for doc in relevant_docs[:num_docs_to_use]) / num_docs_to_use
 
-        # Improved system prompt
-        system_prompt = f"""You are a helpful assistant for FinSolve Technologies with role-based access control.
-
-IMPORTANT INSTRUCTIONS:
-1. Answer the user's question using ONLY the provided context documents
-2. The user has '{user_role}' role - provide information relevant to their role
-3. Be comprehensive and detailed when the context supports it
-4. If the context has relevant information but it's partial, provide what you can and mention limitations
-5. Do NOT refuse to answer if there is relevant information in the context
-6. Format your response clearly and professionally
-7. If you need to make connections between different pieces of information in the context, that's allowed
+        # A lookup answered verbatim by the top section needs no chat completion
+        # Until the extractive model has loaded in the background, every question is generated
+        if (self.extractor and self.extractor.ready and is_lookup(query)
+                and relevant_docs[0]["similarity_score"] >= EXTRACTIVE_MIN_SIMILARITY):
+            extraction = self._extract(query, context_docs[0]["content"])
+            if extraction is not None:
+                ANSWERS.inc(tier=EXTRACTIVE_TIER)
+                source = context_docs[0]["source"]
+                return {
+                    "answer": f"{extraction.highlighted()}\n\nSource: {source}",
+                    "confidence_score": confidence_score,
+                    "sources": [source],
+                    "access_denied": False,
+                    "documents_used": 1,
+                    "context_sections": 1,
+                    "total_relevant_docs": len(relevant_docs),
+                    "model": f"{EXTRACTIVE_TIER}:{self.extractor.name}",
+                    "tier": EXTRACTIVE_TIER,
+                    "escalation_reason": None,
+                    "highlight": {"source": source, "passage": extraction.passage, "start": extraction.start,
+                                  "end": extraction.end, "score": extraction.score}
+                }
 
-Context Quality: The documents provided have been pre-filtered for relevance to the user's question."""
+        with span("prompt_assembly"):
+            messages, sources = self._build_messages(query, context_docs, user_role, history)
 
         try:
-            response = client_oai.chat.completions.create(
-                model=CHAT_MODEL,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"Context Documents:\n{context}\n\n" +
-                                                f"Question: {query}\n\n" +
-                                                f"Please provide a comprehensive answer based on the context above:"}
-                ],
-                temperature=0.2,  # Slightly higher for more natural responses
-                max_tokens=800  # Increased for more detailed answers
-            )
-
-            answer = response.choices[0].message.content.strip()
+            tier, escalation = LARGE_TIER, None
+            usage = {"prompt_tokens": 0, "cached_prompt_tokens": 0}
+            if self.cascade and confidence_score < CASCADE_MIN_CONFIDENCE:
+                escalation = "low_confidence"
+            elif self.cascade:
+                answer, finish_reason = self._complete(SMALL_TIER, messages, usage, priority)
+                escalation = check_draft(answer, finish_reason, "\n".join(m["content"] for m in messages))
+                if escalation is None:
+                    tier = SMALL_TIER
+                else:
+                    logger.info(f"Escalating to {CHAT_MODEL}: small-tier draft failed the self-check ({escalation})")
+            if tier == LARGE_TIER:
+                if escalation:
+                    ESCALATIONS.inc(reason=escalation)
+                answer, _ = self._complete(LARGE_TIER, messages, usage, priority)
+            ANSWERS.inc(tier=tier)
 
             # Quality check: ensure the answer is substantial
             if len(answer) < 50:
@@ -385,21 +1087,198 @@ Context Quality: The documents provided have been pre-filtered for relevance to
                 "sources": list(sources),
                 "access_denied": False,
                 "documents_used": num_docs_to_use,
-                "total_relevant_docs": len(relevant_docs)
+                "context_sections": len(context_docs),
+                "total_relevant_docs": len(relevant_docs),
+                "model": SMALL_CHAT_MODEL if tier == SMALL_TIER else CHAT_MODEL,
+                "tier": tier,
+                "escalation_reason": escalation,
+                "usage": usage
             }
 
+        except UpstreamBusy:
+            raise
         except Exception as e:
             logger.error(f"Answer generation failed: {str(e)}")
             raise HTTPException(status_code=500, detail=f"Answer generation failed: {str(e)}")
 
+    def _extract(self, query: str, content: str):
+        """The extractor's answer from one section, or None when it is not confident enough"""
+        started = time.perf_counter()
+        try:
+            with span("extraction"):
+                extraction = self.extractor(query, content)
+        except Exception as e:
+            logger.warning(f"Extractive answering failed, generating instead: {e}")
+            return None
+        finally:
+            GENERATION_SECONDS.observe(time.perf_counter() - started, tier=EXTRACTIVE_TIER)
+        if extraction is None or extraction.score < EXTRACTIVE_MIN_SCORE:
+            return None
+        return extraction
+
+    def _complete(self, tier: str, messages: List[Dict], usage: Dict[str, int],
+                  priority: Priority = Priority.INTERACTIVE) -> tuple[str, Optional[str]]:
+        """One chat completion on a cascade tier; returns the answer and its finish reason, adding to `usage`"""
+        UPSTREAM_CALLS.inc(endpoint="chat_completions")
+        started = time.perf_counter()
+        with span("chat_completion"):
+            response = upstream.call(
+                lambda: client_oai.chat.completions.create(
+                    model=SMALL_CHAT_MODEL if tier == SMALL_TIER else CHAT_MODEL,
+                    messages=messages,
+                    temperature=0.2,  # Slightly higher for more natural responses
+                    max_tokens=ANSWER_MAX_TOKENS  # Increased for more detailed answers
+                ),
+                priority=priority,
+                estimated_tokens=sum(estimate_tokens(m["content"]) for m in messages) + ANSWER_MAX_TOKENS,
+                endpoint="chat_completions"
+            )
+        GENERATION_SECONDS.observe(time.perf_counter() - started, tier=tier)
+        prompt_tokens = getattr(response.usage, "prompt_tokens", 0) or 0
+        # openai 1.3 keeps prompt_tokens_details as a plain dict
+        details = getattr(response.usage, "prompt_tokens_details", None) or {}
+        cached_tokens = (details.get("cached_tokens") if isinstance(details, dict)
+                         else getattr(details, "cached_tokens", 0)) or 0
+        PROMPT_TOKENS.inc(prompt_tokens, tier=tier)
+        CACHED_PROMPT_TOKENS.inc(cached_tokens, tier=tier)
+        usage["prompt_tokens"] += prompt_tokens
+        usage["cached_prompt_tokens"] += cached_tokens
+        choice = response.choices[0]
+        return choice.message.content.strip(), choice.finish_reason
+
+    def _build_messages(self, query: str, documents: List[Dict], user_role: str,
+                        history: str = "") -> tuple[List[Dict], set]:
+        """Assemble the chat messages for the documents that go into the prompt.
+
+        Everything that repeats across requests comes first so upstream prompt caching can reuse it:
+        the fixed instructions, then the role, then the context in a stable order. Only the conversation
+        history, the question and the relevance ranking, which change every time, come last.
+        """
+        # Prepare context from documents
+        context_parts = []
+        sources = set()
+
+        # By collection and position rather than by score, so overlapping retrievals share a prefix
+        ranked = {id(doc): rank for rank, doc in enumerate(documents)}
+        ordered = sorted(documents, key=lambda doc: (
+            doc["source"], doc.get("metadata", {}).get("source", ""),
+            doc.get("metadata", {}).get("parent_id") or doc.get("metadata", {}).get("heading_path", ""),
+            doc["content"]))
+
+        for i, doc in enumerate(ordered):
+            content = doc["content"]
+            source = doc["source"]
+
+            # Clean and truncate content if too long
+            content = content.strip()
+            if len(content) > 1000:  # Truncate very long documents
+                content = content[:1000] + "..."
+
+            context_parts.append(f"Document {i + 1} (Source: {source}):\n{content}")
+            sources.add(source)
+
+        context = "\n\n" + "=" * 50 + "\n\n".join(context_parts)
+        by_relevance = sorted(range(len(ordered)), key=lambda i: ranked[id(ordered[i])])
+        relevance = ", ".join(f"Document {i + 1} ({ordered[i]['similarity_score']:.2f})" for i in by_relevance)
+
+        messages = [
+            {"role": "system", "content": ANSWER_INSTRUCTIONS},
+            {"role": "system", "content": f"The user has the '{user_role}' role."},
+            {"role": "user", "content": f"Context Documents:\n{context}"},
+            *([{"role": "user", "content": f"Conversation so far:\n{history}"}] if history else []),
+            {"role": "user", "content": f"Documents by relevance: {relevance}\n\n" +
+                                        f"Question: {query}\n\n" +
+                                        f"Please provide a comprehensive answer based on the context above:"}
+        ]
+        return messages, sources
+
 
 # Initialize RAG engine
 rag_engine = RAGEngine()
 
+# Ingestion embeds at the lowest scheduler priority so it never crowds out interactive queries
+ingest_jobs = IngestJobManager(
+    index_manager,
+    embed_fn=lambda texts: rag_engine.embed_text(texts, priority=Priority.INGESTION),
+    db_path=DB_PATH,
+    max_workers=INGEST_WORKERS
+)
+data_watcher = DataWatcher(
+    ingest_docs.DATA_PATH,
+    ingest_docs.departments,
+    ingest_docs.SUPPORTED_EXTENSIONS,
+    on_changes=ingest_jobs.submit_changes,
+    debounce=WATCH_DEBOUNCE,
+    poll_interval=WATCH_POLL_INTERVAL
+)
+
+
+# =============================================================================
+# REQUEST COALESCING
+# =============================================================================
+class SingleFlight:
+    """Lets concurrent callers with the same key share one in-flight computation"""
+
+    def __init__(self):
+        self._inflight: Dict[Any, asyncio.Future] = {}
+
+    async def do(self, key, fn) -> tuple[Any, bool]:
+        """Await fn() or join an identical call already running; returns (result, shared)"""
+        task = self._inflight.get(key)
+        shared = task is not None
+        if not shared:
+            # Run as its own task so a disconnecting first caller does not cancel the others
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task), shared
+
+
+def normalize_question(question: str) -> str:
+    return re.sub(r"\s+", " ", question).strip().rstrip("?!. ").lower()
+
+
+def embedding_key(question: str) -> str:
+    """Cache key for a question's embedding; case and punctuation change the embedding, so they stay"""
+    return re.sub(r"\s+", " ", question).strip()
+
+
+query_flights = SingleFlight()
+conversations = ConversationStore(CONVERSATION_MAX_COUNT, CONVERSATION_TTL, CONVERSATION_RECENT_TURNS)
+
 
 # =============================================================================
 # API ENDPOINTS
 # =============================================================================
+@app.on_event("startup")
+async def start_background_tasks():
+    health_monitor.start()
+    index_manager.start()
+    if rag_engine.extractor is not None:
+        # Downloading and loading the model takes a while; requests skip the extractive tier meanwhile
+        threading.Thread(target=rag_engine.extractor.warm, name="extractor-warmup", daemon=True).start()
+    if WATCH_DATA:
+        data_watcher.start()
+
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    data_watcher.stop()
+    ingest_jobs.shutdown()
+    await index_manager.stop()
+    await health_monitor.stop()
+
+
+@app.exception_handler(UpstreamBusy)
+async def upstream_busy_handler(request, exc: UpstreamBusy):
+    """Shed load with a fast 503 instead of queueing behind the OpenAI rate limit"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": f"The assistant is busy ({exc.reason}), please retry shortly"},
+        headers={"Retry-After": str(max(1, round(exc.retry_after)))}
+    )
+
+
 @app.post("/auth/login", response_model=LoginResponse)
 async def login(login_data: LoginRequest):
     """Authenticate user and return JWT token"""
@@ -436,6 +1315,7 @@ async def login(login_data: LoginRequest):
 @app.post("/chat/query", response_model=QueryResponse)
 async def process_query(query_data: QueryRequest, current_user: dict = Depends(verify_token)):
     """Process user query and return RAG-based response with improved retrieval"""
+    trace = start_trace()
     user = current_user["user"]
     user_role = current_user["role"]
 
@@ -447,19 +1327,45 @@ async def process_query(query_data: QueryRequest, current_user: dict = Depends(v
     if not accessible_collections:
         raise HTTPException(status_code=403, detail="No data access permissions for your role")
 
-    # Retrieve relevant documents with debug info
-    documents, debug_info = rag_engine.retrieve_documents(
-        query=query_data.question,
-        allowed_collections=accessible_collections,
-        top_k=query_data.max_results
-    )
+    conversation = (conversations.get_or_create(user.username, query_data.conversation_id)
+                    if query_data.conversation_id else None)
+    # A turn with no history is answered like any question, so it can share a flight with other users'
+    opening_turn = conversation is not None and not conversation.history_text()
+    pipeline_conversation = None if opening_turn else conversation
+
+    # Retrieval and generation block on I/O, so they run in the threadpool to keep the event loop free
+    def run_pipeline():
+        return run_in_threadpool(
+            rag_engine.answer_query,
+            query_data.question,
+            accessible_collections,
+            query_data.max_results,
+            query_data.retrieval_mode,
+            user_role.value,
+            pipeline_conversation
+        )
 
-    # Generate answer
-    result = rag_engine.generate_answer(
-        query=query_data.question,
-        documents=documents,
-        user_role=user_role.value
-    )
+    coalesced = False
+    if QUERY_COALESCING:
+        # The role is part of the key because generate_answer puts it in the prompt, and so is the conversation
+        flight_key = (normalize_question(query_data.question), tuple(sorted(accessible_collections)),
+                      user_role.value, query_data.max_results, query_data.retrieval_mode,
+                      user.username if pipeline_conversation else None,
+                      query_data.conversation_id if pipeline_conversation else None)
+        with span("query_pipeline"):
+            (documents, debug_info, result), coalesced = await query_flights.do(flight_key, run_pipeline)
+        if coalesced:
+            COALESCED_REQUESTS.inc()
+            logger.info(f"Query from {user.username} joined an identical in-flight query")
+    else:
+        with span("query_pipeline"):
+            documents, debug_info, result = await run_pipeline()
+
+    if opening_turn:
+        result = dict(result, conversation=rag_engine.open_conversation(conversation, query_data.question,
+                                                                        result["answer"]))
+
+    ANSWER_SECONDS.observe(time.perf_counter() - trace.started, tier=result.get("tier", "none"))
 
     # Enhanced logging
     logger.info(f"Query result - User: {user.username}, "
@@ -467,6 +1373,23 @@ async def process_query(query_data: QueryRequest, current_user: dict = Depends(v
                 f"Confidence: {result['confidence_score']:.3f}, "
                 f"Access denied: {result.get('access_denied', False)}")
 
+    response_debug = {
+        "retrieval_debug": debug_info,
+        "documents_processed": len(documents),
+        "documents_used": result.get("documents_used", 0),
+        "context_sections": result.get("context_sections", 0),
+        "model": result.get("model"),
+        "answer_tier": result.get("tier"),
+        "escalation_reason": result.get("escalation_reason"),
+        "highlight": result.get("highlight"),
+        "usage": result.get("usage"),
+        "conversation": result.get("conversation"),
+        "min_threshold": rag_engine.min_confidence_threshold,
+        "coalesced": coalesced
+    }
+    if query_data.include_timings:
+        response_debug["timings"] = trace.timings()
+
     return QueryResponse(
         query=query_data.question,
         answer=result["answer"],
@@ -474,15 +1397,123 @@ async def process_query(query_data: QueryRequest, current_user: dict = Depends(v
         user_role=user_role.value,
         confidence_score=result["confidence_score"],
         departments_searched=accessible_collections,
-        debug_info={
-            "retrieval_debug": debug_info,
-            "documents_processed": len(documents),
-            "documents_used": result.get("documents_used", 0),
-            "min_threshold": rag_engine.min_confidence_threshold
-        }
+        debug_info=response_debug,
+        conversation_id=query_data.conversation_id
     )
 
 
+@app.delete("/chat/conversations/{conversation_id}")
+async def delete_conversation(conversation_id: str, current_user: dict = Depends(verify_token)):
+    """Forget a conversation's history; the next turn with this id starts afresh"""
+    if not conversations.delete(current_user["user"].username, conversation_id):
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return {"conversation_id": conversation_id, "deleted": True}
+
+
+@app.post("/chat/batch")
+async def process_batch(batch_data: BatchQueryRequest, current_user: dict = Depends(verify_token)):
+    """Answer many questions, streaming one NDJSON line per question as its answer completes"""
+    user = current_user["user"]
+    user_role = current_user["role"]
+    questions = batch_data.questions
+    if not questions:
+        raise HTTPException(status_code=400, detail="The batch has no questions")
+    if len(questions) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"A batch takes at most {BATCH_MAX_QUESTIONS} questions")
+
+    accessible_collections = RBACManager.get_accessible_collections(user_role)
+    if not accessible_collections:
+        raise HTTPException(status_code=403, detail="No data access permissions for your role")
+
+    # Repeated questions are retrieved and answered once
+    positions: Dict[str, List[int]] = {}
+    for position, question in enumerate(questions):
+        positions.setdefault(normalize_question(question), []).append(position)
+    distinct = [questions[indexes[0]] for indexes in positions.values()]
+    logger.info(f"Batch of {len(questions)} questions ({len(distinct)} distinct) from {user.username}")
+
+    # Retrieval finishes before the response starts, so a failed embedding call is still a plain HTTP error
+    started = time.perf_counter()
+    with span("batch_retrieval"):
+        retrieved = await run_in_threadpool(rag_engine.retrieve_batch, distinct, accessible_collections,
+                                            batch_data.max_results)
+    retrieval_ms = round((time.perf_counter() - started) * 1000, 2)
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def answer(question: str, documents: List[Dict]) -> tuple[str, Dict[str, Any]]:
+        async with semaphore:
+            try:
+                result = await run_in_threadpool(rag_engine.generate_answer, question, documents, user_role.value,
+                                                 "", Priority.BATCH)
+            except UpstreamBusy as e:
+                # Only this question is lost; the caller can send the failed ones again
+                return question, {"error": str(e), "retry_after": e.retry_after}
+            except HTTPException as e:
+                return question, {"error": e.detail}
+        return question, {
+            "answer": result["answer"],
+            "sources": result["sources"],
+            "confidence_score": result["confidence_score"],
+            "model": result.get("model"),
+            "answer_tier": result.get("tier"),
+            "escalation_reason": result.get("escalation_reason"),
+            "usage": result.get("usage")
+        }
+
+    async def answers():
+        tasks = [asyncio.ensure_future(answer(question, documents))
+                 for question, (documents, _) in zip(distinct, retrieved)]
+        failed = 0
+        try:
+            for completed in asyncio.as_completed(tasks):
+                question, line = await completed
+                status_label = "failed" if "error" in line else "answered"
+                for position in positions[normalize_question(question)]:
+                    failed += status_label == "failed"
+                    BATCH_QUESTIONS.inc(status=status_label)
+                    yield json.dumps({"index": position, "question": questions[position], **line}) + "\n"
+            yield json.dumps({"done": True, "questions": len(questions), "distinct": len(distinct),
+                              "failed": failed, "retrieval_ms": retrieval_ms,
+                              "elapsed_ms": round((time.perf_counter() - started) * 1000, 2)}) + "\n"
+        finally:
+            # The client went away: questions still waiting for a slot are not worth generating
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(answers(), media_type="application/x-ndjson")
+
+
+@app.post("/chat/prefetch")
+async def prefetch_query(prefetch_data: PrefetchRequest, current_user: dict = Depends(verify_token)):
+    """Speculatively embed and retrieve a question still being typed, so its /chat/query starts warm"""
+    question = prefetch_data.question.strip()
+    if len(question) < PREFETCH_MIN_CHARS or not rag_engine.retrieval_cache.enabled:
+        PREFETCHES.inc(status="skipped")
+        return {"status": "skipped"}
+
+    accessible_collections = RBACManager.get_accessible_collections(current_user["role"])
+    try:
+        documents, debug_info = await run_in_threadpool(
+            rag_engine.retrieve_documents,
+            question,
+            accessible_collections,
+            prefetch_data.max_results,
+            prefetch_data.retrieval_mode,
+            Priority.PREFETCH
+        )
+    except UpstreamBusy:
+        # Speculative work is the first to go when OpenAI is saturated; the real query will still run
+        PREFETCHES.inc(status="shed")
+        return {"status": "shed"}
+
+    PREFETCHES.inc(status="cached" if debug_info.get("cache_hit") else "warmed")
+    return {
+        "status": "cached" if debug_info.get("cache_hit") else "warmed",
+        "documents": len(documents),
+        "retrieval_ms": debug_info.get("retrieval_ms")
+    }
+
+
 @app.get("/auth/verify")
 async def verify_auth(current_user: dict = Depends(verify_token)):
     """Verify if current token is valid"""
@@ -501,20 +1532,20 @@ async def debug_collections(current_user: dict = Depends(verify_token)):
         user_role = current_user["role"]
         accessible_collections = RBACManager.get_accessible_collections(user_role)
 
+        # Counts come from the background refresh rather than a count() per collection per request
+        counts = health_monitor.snapshot()
         collection_info = {}
         for collection_name in accessible_collections:
-            try:
-                collection = chroma_client.get_collection(collection_name)
-                count = collection.count()
+            if collection_name in counts:
                 collection_info[collection_name] = {
                     "exists": True,
-                    "document_count": count,
+                    "document_count": counts[collection_name],
                     "status": "accessible"
                 }
-            except Exception as e:
+            else:
                 collection_info[collection_name] = {
                     "exists": False,
-                    "error": str(e),
+                    "error": f"Collection {collection_name} not found at last refresh",
                     "status": "error"
                 }
 
@@ -522,32 +1553,133 @@ async def debug_collections(current_user: dict = Depends(verify_token)):
             "user_role": user_role.value,
             "accessible_collections": accessible_collections,
             "collection_details": collection_info,
-            "total_available_docs": sum(info.get("document_count", 0) for info in collection_info.values())
+            "total_available_docs": sum(info.get("document_count", 0) for info in collection_info.values()),
+            "counts_refreshed_at": health_monitor.refreshed_at
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Debug check failed: {str(e)}")
 
 
+def get_ingest_job(job_id: str):
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Ingestion job {job_id} not found")
+    return job
+
+
+@app.post("/ingest/jobs", status_code=202)
+async def create_ingest_job(job_request: IngestJobRequest, current_user: dict = Depends(require_ingest_role)):
+    """Queue an ingestion job for departments or files under data/"""
+    try:
+        job = ingest_jobs.submit(job_request.mode, job_request.departments, job_request.files)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    logger.info(f"{current_user['username']} queued {job.mode.value} ingestion job {job.id}")
+    return job.snapshot()
+
+
+@app.get("/ingest/jobs")
+async def list_ingest_jobs(current_user: dict = Depends(require_ingest_role)):
+    """Recent ingestion jobs, newest first"""
+    return {"jobs": [job.snapshot() for job in ingest_jobs.list()]}
+
+
+@app.get("/ingest/jobs/{job_id}")
+async def get_ingest_job_status(job_id: str, current_user: dict = Depends(require_ingest_role)):
+    """Current progress of one ingestion job"""
+    return get_ingest_job(job_id).snapshot()
+
+
+@app.get("/ingest/jobs/{job_id}/events")
+async def stream_ingest_job(job_id: str, current_user: dict = Depends(require_ingest_role)):
+    """Stream progress snapshots as NDJSON until the job finishes"""
+    job = get_ingest_job(job_id)
+
+    async def progress():
+        version = -1
+        while True:
+            if job.version != version:
+                version = job.version
+                yield json.dumps(job.snapshot()) + "\n"
+                if job.done:
+                    return
+            await asyncio.sleep(INGEST_PROGRESS_INTERVAL)
+
+    return StreamingResponse(progress(), media_type="application/x-ndjson")
+
+
+@app.post("/ingest/jobs/{job_id}/cancel")
+async def cancel_ingest_job(job_id: str, current_user: dict = Depends(require_ingest_role)):
+    """Ask a queued or running ingestion job to stop"""
+    get_ingest_job(job_id)
+    return ingest_jobs.cancel(job_id).snapshot()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus scrape endpoint with per-stage latency histograms"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/health/live")
+async def liveness():
+    """Liveness probe: the process is up and serving requests"""
+    return health_monitor.liveness()
+
+
+@app.get("/health/ready")
+async def readiness():
+    """Readiness probe from cached state; 503 until the index has been read"""
+    ready, body = health_monitor.readiness()
+    return JSONResponse(status_code=200 if ready else 503, content=body)
+
+
 @app.get("/health")
-async def health_check():
-    """Health check endpoint"""
+async def health_check(deep: bool = False):
+    """Health summary from cached state; deep=true also checks ChromaDB and OpenAI end to end"""
+    if not deep:
+        counts = health_monitor.snapshot()
+        ready, readiness_info = health_monitor.readiness()
+        body = {
+            "status": "healthy" if ready else "unhealthy",
+            "chroma_collections": len(counts),
+            "available_collections": list(counts),
+            "openai_embedding_dim": health_monitor.embedding_dim,
+            "min_confidence_threshold": rag_engine.min_confidence_threshold,
+            "upstream": readiness_info["upstream"],
+            "collections_refreshed_s_ago": readiness_info["collections_refreshed_s_ago"]
+        }
+        return JSONResponse(status_code=200 if ready else 503, content=body)
+
     try:
-        # Test ChromaDB connection
-        collections = chroma_client.list_collections()
+        # Test ChromaDB connection, refreshing the cached counts on the way
+        counts = await run_in_threadpool(health_monitor.refresh_collections)
 
         # Test OpenAI connection
-        test_embedding = client_oai.embeddings.create(
-            model=EMBEDDING_MODEL,
-            input=["test"]
+        test_embedding = await run_in_threadpool(
+            upstream.call,
+            lambda: client_oai.embeddings.create(
+                model=EMBEDDING_MODEL,
+                input=["test"],
+                **ingest_docs.embedding_options()
+            ),
+            priority=Priority.HEALTH,
+            estimated_tokens=1,
+            endpoint="embeddings"
         )
+        embedding_dim = len(ingest_docs.shorten_embeddings([test_embedding.data[0].embedding])[0])
+        health_monitor.record_embedding_dim(embedding_dim)
 
         return {
             "status": "healthy",
-            "chroma_collections": len(collections),
-            "available_collections": [c.name for c in collections],
-            "openai_embedding_dim": len(test_embedding.data[0].embedding),
-            "min_confidence_threshold": rag_engine.min_confidence_threshold
+            "chroma_collections": len(counts),
+            "available_collections": list(counts),
+            "openai_embedding_dim": embedding_dim,
+            "min_confidence_threshold": rag_engine.min_confidence_threshold,
+            "upstream_queue_depth": upstream.queue_depth()
         }
+    except UpstreamBusy:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Health check failed: {str(e)}")
 
@@ -0,0 +1,77 @@
+"""Parent sections for small-to-big retrieval.
+
+With the parent-child index (PARENT_CHILD_INDEX=1) ingestion embeds small
+child chunks and stores the section each one came from, its parent, once in
+a SQLite file next to the generation's Chroma files. Children carry the
+parent's id in their `parent_id` metadata; `generate_answer` swaps the hits
+for their parents and keeps each parent once, so matching is done on precise
+small chunks while the prompt gets whole sections.
+"""
+import json
+import logging
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PARENTS_FILE = "parents.sqlite3"
+
+Parent = Tuple[str, str, Dict]  # (id, content, metadata)
+
+
+class ParentStore:
+    """Parent sections of one index generation; ":memory:" keeps them in process (benchmarks)"""
+
+    def __init__(self, path: str = ":memory:"):
+        self.path = path
+        # Shared by the request threads and ingestion jobs; the lock serialises them
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            if path != ":memory:":
+                self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS parents ("
+                "id TEXT PRIMARY KEY, collection TEXT NOT NULL, source TEXT NOT NULL, "
+                "content TEXT NOT NULL, metadata TEXT NOT NULL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS parents_source ON parents (collection, source)")
+
+    def add(self, collection: str, parents: Iterable[Parent]):
+        rows = [(parent_id, collection, metadata.get("source", ""), content, json.dumps(metadata))
+                for parent_id, content, metadata in parents]
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO parents VALUES (?, ?, ?, ?, ?)", rows)
+
+    def replace_source(self, collection: str, source: str, parents: Iterable[Parent]):
+        """Swap one file's parents in a single transaction"""
+        rows = [(parent_id, collection, source, content, json.dumps(metadata))
+                for parent_id, content, metadata in parents]
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM parents WHERE collection = ? AND source = ?", (collection, source))
+            self._conn.executemany("INSERT OR REPLACE INTO parents VALUES (?, ?, ?, ?, ?)", rows)
+
+    def get_many(self, parent_ids: List[str]) -> Dict[str, str]:
+        """Content by id; ids that are not stored are left out"""
+        unique = list(dict.fromkeys(parent_ids))
+        if not unique:
+            return {}
+        placeholders = ",".join("?" * len(unique))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, content FROM parents WHERE id IN ({placeholders})", unique).fetchall()
+        return dict(rows)
+
+    def count(self, collection: Optional[str] = None) -> int:
+        with self._lock:
+            if collection is None:
+                return self._conn.execute("SELECT COUNT(*) FROM parents").fetchone()[0]
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM parents WHERE collection = ?", (collection,)).fetchone()[0]
+
+    def close(self):
+        try:
+            with self._lock:
+                self._conn.close()
+        except Exception as e:
+            logger.warning(f"Could not close parent store {self.path}: {e}")
@@ -0,0 +1,270 @@
+"""Pluggable text extraction for document formats beyond Markdown and CSV.
+
+A parser is a generator registered for one or more file extensions. It yields
+`Block`s as it reads the file (a page, a run of paragraphs, a batch of sheet
+rows), so large documents are never held in memory as a whole:
+
+* `text` blocks are Markdown-ish text (headings as `#`) and go through the
+  heading-aware Markdown chunker,
+* `table` blocks are rows of cells and go through the CSV row chunker.
+
+Parsers whose library is not installed stay registered and report the
+missing package, so a dropped-in PDF fails loudly instead of being ignored.
+
+    @register_parser(".txt")
+    def parse_text(path):
+        with open(path, encoding="utf-8") as f:
+            yield Block("text", f.read())
+"""
+import importlib.util
+import re
+from html.parser import HTMLParser
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Union
+
+TEXT_BATCH_CHARS = 20_000  # Flush paragraph text in blocks of about this size
+TABLE_BATCH_ROWS = 500  # Flush sheet rows in blocks of this many rows
+
+
+class Block(NamedTuple):
+    kind: str  # "text" or "table"
+    content: Union[str, List[List[str]]]
+    page: Optional[int] = None  # 1-based page or sheet number, when the format has one
+
+
+class Parser(NamedTuple):
+    name: str
+    extensions: tuple
+    parse: Callable[[str], Iterator[Block]]
+    requires: Optional[str] = None  # Importable module the parser needs
+
+    def missing_dependency(self) -> Optional[str]:
+        if self.requires and importlib.util.find_spec(self.requires) is None:
+            return self.requires
+        return None
+
+
+_REGISTRY: Dict[str, Parser] = {}
+
+
+def register_parser(*extensions: str, requires: Optional[str] = None, name: Optional[str] = None):
+    def decorator(fn):
+        parser = Parser(name or extensions[0].lstrip("."), extensions, fn, requires)
+        for extension in extensions:
+            _REGISTRY[extension.lower()] = parser
+        return fn
+    return decorator
+
+
+def get_parser(path: str) -> Optional[Parser]:
+    for extension, parser in _REGISTRY.items():
+        if path.lower().endswith(extension):
+            return parser
+    return None
+
+
+def registered_extensions() -> tuple:
+    return tuple(_REGISTRY)
+
+
+def table_lines(rows: List[List[str]], header: Optional[List[str]] = None) -> List[str]:
+    """One line per row; with a header each cell is labelled, so a row chunk stands on its own"""
+    lines = []
+    for row in rows:
+        cells = [str(cell).strip() for cell in row]
+        if header:
+            pairs = [f"{label}: {cell}" if label else cell for label, cell in zip(header, cells) if cell]
+            line = " | ".join(pairs)
+        else:
+            line = " | ".join(cell for cell in cells if cell)
+        if line:
+            lines.append(line)
+    return lines
+
+
+def looks_like_header(row: List[str]) -> bool:
+    # Same rule the CSV reader uses: plain word-only column names
+    cells = [str(cell) for cell in row if str(cell).strip()]
+    return bool(cells) and all(re.match(r'^\s*[\w\s]+\s*$', cell) and not re.match(r'^\s*[\d\s]+$', cell)
+                               for cell in cells)
+
+
+# =============================================================================
+# PDF
+# =============================================================================
+@register_parser(".pdf", requires="pypdf")
+def parse_pdf(path: str) -> Iterator[Block]:
+    from pypdf import PdfReader
+
+    # PdfReader loads page objects lazily, so only one page's content is decoded at a time
+    reader = PdfReader(path)
+    for number, page in enumerate(reader.pages, start=1):
+        text = page.extract_text() or ""
+        if text.strip():
+            yield Block("text", text, number)
+
+
+# =============================================================================
+# DOCX
+# =============================================================================
+@register_parser(".docx", requires="docx")
+def parse_docx(path: str) -> Iterator[Block]:
+    import docx
+    from docx.table import Table
+    from docx.text.paragraph import Paragraph
+
+    document = docx.Document(path)
+    buffer: List[str] = []
+    size = 0
+    # Walk the body in order so tables stay between the paragraphs around them
+    for element in document.element.body.iterchildren():
+        tag = element.tag.rsplit("}", 1)[-1]
+        if tag == "p":
+            paragraph = Paragraph(element, document)
+            text = paragraph.text.strip()
+            if not text:
+                continue
+            style = paragraph.style.name if paragraph.style is not None else ""
+            match = re.match(r"Heading (\d)", style)
+            if match:
+                text = "#" * int(match.group(1)) + " " + text
+            elif style == "Title":
+                text = "# " + text
+            buffer.append(text)
+            size += len(text)
+            if size >= TEXT_BATCH_CHARS:
+                yield Block("text", "\n\n".join(buffer))
+                buffer, size = [], 0
+        elif tag == "tbl":
+            if buffer:
+                yield Block("text", "\n\n".join(buffer))
+                buffer, size = [], 0
+            rows = [[cell.text for cell in row.cells] for row in Table(element, document).rows]
+            if rows:
+                yield Block("table", rows)
+    if buffer:
+        yield Block("text", "\n\n".join(buffer))
+
+
+# =============================================================================
+# HTML (standard library only)
+# =============================================================================
+class _HTMLBlocks(HTMLParser):
+    SKIP = {"script", "style", "noscript", "template", "head"}
+    BREAKS = {"p", "div", "section", "article", "li", "br", "tr", "blockquote", "pre", "ul", "ol"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.blocks: List[Block] = []
+        self._text: List[str] = []
+        self._size = 0
+        self._skip = 0
+        self._heading: Optional[int] = None
+        self._table: Optional[List[List[str]]] = None
+        self._row: Optional[List[str]] = None
+        self._cell: Optional[List[str]] = None
+
+    def _flush_text(self):
+        text = re.sub(r"\n{3,}", "\n\n", "".join(self._text)).strip()
+        if text:
+            self.blocks.append(Block("text", text))
+        self._text, self._size = [], 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self._skip += 1
+        elif self._skip:
+            return
+        elif tag == "table":
+            self._flush_text()
+            self._table = []
+        elif tag == "tr" and self._table is not None:
+            self._row = []
+        elif tag in ("td", "th") and self._row is not None:
+            self._cell = []
+        elif re.fullmatch(r"h[1-6]", tag):
+            self._heading = int(tag[1])
+            self._text.append("\n\n" + "#" * self._heading + " ")
+        elif tag in self.BREAKS:
+            self._text.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP:
+            self._skip = max(0, self._skip - 1)
+        elif self._skip:
+            return
+        elif tag in ("td", "th") and self._cell is not None:
+            self._row.append(" ".join("".join(self._cell).split()))
+            self._cell = None
+        elif tag == "tr" and self._row is not None:
+            if any(self._row):
+                self._table.append(self._row)
+            self._row = None
+        elif tag == "table" and self._table is not None:
+            if self._table:
+                self.blocks.append(Block("table", self._table))
+            self._table = None
+        elif re.fullmatch(r"h[1-6]", tag):
+            self._heading = None
+            self._text.append("\n\n")
+        elif tag in self.BREAKS:
+            self._text.append("\n")
+            if self._size >= TEXT_BATCH_CHARS and self._heading is None:
+                self._flush_text()
+
+    def handle_data(self, data):
+        if self._skip:
+            return
+        if self._cell is not None:
+            self._cell.append(data)
+        elif self._table is None:
+            text = " ".join(data.split()) if self._heading else re.sub(r"[ \t]+", " ", data)
+            self._text.append(text)
+            self._size += len(text)
+
+    def close(self):
+        super().close()
+        self._flush_text()
+
+
+@register_parser(".html", ".htm")
+def parse_html(path: str) -> Iterator[Block]:
+    parser = _HTMLBlocks()
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        # Feed in pieces and hand out finished blocks as they complete
+        for piece in iter(lambda: f.read(64 * 1024), ""):
+            parser.feed(piece)
+            yield from parser.blocks
+            parser.blocks = []
+    parser.close()
+    yield from parser.blocks
+
+
+# =============================================================================
+# XLSX
+# =============================================================================
+@register_parser(".xlsx", requires="openpyxl")
+def parse_xlsx(path: str) -> Iterator[Block]:
+    import openpyxl
+
+    # read_only mode streams rows from the sheet XML instead of building the whole workbook
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        for number, sheet in enumerate(workbook.worksheets, start=1):
+            header: Optional[List[str]] = None
+            rows: List[List[str]] = []
+            for values in sheet.iter_rows(values_only=True):
+                cells = ["" if value is None else str(value) for value in values]
+                if not any(cell.strip() for cell in cells):
+                    continue
+                if header is None and not rows and looks_like_header(cells):
+                    header = ["Sheet"] + cells
+                    continue
+                rows.append([sheet.title] + cells)
+                if len(rows) >= TABLE_BATCH_ROWS:
+                    # Every batch repeats the header so its rows can still be labelled
+                    yield Block("table", ([header] if header else []) + rows, number)
+                    rows = []
+            if rows:
+                yield Block("table", ([header] if header else []) + rows, number)
+    finally:
+        workbook.close()
@@ -0,0 +1,143 @@
+"""Fiscal periods, report types and entity tags for chunks and questions.
+
+Ingestion tags each chunk with the periods its document or section covers.
+The document period comes from the title or file name ("Comprehensive
+Marketing Report - Q4 2024", `marketing_report_q1_2024.md`). A section whose
+heading names a period ("Q2 - April to June 2024", "Recommendations for Q1
+2025") adds that period. Chroma 0.4 metadata cannot hold lists, so periods
+are stored as flags:
+
+    period_2024: 1         # about 2024
+    period_2024_q4: 1      # about Q4 2024
+    period_q4: 1           # about a Q4, for questions that give no year
+    period_2024_annual: 1  # about the whole of 2024 rather than one quarter
+    period_annual: 1       # about some whole year
+    period_any: 1          # about any period at all
+    period_none: 1         # undated (handbooks, architecture docs, HR records)
+
+`period_filter()` turns the periods a question names into a `where` clause
+that keeps on-period, whole-year and undated chunks, and drops only chunks
+explicitly about another period.
+"""
+import os
+import re
+from typing import Dict, List, Optional, Set, Tuple
+
+Period = Tuple[Optional[int], Optional[int]]  # (year, quarter); either may be unknown
+
+_YEAR_RE = re.compile(r"(?<![\d$.,])(20\d{2})(?![\d%])")
+_QUARTER_RE = re.compile(r"\bQ([1-4])\b", re.IGNORECASE)
+_ORDINAL_QUARTER_RE = re.compile(r"\b(first|second|third|fourth)\s+quarter\b", re.IGNORECASE)
+_ORDINALS = {"first": 1, "second": 2, "third": 3, "fourth": 4}
+# Headings that open a period's section, as opposed to ones that only mention a date
+_SECTION_PERIOD_RE = re.compile(r"^\s*(?:Q[1-4]\b|(?:first|second|third|fourth)\s+quarter\b|20\d{2}\b)"
+                                r"|\b(?:for|in|during)\s+(?:Q[1-4]\s+)?20\d{2}\b", re.IGNORECASE)
+
+# Regions and markets the reports break results down by
+ENTITIES = ("North America", "Latin America", "South America", "Europe", "Asia-Pacific", "APAC", "Asia",
+            "Middle East", "Africa", "India", "Brazil", "Germany", "UK", "United States")
+_ENTITY_RE = re.compile(r"\b(" + "|".join(re.escape(entity) for entity in ENTITIES) + r")\b", re.IGNORECASE)
+_ENTITY_NAMES = {entity.lower(): entity for entity in ENTITIES}
+
+
+def _quarters(text: str) -> Set[int]:
+    quarters = {int(q) for q in _QUARTER_RE.findall(text)}
+    quarters.update(_ORDINALS[word.lower()] for word in _ORDINAL_QUARTER_RE.findall(text))
+    return quarters
+
+
+def find_period(text: str) -> Period:
+    """The first year and quarter a title or heading names"""
+    text = text.replace("_", " ")
+    year = _YEAR_RE.search(text)
+    quarters = sorted(_quarters(text))
+    return (int(year.group(1)) if year else None), (quarters[0] if quarters else None)
+
+
+def question_periods(question: str) -> Tuple[Set[int], Set[int]]:
+    """Every year and quarter a question names"""
+    return {int(year) for year in _YEAR_RE.findall(question)}, _quarters(question)
+
+
+def document_period(title: str, source: str) -> Period:
+    year, quarter = find_period(title)
+    file_year, file_quarter = find_period(os.path.splitext(source)[0])
+    return year or file_year, quarter or file_quarter
+
+
+def section_periods(heading_path: str, document: Period) -> List[Period]:
+    """Periods one chunk is about: its document's, plus any named by its section headings"""
+    periods = [document]
+    for heading in heading_path.split(" > "):
+        if not _SECTION_PERIOD_RE.search(heading):
+            continue
+        period = find_period(heading)
+        period = (period[0] or document[0], period[1])
+        if periods == [document] and document[1] is None and period[0] == document[0]:
+            # A quarter's section of a yearly document is about that quarter only
+            periods = [period]
+        elif period not in periods:
+            periods.append(period)
+    return periods
+
+
+def period_flags(periods: List[Period]) -> Dict[str, int]:
+    flags = {}
+    for year, quarter in periods:
+        if year:
+            flags[f"period_{year}"] = 1
+        if quarter:
+            flags[f"period_q{quarter}"] = 1
+            if year:
+                flags[f"period_{year}_q{quarter}"] = 1
+        elif year:
+            flags[f"period_{year}_annual"] = 1
+            flags["period_annual"] = 1
+    return dict(flags, period_any=1) if flags else {"period_none": 1}
+
+
+def report_type(title: str, source: str, doc_type: str, period: Period) -> str:
+    text = f"{title} {source}".lower()
+    if doc_type == "csv":
+        return "records"
+    if "handbook" in text or "policy" in text:
+        return "handbook"
+    if period[1] or "quarterly" in text:
+        return "quarterly_report"
+    if "report" in text or "summary" in text:
+        return "annual_report" if period[0] else "report"
+    return "document"
+
+
+def find_entities(text: str) -> str:
+    """Regions and markets named in a chunk, ';'-joined (metadata values cannot be lists)"""
+    found = {_ENTITY_NAMES[match.lower()] for match in _ENTITY_RE.findall(text)}
+    return ";".join(sorted(found))
+
+
+def period_label(periods: List[Period]) -> str:
+    """Human-readable periods for sources and debug output, e.g. "Q4 2024, Q1 2025" """
+    labels = [" ".join(part for part in (f"Q{quarter}" if quarter else "", str(year) if year else "") if part)
+              for year, quarter in periods]
+    return ", ".join(label for label in labels if label)
+
+
+def in_period(metadata: Dict, where: Dict) -> bool:
+    """Whether a chunk's metadata passes a period_filter() clause, for filtering hits in Python"""
+    return any(metadata.get(flag) == 1 for clause in where["$or"] for flag in clause)
+
+
+def period_filter(question: str) -> Optional[Dict]:
+    """A `where` clause for the periods a question names, or None when it names none"""
+    years, quarters = question_periods(question)
+    if not years and not quarters:
+        return None
+    if years and quarters:
+        wanted = [f"period_{year}_q{quarter}" for year in sorted(years) for quarter in sorted(quarters)]
+        wanted.extend(f"period_{year}_annual" for year in sorted(years))
+    elif years:
+        wanted = [f"period_{year}" for year in sorted(years)]
+    else:
+        wanted = [f"period_q{quarter}" for quarter in sorted(quarters)] + ["period_annual"]
+    wanted.append("period_none")
+    return {"$or": [{flag: 1} for flag in wanted]}
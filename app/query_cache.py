@@ -0,0 +1,63 @@
+"""Short-lived caches for query embeddings and retrieval results.
+
+`/chat/prefetch` embeds a question and runs retrieval while the user is still
+typing; the results land here, so the submitted query skips both steps and
+goes straight to generation. Entries expire after `ttl` seconds and the least
+recently used ones are evicted past `max_entries`. Retrieval entries are keyed
+by index generation and version stamp, so hits never outlive an ingestion.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from app.telemetry import REGISTRY
+
+CACHE_HITS = REGISTRY.counter("finrag_query_cache_hits_total", "Query cache lookups that hit", ["cache"])
+CACHE_MISSES = REGISTRY.counter("finrag_query_cache_misses_total", "Query cache lookups that missed", ["cache"])
+
+
+class QueryCache:
+    """Thread-safe LRU with a TTL; a ttl of 0 disables it"""
+
+    def __init__(self, name: str, max_entries: int = 1024, ttl: float = 300.0):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_entries > 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                CACHE_HITS.inc(cache=self.name)
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+        CACHE_MISSES.inc(cache=self.name)
+        return None
+
+    def put(self, key: Hashable, value: Any):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
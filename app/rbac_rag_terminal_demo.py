@@ -1,11 +1,12 @@
 from app.auth import authenticate
 from app.rbac import get_collections_for_role
-from app.vector_store import search_collections
+from app.backend import search_collections
 
 def main():
     print("\n==== FinSolve RAG + RBAC Terminal Assistant ====\n")
     username = input("Enter your username: ").strip()
-    role = authenticate(username)
+    password = input("Enter your password: ").strip()
+    role = authenticate(username, password)
     if not role:
         print("Invalid user. Exiting.")
         return
@@ -0,0 +1,123 @@
+"""Query routing: rank a user's collections before searching them.
+
+Ingestion stores one centroid per source file, the normalised mean of that
+file's chunk embeddings, in `centroids.json` next to the generation's Chroma
+files. A collection scores the best cosine similarity between the query and
+its centroids, plus a boost for every keyword rule it matches. The router only
+ranks the collections it is given, which come from ROLE_COLLECTIONS: it can
+leave a collection out of a search, never add one.
+
+    ranked, selected, scores = router.route(question, embedding, allowed, centroids)
+    # search ranked[:selected]; ranked[selected:] only when those answer weakly
+"""
+import json
+import math
+import os
+import re
+import uuid
+from typing import Dict, List, Optional, Sequence, Tuple
+
+CENTROIDS_FILE = "centroids.json"
+PAGE_SIZE = 1000
+
+# Words that point at a collection whatever the embeddings say
+KEYWORD_RULES: Dict[str, Tuple[str, ...]] = {
+    "finance_docs": ("finance", "financial", "revenue", "expense", "expenses", "profit", "margin", "budget",
+                     "cash flow", "earnings", "income", "ebitda", "balance sheet", "vendor", "tax"),
+    "marketing_docs": ("marketing", "campaign", "campaigns", "roi", "brand", "customer acquisition", "cac",
+                       "conversion", "leads", "advertising", "market share", "social media", "channel"),
+    "hr_docs": ("salary", "salaries", "payroll", "performance rating", "attendance", "employee data",
+                "headcount", "department", "hiring", "joining date", "leave balance"),
+    "engineering_docs": ("engineering", "architecture", "api", "deployment", "infrastructure", "microservices",
+                         "kubernetes", "ci/cd", "disaster recovery", "availability", "latency", "platform",
+                         "security", "database"),
+    "general_docs": ("policy", "policies", "handbook", "holiday", "holidays", "leave", "benefits",
+                     "code of conduct", "values", "mission", "reimbursement", "work from home"),
+}
+KEYWORD_BOOST = 0.1  # Added to a collection's score per matched keyword
+
+
+def _normalise(vector: Sequence[float]) -> List[float]:
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+
+def collection_centroids(collection) -> List[List[float]]:
+    """Per-source centroids of one collection, read back from its stored embeddings"""
+    sums: Dict[str, List[float]] = {}
+    offset = 0
+    while True:
+        page = collection.get(include=["embeddings", "metadatas"], limit=PAGE_SIZE, offset=offset)
+        for embedding, metadata in zip(page["embeddings"], page["metadatas"]):
+            source = (metadata or {}).get("source", "")
+            total = sums.setdefault(source, [0.0] * len(embedding))
+            for i, x in enumerate(_normalise(embedding)):
+                total[i] += x
+        if len(page["ids"]) < PAGE_SIZE:
+            break
+        offset += PAGE_SIZE
+    return [_normalise(total) for _, total in sorted(sums.items())]
+
+
+def compute_centroids(client, names: Optional[List[str]] = None) -> Dict[str, List[List[float]]]:
+    names = names if names is not None else [c.name for c in client.list_collections()]
+    return {name: collection_centroids(client.get_collection(name)) for name in names}
+
+
+def load_centroids(directory: str) -> Optional[Dict[str, List[List[float]]]]:
+    try:
+        with open(os.path.join(directory, CENTROIDS_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_centroids(client, directory: str, names: Optional[List[str]] = None):
+    """Store the centroids of `names` (default: every collection), keeping the other collections' entries"""
+    centroids = (load_centroids(directory) or {}) if names is not None else {}
+    centroids.update(compute_centroids(client, names))
+    path = os.path.join(directory, CENTROIDS_FILE)
+    tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(centroids, f)
+    os.replace(tmp_path, path)
+
+
+class CollectionRouter:
+    """Ranks allowed collections by centroid similarity and keyword rules"""
+
+    def __init__(self, top_n: int = 2, min_margin: float = 0.05,
+                 keyword_rules: Dict[str, Tuple[str, ...]] = KEYWORD_RULES):
+        self.top_n = top_n
+        self.min_margin = min_margin
+        self._patterns = {
+            name: re.compile(r"\b(?:" + "|".join(re.escape(word) for word in words) + r")\b", re.IGNORECASE)
+            for name, words in keyword_rules.items()
+        }
+
+    def score(self, query: str, query_embedding: Sequence[float], name: str,
+              centroids: Dict[str, List[List[float]]]) -> float:
+        query_vector = _normalise(query_embedding)
+        similarity = max((sum(q * c for q, c in zip(query_vector, centroid))
+                          for centroid in centroids.get(name, ()) if len(centroid) == len(query_vector)),
+                         default=0.0)
+        pattern = self._patterns.get(name)
+        keywords = len(set(match.lower() for match in pattern.findall(query))) if pattern else 0
+        return similarity + KEYWORD_BOOST * keywords
+
+    def route(self, query: str, query_embedding: Sequence[float], allowed: List[str],
+              centroids: Dict[str, List[List[float]]]) -> Tuple[List[str], int, Dict[str, float]]:
+        """The allowed collections best first, how many of them to search, and their scores.
+
+        All of them are selected when there are no more than top_n, when the
+        best collection leads the first one left out by less than min_margin
+        (a flat ranking says little), or when no centroids are known.
+        """
+        scores = {name: round(self.score(query, query_embedding, name, centroids), 4) for name in allowed}
+        # Stable sort: ties keep the role's own order
+        ranked = sorted(allowed, key=lambda name: -scores[name])
+        selected = len(ranked)
+        if centroids and len(ranked) > self.top_n:
+            if scores[ranked[0]] - scores[ranked[self.top_n]] >= self.min_margin:
+                selected = self.top_n
+        return ranked, selected, scores
@@ -0,0 +1,206 @@
+"""Central scheduler for OpenAI calls.
+
+Every upstream call goes through `UpstreamScheduler.call`, which
+
+* keeps requests-per-minute and tokens-per-minute budgets as token buckets,
+* queues callers by priority (interactive chat before health checks before
+  speculative prefetches before batch jobs before ingestion) and caps how many
+  calls are in flight,
+* retries rate-limit, timeout and 5xx errors with full-jitter exponential
+  backoff, honouring Retry-After when the API sends it, and
+* sheds load by raising `UpstreamBusy` when the queue is too deep or a caller
+  waited too long, which the API turns into a fast 503.
+"""
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from enum import IntEnum
+from typing import Callable, Optional, TypeVar
+
+import openai
+
+from app.telemetry import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+QUEUE_DEPTH = REGISTRY.gauge(
+    "finrag_scheduler_queue_depth", "Upstream calls waiting for budget or a slot", ["priority"])
+INFLIGHT = REGISTRY.gauge("finrag_scheduler_inflight", "Upstream calls currently in flight")
+WAIT_SECONDS = REGISTRY.histogram(
+    "finrag_scheduler_wait_seconds", "Time upstream calls spent queued", ["priority"])
+REJECTED = REGISTRY.counter(
+    "finrag_scheduler_rejected_total", "Upstream calls shed by the scheduler", ["priority", "reason"])
+RETRIES = REGISTRY.counter(
+    "finrag_scheduler_retries_total", "Upstream calls retried after a transient error", ["endpoint", "error"])
+
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError,
+                    openai.InternalServerError)
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    HEALTH = 1
+    PREFETCH = 2
+    BATCH = 3
+    INGESTION = 4
+
+
+class UpstreamBusy(Exception):
+    """The upstream cannot take this call now; callers should answer 503"""
+
+    def __init__(self, reason: str, retry_after: float = 1.0):
+        super().__init__(f"Upstream busy: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _TokenBucket:
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` is available; requests larger than the bucket only need a full one"""
+        self._refill(now)
+        needed = min(amount, self.capacity) - self.level
+        return max(0.0, needed / self.rate) if self.rate else 0.0
+
+    def take(self, amount: float):
+        self.level -= amount
+
+
+class UpstreamScheduler:
+    def __init__(self, requests_per_minute: float = 500, tokens_per_minute: float = 200_000,
+                 max_concurrency: int = 16, max_queue_depth: int = 64, max_queue_wait: float = 10.0,
+                 max_retries: int = 3, base_backoff: float = 0.5, max_backoff: float = 8.0):
+        self.max_concurrency = max_concurrency
+        self.max_queue_depth = max_queue_depth
+        self.max_queue_wait = max_queue_wait
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._requests = _TokenBucket(requests_per_minute)
+        self._tokens = _TokenBucket(tokens_per_minute)
+        self._cond = threading.Condition()
+        self._waiters = []  # heap of (priority, sequence)
+        self._sequence = itertools.count()
+        self._active = 0
+        # Upstream state for the health probes
+        self.last_success_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.consecutive_failures = 0
+
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    def _update_depth_gauge(self):
+        for priority in Priority:
+            QUEUE_DEPTH.set(sum(1 for p, _ in self._waiters if p == priority), priority=priority.name.lower())
+
+    def _acquire(self, priority: Priority, tokens: int):
+        label = priority.name.lower()
+        start = time.monotonic()
+        deadline = start + self.max_queue_wait
+        with self._cond:
+            # Lower priorities get a smaller share of the queue so they are shed first
+            depth_limit = self.max_queue_depth // (1 + int(priority))
+            if len(self._waiters) >= depth_limit:
+                REJECTED.inc(priority=label, reason="queue_full")
+                raise UpstreamBusy("queue full")
+
+            ticket = (int(priority), next(self._sequence))
+            heapq.heappush(self._waiters, ticket)
+            self._update_depth_gauge()
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = None
+                    if self._waiters[0] == ticket and self._active < self.max_concurrency:
+                        wait = max(self._requests.wait_time(1, now), self._tokens.wait_time(tokens, now))
+                        if wait == 0:
+                            self._requests.take(1)
+                            self._tokens.take(tokens)
+                            self._active += 1
+                            heapq.heappop(self._waiters)
+                            INFLIGHT.set(self._active)
+                            break
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        REJECTED.inc(priority=label, reason="queue_timeout")
+                        raise UpstreamBusy("queue wait exceeded", retry_after=wait or 1.0)
+                    self._cond.wait(timeout=min(remaining, wait) if wait else remaining)
+            finally:
+                if ticket in self._waiters:
+                    self._waiters.remove(ticket)
+                    heapq.heapify(self._waiters)
+                self._update_depth_gauge()
+                # The head of the queue may have changed
+                self._cond.notify_all()
+        WAIT_SECONDS.observe(time.monotonic() - start, priority=label)
+
+    def _release(self, token_correction: int = 0):
+        with self._cond:
+            self._active -= 1
+            # Charge the budget for what the call really used, not the estimate
+            self._tokens.take(token_correction)
+            INFLIGHT.set(self._active)
+            self._cond.notify_all()
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        retry_after = None
+        response = getattr(error, "response", None)
+        if response is not None:
+            try:
+                retry_after = float(response.headers.get("retry-after"))
+            except (TypeError, ValueError):
+                retry_after = None
+        jittered = random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** attempt))
+        return max(jittered, retry_after or 0.0)
+
+    def call(self, fn: Callable[[], T], priority: Priority = Priority.INTERACTIVE, estimated_tokens: int = 0,
+             endpoint: str = "") -> T:
+        """Run fn() once budget and a slot are available, retrying transient upstream errors"""
+        for attempt in range(self.max_retries + 1):
+            self._acquire(priority, estimated_tokens)
+            correction = 0
+            try:
+                result = fn()
+                usage = getattr(result, "usage", None)
+                total_tokens = getattr(usage, "total_tokens", None)
+                if total_tokens is not None:
+                    correction = total_tokens - estimated_tokens
+                self.last_success_at = time.time()
+                self.consecutive_failures = 0
+                return result
+            except RETRYABLE_ERRORS as e:
+                error_name = type(e).__name__
+                self.last_error = f"{error_name}: {e}"
+                self.consecutive_failures += 1
+                if attempt == self.max_retries:
+                    if isinstance(e, openai.RateLimitError):
+                        REJECTED.inc(priority=priority.name.lower(), reason="rate_limited")
+                        raise UpstreamBusy("rate limited by OpenAI", retry_after=self._backoff(attempt, e)) from e
+                    raise
+                delay = self._backoff(attempt, e)
+                RETRIES.inc(endpoint=endpoint, error=error_name)
+                logger.warning(f"{endpoint} call failed with {error_name}, retry {attempt + 1} in {delay:.2f}s")
+            finally:
+                self._release(correction)
+            time.sleep(delay)
+        raise AssertionError("unreachable")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token) for budgeting"""
+    return len(text) // 4 + 1
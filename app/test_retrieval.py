@@ -3,8 +3,11 @@ import chromadb
 from chromadb.config import Settings
 from sentence_transformers import SentenceTransformer
 
+from app.index_store import current_generation_path
+
 # ---- Absolute Path for DB ----
-DB_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "chroma_db"))
+# Full ingestions write generations under chroma_db/generations; read the one CURRENT points at
+DB_PATH = current_generation_path(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "chroma_db")))
 
 chroma_client = chromadb.Client(Settings(
     persist_directory=DB_PATH,
@@ -0,0 +1,179 @@
+"""Watches data/<department>/ folders and reports changed documents in debounced batches.
+
+Uses watchdog (inotify, FSEvents, ...) when it is installed and falls back to
+polling the folders' mtimes otherwise. Events are debounced per file: a batch
+is reported once no file in it has changed for `debounce` seconds, so an
+editor's save-rename dance or a copy of many files becomes one batch. With
+watchdog the watcher sleeps until something happens; polling costs one
+scandir per department folder every `poll_interval` seconds. Only creations,
+modifications, deletions and moves count, and a file whose mtime and size
+are what they were when it was last reported is dropped from the batch, so
+ingestion reading a file (open/close events) does not re-trigger itself.
+
+The API feeds the batches into incremental ingestion jobs (WATCH_DATA=1).
+"""
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.telemetry import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+WATCH_EVENTS = REGISTRY.counter("finrag_watch_events_total", "Document change events seen by the data watcher")
+WATCH_BATCHES = REGISTRY.counter("finrag_watch_batches_total", "Debounced change batches sent to ingestion")
+
+Change = Tuple[str, str]  # (department, absolute path)
+Signature = Optional[Tuple[int, int]]  # (mtime_ns, size), None once the file is gone
+
+_CHANGE_EVENTS = ("created", "modified", "deleted", "moved")
+
+
+class DataWatcher:
+    def __init__(self, data_path: str, departments: List[str], extensions: Tuple[str, ...],
+                 on_changes: Callable[[List[Change]], None], debounce: float = 2.0,
+                 poll_interval: float = 2.0, use_watchdog: bool = True):
+        self.data_path = os.path.realpath(data_path)
+        self.departments = departments
+        self.extensions = extensions
+        self.on_changes = on_changes
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.use_watchdog = use_watchdog
+        self.backend: Optional[str] = None
+        self._pending: Dict[str, Tuple[str, float]] = {}  # path -> (department, last event)
+        self._reported: Dict[str, Signature] = {}  # path -> signature when last sent to ingestion
+        self._cond = threading.Condition()
+        self._stopped = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._observer = None
+
+    # ----- change intake -----
+    def _department_of(self, path: str) -> Optional[str]:
+        folder = os.path.dirname(path)
+        dept = os.path.basename(folder)
+        if os.path.dirname(folder) != self.data_path or dept not in self.departments:
+            return None
+        if not path.endswith(self.extensions):
+            return None  # Editor swap files, temp files, unsupported formats
+        return dept
+
+    def notify(self, path: str):
+        path = os.path.realpath(path)
+        dept = self._department_of(path)
+        if dept is None:
+            return
+        WATCH_EVENTS.inc()
+        with self._cond:
+            self._pending[path] = (dept, time.monotonic())
+            self._cond.notify()
+
+    # ----- debounce -----
+    def _flush_loop(self):
+        while not self._stopped.is_set():
+            with self._cond:
+                if not self._pending:
+                    self._cond.wait()
+                    continue
+                quiet_since = max(last for _, last in self._pending.values())
+                remaining = quiet_since + self.debounce - time.monotonic()
+                if remaining > 0:
+                    self._cond.wait(timeout=remaining)
+                    continue
+                pending = sorted((dept, path) for path, (dept, _) in self._pending.items())
+                self._pending.clear()
+            signatures = {path: self._signature(path) for _, path in pending}
+            batch = [(dept, path) for dept, path in pending if self._reported.get(path) != signatures[path]]
+            if not batch:
+                continue
+            WATCH_BATCHES.inc()
+            logger.info(f"Data watcher: {len(batch)} changed file(s)")
+            try:
+                self.on_changes(batch)
+            except Exception as e:
+                logger.error(f"Data watcher could not queue ingestion: {e}")
+                continue
+            for _, path in batch:
+                self._reported[path] = signatures[path]
+
+    # ----- backends -----
+    def _folders(self) -> List[str]:
+        return [os.path.join(self.data_path, dept) for dept in self.departments
+                if os.path.isdir(os.path.join(self.data_path, dept))]
+
+    @staticmethod
+    def _signature(path: str) -> Signature:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _scan(self) -> Dict[str, Tuple[int, int]]:
+        signatures = {}
+        for folder in self._folders():
+            try:
+                with os.scandir(folder) as entries:
+                    for entry in entries:
+                        if entry.is_file() and entry.name.endswith(self.extensions):
+                            stat = entry.stat()
+                            signatures[entry.path] = (stat.st_mtime_ns, stat.st_size)
+            except FileNotFoundError:
+                continue
+        return signatures
+
+    def _poll_loop(self):
+        previous = self._scan()
+        while not self._stopped.wait(self.poll_interval):
+            current = self._scan()
+            for path in set(previous) | set(current):
+                if previous.get(path) != current.get(path):
+                    self.notify(path)
+            previous = current
+
+    def _start_watchdog(self) -> bool:
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            return False
+
+        watcher = self
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                # Opened/closed events fire whenever ingestion reads a file
+                if event.is_directory or event.event_type not in _CHANGE_EVENTS:
+                    return
+                watcher.notify(event.src_path)
+                if getattr(event, "dest_path", None):
+                    watcher.notify(event.dest_path)
+
+        self._observer = Observer()
+        for folder in self._folders():
+            self._observer.schedule(Handler(), folder, recursive=False)
+        self._observer.daemon = True
+        self._observer.start()
+        return True
+
+    def start(self):
+        # Files as they are now are what the startup ingestion sees
+        self._reported = dict(self._scan())
+        if self.use_watchdog and self._start_watchdog():
+            self.backend = "watchdog"
+        else:
+            self.backend = "polling"
+            self._threads.append(threading.Thread(target=self._poll_loop, name="data-watcher-poll", daemon=True))
+        self._threads.append(threading.Thread(target=self._flush_loop, name="data-watcher-flush", daemon=True))
+        for thread in self._threads:
+            thread.start()
+        logger.info(f"Watching {len(self._folders())} department folders under {self.data_path} ({self.backend})")
+
+    def stop(self):
+        self._stopped.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._observer is not None:
+            self._observer.stop()
@@ -1,12 +1,21 @@
 import streamlit as st
 import requests
 import json
+import threading
+import uuid
 from typing import Optional
 from datetime import datetime
 import time
 
+try:
+    # Optional: reports the question while it is typed, which lets us prefetch (pip install streamlit-keyup)
+    from st_keyup import st_keyup
+except ImportError:
+    st_keyup = None
+
 # Configuration
 API_BASE_URL = "http://localhost:8000"
+PREFETCH_DEBOUNCE_MS = 400  # Pause in typing before the draft question is prefetched
 
 st.set_page_config(
     page_title="FinRAG Chatbot",
@@ -143,6 +152,9 @@ if 'user_info' not in st.session_state:
     st.session_state.user_info = None
 if 'chat_history' not in st.session_state:
     st.session_state.chat_history = []
+if 'conversation_id' not in st.session_state:
+    # Lets the backend read follow-ups ("and for Q3?") in the context of earlier questions
+    st.session_state.conversation_id = str(uuid.uuid4())
 if 'show_debug' not in st.session_state:
     st.session_state.show_debug = False
 
@@ -202,6 +214,7 @@ def logout():
     st.session_state.access_token = None
     st.session_state.user_info = None
     st.session_state.chat_history = []
+    st.session_state.conversation_id = str(uuid.uuid4())
 
 
 def send_query(question: str, max_results: int = 10):
@@ -209,7 +222,8 @@ def send_query(question: str, max_results: int = 10):
     data, error = make_api_request(
         "/chat/query",
         method="POST",
-        data={"question": question, "max_results": max_results},
+        data={"question": question, "max_results": max_results,
+              "conversation_id": st.session_state.conversation_id},
         auth_required=True
     )
 
@@ -219,6 +233,28 @@ def send_query(question: str, max_results: int = 10):
         return None, error
 
 
+def _post_quietly(url: str, data: dict, headers: dict):
+    try:
+        requests.post(url, json=data, headers=headers, timeout=10)
+    except requests.exceptions.RequestException:
+        pass  # Prefetching is best effort
+
+
+def prefetch_query(question: str, max_results: int = 10):
+    """Warm the backend's embedding and retrieval caches for the question being typed"""
+    if not question.strip() or question == st.session_state.get("prefetched_query"):
+        return
+    st.session_state.prefetched_query = question
+    headers = {"Content-Type": "application/json",
+               "Authorization": f"Bearer {st.session_state.access_token}"}
+    # Fire and forget, so typing never waits for the backend
+    threading.Thread(
+        target=_post_quietly,
+        args=(f"{API_BASE_URL}/chat/prefetch", {"question": question, "max_results": max_results}, headers),
+        daemon=True
+    ).start()
+
+
 def check_system_health():
 
     data, error = make_api_request("/health", auth_required=True)
@@ -434,12 +470,26 @@ else:
                 if st.button(question, key=f"sample_{i}", use_container_width=True):
                     st.session_state.current_query = question
 
-    query = st.text_area(
-        "Your Question:",
-        height=100,
-        placeholder="Type your question here... Be specific for better results!",
-        value=st.session_state.get('current_query', '')
-    )
+    if st_keyup is not None:
+        if 'current_query' in st.session_state:
+            # A fresh widget key makes the component start over from the sample question
+            st.session_state.question_widget = st.session_state.get('question_widget', 0) + 1
+        # Reruns on every pause in typing, so the backend can embed and search before submit
+        query = st_keyup(
+            "Your Question:",
+            placeholder="Type your question here... Be specific for better results!",
+            value=st.session_state.get('current_query', ''),
+            debounce=PREFETCH_DEBOUNCE_MS,
+            key=f"question_{st.session_state.get('question_widget', 0)}"
+        ) or ""
+        prefetch_query(query, max_results)
+    else:
+        query = st.text_area(
+            "Your Question:",
+            height=100,
+            placeholder="Type your question here... Be specific for better results!",
+            value=st.session_state.get('current_query', '')
+        )
 
     if 'current_query' in st.session_state:
         del st.session_state.current_query
@@ -551,6 +601,8 @@ else:
         with col2:
             if st.button("🗑️ Clear History"):
                 st.session_state.chat_history = []
+                # Start a new conversation, so follow-ups stop referring to the cleared questions
+                st.session_state.conversation_id = str(uuid.uuid4())
                 st.rerun()
 
 